@@ -0,0 +1,83 @@
+"""Async access to MongoDB for the ASGI entry point.
+
+``MotorStore`` talks to MongoDB through Motor's asyncio driver.
+``ThreadedStore`` runs a synchronous database object (PyMongo or mongomock)
+in worker threads, as a stand-in for tests and local runs without a
+server. Both return plain lists so the views can ``asyncio.gather`` them.
+"""
+import asyncio
+from itertools import chain
+from pagination import LIST_FIELDS, page_from_docs
+from rollups import GRANULARITIES, SUMMARY_FIELDS, summary_from_docs
+from summary import FACETS
+
+
+class AsyncStore:
+    async def find(self, collection, query, projection=None, sort=None, limit=0):
+        raise NotImplementedError
+
+    async def find_one(self, collection, query):
+        raise NotImplementedError
+
+    async def aggregate(self, collection, pipeline):
+        raise NotImplementedError
+
+
+class MotorStore(AsyncStore):
+    def __init__(self, uri, db_name, **options):
+        from motor.motor_asyncio import AsyncIOMotorClient
+        self.client = AsyncIOMotorClient(uri, **options)
+        self.db = self.client[db_name]
+
+    async def find(self, collection, query, projection=None, sort=None, limit=0):
+        cursor = self.db[collection].find(query, projection, limit=limit)
+        if sort:
+            cursor = cursor.sort(sort)
+        return await cursor.to_list(None)
+
+    async def find_one(self, collection, query):
+        return await self.db[collection].find_one(query)
+
+    async def aggregate(self, collection, pipeline):
+        return await self.db[collection].aggregate(pipeline).to_list(None)
+
+
+class ThreadedStore(AsyncStore):
+    def __init__(self, db):
+        self.db = db
+
+    async def find(self, collection, query, projection=None, sort=None, limit=0):
+        def run():
+            cursor = self.db[collection].find(query, projection, limit=limit)
+            return list(cursor.sort(sort) if sort else cursor)
+        return await asyncio.to_thread(run)
+
+    async def find_one(self, collection, query):
+        return await asyncio.to_thread(self.db[collection].find_one, query)
+
+    async def aggregate(self, collection, pipeline):
+        return await asyncio.to_thread(lambda: list(self.db[collection].aggregate(pipeline)))
+
+
+async def read_summary(store, user_id):
+    """Async rollups.read_summary: the three granularities are read concurrently."""
+    results = await asyncio.gather(*(
+        store.find('spending_rollups', {'user_id': user_id, 'granularity': granularity, 'count': {'$gt': 0}},
+                   SUMMARY_FIELDS)
+        for granularity in GRANULARITIES
+    ))
+    return summary_from_docs(chain.from_iterable(results))
+
+
+async def period_categories(store, match):
+    """Async ``summarize(..., facets=('categories',))['categories']``."""
+    categories = await store.aggregate('transactions', [{'$match': match}] + FACETS['categories'])
+    for row in categories:
+        row['total'] = round(row['total']) / 100
+    return categories
+
+
+async def first_page(store, match, page_size):
+    """Async ``pagination.fetch_page`` without a cursor: the newest ``page_size`` transactions."""
+    docs = await store.find('transactions', match, LIST_FIELDS, sort=[('date', -1), ('_id', -1)], limit=page_size + 1)
+    return page_from_docs(docs, page_size)
@@ -0,0 +1,138 @@
+"""Rolling and comparative spending analytics over NumPy columns.
+
+``load_columns`` reads a user's date, amount and category once, with a
+projection and a batched cursor, into three arrays. Every figure after that
+is computed with array operations (``bincount`` for grouping, cumulative
+sums for moving averages, a closed-form least-squares slope for trends), so
+the cost beyond the read is a few passes over the arrays even for 100k+
+transactions.
+"""
+from collections import namedtuple
+from datetime import datetime
+import numpy as np
+from schema import parse_date, to_cents
+
+Columns = namedtuple('Columns', 'days cents categories names')
+
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+PROJECTION = {'_id': 0, 'date': 1, 'amount': 1, 'amount_cents': 1, 'category': 1}
+
+
+def to_columns(docs):
+    """Build ``Columns`` from transaction documents.
+
+    ``days`` is ``datetime64[D]``, ``cents`` int64 and ``categories`` holds
+    indexes into ``names``.
+    """
+    dates, cents, codes, names = [], [], [], {}
+    for doc in docs:
+        date, amount = doc.get('date'), doc.get('amount_cents')
+        if date is None or (amount is None and doc.get('amount') is None):
+            continue
+        dates.append((date if isinstance(date, datetime) else parse_date(date)).toordinal())
+        cents.append(amount if amount is not None else to_cents(doc['amount']))
+        codes.append(names.setdefault(doc.get('category') or '', len(names)))
+    # Converting ordinals is far cheaper than letting NumPy parse datetime objects
+    days = (np.array(dates, dtype=np.int64) - EPOCH_ORDINAL).astype('datetime64[D]')
+    return Columns(days, np.array(cents, dtype=np.int64),
+                   np.array(codes, dtype=np.int64), list(names))
+
+
+def load_columns(transactions, user_id, batch_size=5000):
+    return to_columns(transactions.find({'user_id': user_id}, PROJECTION, batch_size=batch_size))
+
+
+def daily_totals(columns, start, days):
+    """Cents spent on each of ``days`` days from ``start`` (a ``datetime64[D]``)."""
+    offsets = (columns.days - start).astype(np.int64)
+    inside = (offsets >= 0) & (offsets < days)
+    return np.bincount(offsets[inside], weights=columns.cents[inside], minlength=days)
+
+
+def rolling_mean(series, window):
+    """Trailing mean over ``window`` points; the first points average what is available."""
+    sums = np.cumsum(series, dtype=np.float64)
+    sums[window:] = sums[window:] - sums[:-window]
+    return sums / np.minimum(np.arange(1, len(series) + 1), window)
+
+
+def month_index(days):
+    """Months since 1970-01 of ``datetime64`` values."""
+    return days.astype('datetime64[M]').astype(np.int64)
+
+
+def monthly_matrix(columns, first_month, months):
+    """``(len(names), months)`` array of cents per category and month, from ``first_month``."""
+    offsets = month_index(columns.days) - first_month
+    inside = (offsets >= 0) & (offsets < months)
+    width = len(columns.names)
+    flat = np.bincount(columns.categories[inside] * months + offsets[inside],
+                       weights=columns.cents[inside], minlength=width * months)
+    return flat.reshape(width, months)
+
+
+def trend_slopes(matrix):
+    """Least-squares slope of every row against its column index (change per month)."""
+    x = np.arange(matrix.shape[1], dtype=np.float64)
+    x -= x.mean()
+    denominator = (x ** 2).sum()
+    if not denominator:
+        return np.zeros(matrix.shape[0])
+    return (matrix - matrix.mean(axis=1, keepdims=True)) @ x / denominator
+
+
+def month_label(index):
+    return f'{1970 + index // 12}-{index % 12 + 1:02d}'
+
+
+def analyze(columns, today, days=90, months=12, top=5, trend_months=6):
+    """All analytics for one user's columns, in dollars and ready for JSON."""
+    today = np.datetime64(today.date() if isinstance(today, datetime) else today, 'D')
+    start = today - (days - 1)
+    daily = daily_totals(columns, start, days) / 100
+    this_month = int(month_index(today))
+
+    matrix = monthly_matrix(columns, this_month - months + 1, months)
+    totals = matrix.sum(axis=0) / 100
+    changes = np.diff(totals, prepend=np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change_pct = np.where(np.roll(totals, 1) > 0, changes / np.roll(totals, 1) * 100, np.nan)
+
+    by_category = np.bincount(columns.categories, weights=columns.cents, minlength=len(columns.names)) / 100
+    order = np.argsort(-by_category, kind='stable')[:top]
+    grand_total = by_category.sum()
+
+    recent = matrix[:, -trend_months:] / 100
+    slopes = trend_slopes(recent)
+    return {
+        'as_of': str(today),
+        'transaction_count': int(len(columns.cents)),
+        'rolling': {
+            'dates': [str(day) for day in np.arange(start, today + 1)],
+            'daily': _rounded(daily),
+            'avg_7': _rounded(rolling_mean(daily, 7)),
+            'avg_30': _rounded(rolling_mean(daily, 30)),
+        },
+        'months': [
+            {'month': month_label(this_month - months + 1 + index), 'total': round(float(totals[index]), 2),
+             'change': _number(changes[index]), 'change_pct': _number(change_pct[index])}
+            for index in range(months)
+        ],
+        'top_categories': [
+            {'category': columns.names[index], 'total': round(float(by_category[index]), 2),
+             'share': round(float(by_category[index] / grand_total * 100), 2) if grand_total else 0.0}
+            for index in order if by_category[index]
+        ],
+        'trends': sorted(
+            ({'category': name, 'monthly': _rounded(recent[index]), 'slope': round(float(slopes[index]), 2)}
+             for index, name in enumerate(columns.names) if recent[index].any()),
+            key=lambda row: row['slope'], reverse=True),
+    }
+
+
+def _rounded(values):
+    return [round(float(value), 2) for value in values]
+
+
+def _number(value):
+    return None if np.isnan(value) else round(float(value), 2)
@@ -0,0 +1,89 @@
+"""Request parsing and serialisation for the JSON transactions API.
+
+The routes themselves live in app.py with the other views; these helpers
+turn request bodies into validated documents and documents into JSON, so
+batch operations can be sent to MongoDB in single ``insert_many``,
+``bulk_write`` and ``delete_many`` calls (batch edits and deletes first
+claim their documents with one ``update_many``, see ``storage``).
+"""
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from exporter import export_row
+from importer import FIELDS, parse_row
+from schema import to_view
+
+MAX_BATCH = 500
+
+
+class ApiError(ValueError):
+    """A request body that cannot be processed; ``errors`` holds per-item messages."""
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+def serialize(transaction):
+    """JSON representation of a stored transaction (amounts as exact decimal strings)."""
+    return {'id': str(transaction['_id']), **export_row(transaction)}
+
+
+def _as_list(payload, what):
+    items = payload if isinstance(payload, list) else [payload]
+    if not items or len(items) > MAX_BATCH:
+        raise ApiError(f'Send between 1 and {MAX_BATCH} {what}.')
+    return items
+
+
+def parse_ids(values):
+    """Convert a list of id strings to ObjectIds."""
+    if not isinstance(values, list):
+        raise ApiError('"ids" must be a list.')
+    values = _as_list(values, 'ids')
+    try:
+        return [ObjectId(value) for value in values]
+    except (InvalidId, TypeError):
+        raise ApiError('Invalid transaction id.')
+
+
+def parse_creates(payload, user_id):
+    """Validate one transaction object or a list of them into documents to insert."""
+    docs, errors = [], []
+    for index, item in enumerate(_as_list(payload, 'transactions')):
+        try:
+            doc = parse_row(item if isinstance(item, dict) else None)
+        except (ValueError, TypeError) as error:
+            errors.append(f'item {index}: {error}')
+            continue
+        doc['user_id'] = user_id
+        docs.append(doc)
+    if errors:
+        raise ApiError('Invalid transactions.', errors)
+    return docs
+
+
+def parse_updates(payload):
+    """Validate a list of ``{"id": ..., <fields>}`` objects into ``{ObjectId: changes}``."""
+    updates, errors = {}, []
+    for index, item in enumerate(_as_list(payload, 'updates')):
+        if not isinstance(item, dict) or 'id' not in item:
+            errors.append(f'item {index}: missing id')
+            continue
+        unknown = set(item) - set(FIELDS) - {'id'}
+        if unknown:
+            errors.append(f'item {index}: unknown fields ' + ', '.join(sorted(unknown)))
+            continue
+        try:
+            updates[ObjectId(item['id'])] = {field: item[field] for field in FIELDS if field in item}
+        except (InvalidId, TypeError):
+            errors.append(f'item {index}: invalid id')
+    if errors:
+        raise ApiError('Invalid updates.', errors)
+    return updates
+
+
+def merge_update(transaction, changes):
+    """Return the typed fields of ``transaction`` with ``changes`` applied; raises ValueError."""
+    current = to_view(transaction)
+    row = {field: changes.get(field, current.get(field)) for field in FIELDS}
+    return parse_row(row)
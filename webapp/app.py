@@ -1,10 +1,36 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, Response, render_template, stream_template, stream_with_context, request, redirect, url_for, flash, get_flashed_messages, session, jsonify, abort
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_bcrypt import Bcrypt
 from pymongo import MongoClient, DESCENDING
+from pymongo.errors import BulkWriteError, PyMongoError
 from bson.objectid import ObjectId
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
+from rollups import apply_change, apply_changes, apply_inserts, read_summary, rebuild_rollups
+from summary import period_bounds, period_match, range_bounds, shift_years, summarize
+from analytics import analyze, load_columns
+from filters import NO_FILTERS, apply_filters, filter_args, is_filtered, parse_filters
+from recurring import FREQUENCIES, RecurringScheduler, SchedulerLease, materialize_due, new_template
+from budgets import check_budget, load_budgets, month_report, set_budget
+from daily import apply_daily_changes, apply_daily_inserts, check_daily, range_summary, rebuild_daily
+from schema import to_cents, transaction_fields, to_view
+from migration import migrate_transactions
+from indexes import ensure_indexes, check_query_plans
+from pagination import LIST_FIELDS, fetch_page
+from cache import MISSING, LRUCache, RedisCache, SummaryCache
+from importer import FORMATS, detect_format, import_transactions
+from exporter import FORMATS as EXPORT_FORMATS, export_chunks
+from metrics import RequestMetrics
+from profiler import RequestProfiler
+from hashing import HasherBusy, PasswordHasher
+from writebehind import WriteBehindQueue
+from events import ChangeFeed, event_stream
+from storage import MongoRepository
+from api import ApiError, merge_update, parse_creates, parse_ids, parse_updates, serialize
+from functools import wraps
+import atexit
+import codecs
+import click
 import os
 import certifi
 
@@ -13,39 +39,293 @@ load_dotenv()
 
 app = Flask(__name__, template_folder='./templates')
 app.secret_key = os.getenv('SECRET_KEY', 'a_very_secret_fallback_key')
+app.config['PAGE_SIZE'] = int(os.getenv('PAGE_SIZE', 50))
+app.config['MAX_PAGE_SIZE'] = int(os.getenv('MAX_PAGE_SIZE', 200))
+# Stream the rendered listing pages to the client instead of sending them whole
+app.config['STREAM_TEMPLATES'] = os.getenv('STREAM_TEMPLATES', '0') == '1'
+# Documents per batch of the cursor an export streams from
+app.config['STREAM_BATCH_SIZE'] = int(os.getenv('STREAM_BATCH_SIZE', 100))
+
+# Per-route latency and MongoDB metrics for /metrics; requests slower than
+# SLOW_REQUEST_MS are logged along with the commands they ran
+app.config['SLOW_REQUEST_MS'] = int(os.getenv('SLOW_REQUEST_MS', 0)) or None
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+# Under several gunicorn workers, METRICS_MULTIPROC_DIR lets /metrics report all of them
+request_metrics = RequestMetrics(slow_threshold=app.config['SLOW_REQUEST_MS'] and app.config['SLOW_REQUEST_MS'] / 1000,
+                                 multiprocess_dir=os.getenv('METRICS_MULTIPROC_DIR'))
+request_metrics.init_app(app)
 
 # MongoDB setup
 mongo_uri = os.getenv("MONGO_URI")
-client = MongoClient(mongo_uri, tlsCAFile=certifi.where())
+
+# Optional pool settings: environment variable -> MongoClient option
+POOL_TIMEOUTS = {
+    'MONGO_MAX_IDLE_TIME_MS': 'maxIdleTimeMS',
+    'MONGO_CONNECT_TIMEOUT_MS': 'connectTimeoutMS',
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': 'serverSelectionTimeoutMS',
+    'MONGO_WAIT_QUEUE_TIMEOUT_MS': 'waitQueueTimeoutMS',
+}
+
+def mongo_client_options():
+    # connect=False defers the pool and its monitor threads to the first
+    # operation, so a client created before a fork is never shared by workers
+    options = dict(tlsCAFile=certifi.where(), connect=False, event_listeners=[request_metrics],
+                   maxPoolSize=int(os.getenv('MONGO_MAX_POOL_SIZE', 100)),
+                   minPoolSize=int(os.getenv('MONGO_MIN_POOL_SIZE', 0)))
+    for variable, option in POOL_TIMEOUTS.items():
+        if os.getenv(variable):
+            options[option] = int(os.getenv(variable))
+    return options
+
+mongo_options = mongo_client_options()
+client = MongoClient(mongo_uri, **mongo_options)
 db = client['BudgetTracker']
 users = db.users
 transactions = db.transactions
+spending_rollups = db.spending_rollups
+spending_daily = db.spending_daily
+recurring = db.recurring
+# User lookup and single-transaction reads and writes (see storage.py)
+repository = MongoRepository(db)
+
+def warm_up_pool():
+    """Open the connection pool (up to minPoolSize) before the first request arrives."""
+    client.admin.command('ping')
+
+# Indexes are created once per process, on the first request rather than at
+# import time so CLI commands and imports don't need a reachable database
+app.config['ENSURE_INDEXES'] = os.getenv('ENSURE_INDEXES', '1') == '1'
+indexes_ready = False
+
+@app.before_request
+def ensure_indexes_once():
+    global indexes_ready
+    if app.config['ENSURE_INDEXES'] and not indexes_ready:
+        indexes_ready = True
+        try:
+            ensure_indexes(db)
+        except PyMongoError:
+            # Serve requests anyway; `flask ensure-indexes` reports the problem
+            app.logger.exception('Could not create indexes')
+
+# Summary cache, in process by default or in Redis with CACHE_BACKEND=redis
+def make_cache_backend():
+    ttl = int(os.getenv('CACHE_TTL', 300))
+    if os.getenv('CACHE_BACKEND', 'memory') == 'redis':
+        import redis
+        return RedisCache(redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0')), ttl=ttl)
+    return LRUCache(max_entries=int(os.getenv('CACHE_MAX_ENTRIES', 1024)), ttl=ttl,
+                    max_bytes=int(os.getenv('CACHE_MAX_BYTES', 64 * 1024 * 1024)))
+
+summary_cache = SummaryCache(make_cache_backend())
+
+def record_change(user_id, old=None, new=None):
+    """Bring the data derived from transactions in line with one insert, edit or delete."""
+    apply_change(spending_rollups, user_id, old=old, new=new)
+    apply_daily_changes(spending_daily, user_id, [(old, new)])
+    summary_cache.invalidate(user_id, old, new)
+
+def record_changes(user_id, changes):
+    """Same as record_change for a batch of ``(old, new)`` pairs."""
+    apply_changes(spending_rollups, user_id, changes)
+    apply_daily_changes(spending_daily, user_id, changes)
+    summary_cache.invalidate(user_id, *(t for change in changes for t in change))
+
+def record_inserts(user_id, inserted):
+    """Same as record_change for a batch of new transactions."""
+    apply_inserts(spending_rollups, user_id, inserted)
+    apply_daily_inserts(spending_daily, user_id, inserted)
+    summary_cache.invalidate(user_id, *inserted)
+
+def record_inserts_by_user(inserted):
+    by_user = {}
+    for doc in inserted:
+        by_user.setdefault(doc['user_id'], []).append(doc)
+    for user_id, docs in by_user.items():
+        record_inserts(user_id, docs)
+
+def insert_queued(docs):
+    """Write one write-behind batch, of any users, with a single insert_many."""
+    try:
+        transactions.insert_many(docs, ordered=False)
+    except BulkWriteError as error:
+        failed = {write_error['index'] for write_error in error.details['writeErrors']}
+        record_inserts_by_user([doc for index, doc in enumerate(docs) if index not in failed])
+        raise
+    record_inserts_by_user(docs)
+
+# Write-behind batching of added transactions (see writebehind.py): 'off' inserts
+# on the request, 'ack' waits for the batch that writes the transaction and
+# 'async' returns before it is written
+def write_behind_mode():
+    mode = os.getenv('WRITE_BEHIND', 'off')
+    if mode == 'async' and int(os.getenv('WEB_CONCURRENCY', 1)) > 1:
+        # The queue is per process: the user's next request may reach a worker
+        # that can't wait for it, and miss the transactions they just added
+        app.logger.warning('WRITE_BEHIND=async needs a single worker; using ack with %s workers',
+                           os.getenv('WEB_CONCURRENCY'))
+        return 'ack'
+    return mode
+
+app.config['WRITE_BEHIND'] = write_behind_mode()
+write_queue = WriteBehindQueue(insert_queued,
+                               max_batch=int(os.getenv('WRITE_BEHIND_BATCH', 100)),
+                               max_delay=int(os.getenv('WRITE_BEHIND_DELAY_MS', 50)) / 1000,
+                               max_pending=int(os.getenv('WRITE_BEHIND_MAX_PENDING', 10000)))
+atexit.register(write_queue.close, 10)
+# Routes that queue writes; any other request of the user first waits for them
+QUEUED_ENDPOINTS = {'add_transaction', 'api_create_transactions'}
+
+def queue_transactions(docs):
+    write_queue.submit(docs, wait=app.config['WRITE_BEHIND'] == 'ack')
+
+@app.before_request
+def sync_queued_writes():
+    # Read-your-writes: pages, edits and deletes see every transaction the user added
+    if app.config['WRITE_BEHIND'] != 'off' and request.endpoint not in QUEUED_ENDPOINTS \
+            and current_user.is_authenticated:
+        write_queue.sync(current_user.id)
+
+def materialize_recurring(now=None):
+    """Insert the due occurrences of every recurring template, catching up on missed ones."""
+    return materialize_due(recurring, transactions, now=now, on_inserted=record_inserts)
+
+# Recurring occurrences are materialized by a background thread in the web
+# processes (RECURRING_SCHEDULER=thread), or by `flask materialize-recurring
+# --every N` in a process of its own (RECURRING_SCHEDULER=off here). Either
+# way the schedulers share a lease, so only one of them runs at a time.
+app.config['RECURRING_SCHEDULER'] = os.getenv('RECURRING_SCHEDULER', 'thread')
+app.config['RECURRING_INTERVAL'] = int(os.getenv('RECURRING_INTERVAL', 60))
+
+def recurring_lease(interval):
+    # Outlives a couple of missed renewals before another process takes over
+    return SchedulerLease(db.locks, ttl=3 * interval)
+
+recurring_scheduler = RecurringScheduler(materialize_recurring, interval=app.config['RECURRING_INTERVAL'],
+                                         lease=recurring_lease(app.config['RECURRING_INTERVAL']))
+
+@app.before_request
+def start_recurring_scheduler():
+    # Started from the first request, i.e. after gunicorn has forked the worker
+    if app.config['RECURRING_SCHEDULER'] == 'thread' and not app.testing:
+        recurring_scheduler.start()
 
 # Flask-Login setup
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
-# Flask-Bcrypt setup
+# Flask-Bcrypt setup. Hashes run on a bounded pool (see hashing.py) so login
+# bursts can't take every CPU; logins past its queue get a 503.
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
 bcrypt = Bcrypt(app)
+password_hasher = PasswordHasher(bcrypt, app.config['BCRYPT_LOG_ROUNDS'],
+                                 workers=int(os.getenv('PASSWORD_HASH_WORKERS', 2)),
+                                 max_pending=int(os.getenv('PASSWORD_HASH_QUEUE', 16)),
+                                 metrics=request_metrics)
+
+@app.errorhandler(HasherBusy)
+def hasher_busy(error):
+    flash('The server is busy, please try again in a moment.', 'error')
+    template = 'register.html' if request.endpoint == 'register' else 'login.html'
+    return render_template(template), 503, {'Retry-After': '1'}
 
 class User(UserMixin):
     def __init__(self, user_id, username):
         self.id = str(user_id)
         self.username = username
 
+# Users loaded for authenticated requests, so a page view doesn't start with a users lookup
+user_cache = LRUCache(max_entries=int(os.getenv('USER_CACHE_MAX_ENTRIES', 4096)),
+                      ttl=int(os.getenv('USER_CACHE_TTL', 300)))
+
 @login_manager.user_loader
 def load_user(user_id):
-    user = users.find_one({"_id": ObjectId(user_id)})
+    cached = user_cache.get(user_id)
+    if cached is not MISSING:
+        return cached
+    user = repository.get_user(user_id)
     if user:
-        return User(str(user['_id']), user['username'])
+        user_obj = User(str(user['_id']), user['username'])
+        user_cache.set(user_id, user_obj)
+        return user_obj
     return None
 
+def forget_user(user_id):
+    """Drop a cached user after logout or a change to their record."""
+    user_cache.delete(str(user_id))
+
+# Opt-in cProfile runs of the summary routes: a PROFILE_SAMPLE_RATE fraction of
+# requests, or any request an admin sends with an `X-Profile: 1` header
+app.config['ADMIN_USERNAMES'] = set(filter(None, os.getenv('ADMIN_USERNAMES', '').split(',')))
+request_profiler = RequestProfiler(
+    os.getenv('PROFILE_DIR', 'profiles'),
+    os.getenv('PROFILE_ENDPOINTS', 'spending_summary,detailed_spending_summary').split(','),
+    sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', 0)),
+    is_admin=lambda: current_user.is_authenticated and current_user.username in app.config['ADMIN_USERNAMES'],
+    user_id=lambda: current_user.get_id(),
+)
+request_profiler.init_app(app)
+
 @app.route('/')
 @login_required
 def home():
-    user_transactions = transactions.find({'user_id': current_user.id})
-    return render_template('home.html', transactions=list(user_transactions))
+    filters, custom_range = request_filters(), request_range()
+    start, end = custom_range[:2] if custom_range else (None, None)
+    page = request_page(apply_filters(period_match(current_user.id, start, end), filters))
+    return render_listing('home.html', page.items, page=page, query_args=page_args(),
+                          filtered=is_filtered(filters) or custom_range is not None)
+
+def request_page(match):
+    """The page of ``match`` selected by the request's ``after``/``before`` cursor and ``size``."""
+    page_size = min(request.args.get('size', app.config['PAGE_SIZE'], type=int), app.config['MAX_PAGE_SIZE'])
+    try:
+        return fetch_page(transactions, match, max(page_size, 1),
+                          after=request.args.get('after'), before=request.args.get('before'))
+    except ValueError:
+        abort(400)
+
+def page_args():
+    # Page links keep the search, period and size, only the cursor changes
+    return {key: value for key, value in request.args.items() if key not in ('after', 'before')}
+
+def request_filters():
+    """The search filters of the request; invalid ones are flashed and ignored."""
+    try:
+        return parse_filters(request.args)
+    except ValueError:
+        flash('Invalid search filters.')
+        return NO_FILTERS
+
+def request_range():
+    """The request's custom date range as ``(start, end, label)``, or None."""
+    try:
+        return range_bounds(request.args, datetime.now())
+    except ValueError:
+        flash('Invalid date range.')
+        return None
+
+# The query args that select a custom range (see summary.range_bounds)
+RANGE_ARGS = ('start', 'end', 'range', 'year', 'quarter')
+
+def range_args():
+    return {key: request.args[key] for key in RANGE_ARGS if request.args.get(key)}
+
+def cached_summary(key, compute, filters):
+    # Filtered results are too varied to cache and their queries are index-backed
+    if is_filtered(filters):
+        return compute()
+    return summary_cache.get_or_compute(key, compute)
+
+def render_listing(template, rows, **context):
+    """Render a page of listed transactions, streamed when STREAM_TEMPLATES is on."""
+    # Taken now: once a stream has started, the session cookie is already sent
+    # and popping the flashes from it would never be saved
+    context['flashes'] = get_flashed_messages(with_categories=True)
+    rows = [to_view(t) for t in rows]
+    if app.config['STREAM_TEMPLATES']:
+        return app.response_class(stream_template(template, transactions=rows, **context))
+    return render_template(template, transactions=rows, **context)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -55,8 +335,11 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        user = users.find_one({"username": username})
-        if user and bcrypt.check_password_hash(user['password'], password):
+        user = repository.find_user(username)
+        if user and password_hasher.check(user['password'], password):
+            if password_hasher.needs_rehash(user['password']):
+                # Move the stored hash to the configured cost, unless the password changed meanwhile
+                repository.set_password(user['_id'], password_hasher.hash(password), expected=user['password'])
             user_obj = User(str(user['_id']), username)
             login_user(user_obj)
             return redirect(url_for('home'))
@@ -73,21 +356,22 @@ def register():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        print(db, users, users.find_one({"username": username}))
-        user_exists = users.find_one({"username": username})
+        user_exists = repository.find_user(username)
         if user_exists:
             flash('Username already exists', 'error')
             print("here")
             #return redirect(url_for('register'))
         else:
-            hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
-            users.insert_one({"username": username, "password": hashed_password})
+            hashed_password = password_hasher.hash(password)
+            repository.add_user(username, hashed_password)
             flash('Registration successful', 'success')
             #return redirect(url_for('login'))
     return render_template('register.html')
 
 @app.route('/logout')
 def logout():
+    if current_user.is_authenticated:
+        forget_user(current_user.id)
     logout_user()
     return redirect(url_for('login'))
 
@@ -96,48 +380,258 @@ def logout():
 def add_transaction():
     if request.method == 'POST':
         item_name = request.form['item_name']
-        amount = float(request.form['amount'])
+        amount = request.form['amount']
         category = request.form['category']
         date = request.form['date']
-        transactions.insert_one({
-            'item_name': item_name,
-            'amount': amount,
-            'category': category,
-            'date': date,
-            'user_id': current_user.id
-        })
+        new_transaction = transaction_fields(item_name, amount, category, date)
+        new_transaction['user_id'] = current_user.id
+        if app.config['WRITE_BEHIND'] != 'off':
+            queue_transactions([new_transaction])
+        else:
+            repository.add_transactions([new_transaction])
+            record_change(current_user.id, new=new_transaction)
+        flash_budget_status(new_transaction)
         return redirect(url_for('home'))
     return render_template('add_transaction.html')
 
 
+def flash_budget_status(transaction):
+    """Warn when a write brings its category near or over the month's budget."""
+    # The limits are read fresh, not from the per-process user cache; the spent
+    # total is one read of the month's rollup
+    status = check_budget(spending_rollups, current_user.id, load_budgets(users, ObjectId(current_user.id)),
+                          transaction, pending=write_queue.pending(current_user.id))
+    if status is None or not status['warning']:
+        return
+    month = transaction['date'].strftime('%B %Y')
+    if status['over']:
+        flash(f"Over budget: ${status['spent']:.2f} spent on {status['category']} in {month}, "
+              f"limit ${status['limit']:.2f}.", 'warning')
+    else:
+        flash(f"${status['spent']:.2f} of your ${status['limit']:.2f} {status['category']} budget "
+              f"for {month} is spent.", 'warning')
+
+
+@app.route('/budgets', methods=['GET', 'POST'])
+@login_required
+def budgets():
+    if request.method == 'POST':
+        category = request.form.get('category', '').strip()
+        limit = request.form.get('limit', '').strip()
+        try:
+            limit_cents = to_cents(limit) if limit else None  # an empty limit removes the budget
+            if not category or (limit_cents is not None and limit_cents <= 0):
+                raise ValueError(limit)
+        except ValueError:
+            flash('Enter a category and a positive monthly limit.', 'error')
+        else:
+            set_budget(users, ObjectId(current_user.id), category, limit_cents)
+            flash(f'Budget for {category} removed.' if limit_cents is None else f'Budget for {category} saved.')
+        return redirect(url_for('budgets'))
+    now = datetime.now()
+    limits = load_budgets(users, ObjectId(current_user.id))
+    return render_template('budgets.html', report=month_report(spending_rollups, current_user.id, limits, now),
+                           now=now)
+
+
+@app.route('/recurring', methods=['GET', 'POST'])
+@login_required
+def recurring_transactions():
+    if request.method == 'POST':
+        form = request.form
+        try:
+            template = new_template(current_user.id, form.get('item_name', '').strip(), form.get('amount'),
+                                    form.get('category', '').strip(), form.get('start'), form.get('frequency'),
+                                    form.get('interval') or 1, form.get('end') or None)
+        except (ValueError, TypeError):
+            flash('Please fill in a valid name, amount, category, start date and frequency.', 'error')
+        else:
+            recurring.insert_one(template)
+            flash(f"Recurring transaction {template['item_name']} saved; due occurrences are added shortly.")
+        return redirect(url_for('recurring_transactions'))
+    templates = [to_view(template) for template in recurring.find({'user_id': current_user.id}).sort('start', 1)]
+    return render_template('recurring.html', templates=templates, frequencies=FREQUENCIES)
+
+
+@app.route('/recurring/<template_id>/delete', methods=['POST'])
+@login_required
+def delete_recurring(template_id):
+    # Occurrences already added stay; only future ones are cancelled
+    recurring.delete_one({'_id': ObjectId(template_id), 'user_id': current_user.id})
+    flash('Recurring transaction removed.')
+    return redirect(url_for('recurring_transactions'))
+
+
+@app.route('/import-transactions', methods=['GET', 'POST'])
+@login_required
+def import_transactions_view():
+    result = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Please choose a file to import.')
+        else:
+            fmt = request.form.get('format') or detect_format(upload.filename)
+            if fmt not in FORMATS:
+                abort(400)
+            # Decode the upload as it is read; Werkzeug spools large files to a
+            # SpooledTemporaryFile, which TextIOWrapper rejects before Python 3.11
+            stream = codecs.getreader('utf-8-sig')(upload.stream)
+            user_id = current_user.id
+            result = import_transactions(transactions, stream, fmt, user_id,
+                                         on_batch=lambda docs: record_inserts(user_id, docs))
+            flash(f'Imported {result.accepted} transactions, rejected {result.rejected}.')
+    return render_template('import_transactions.html', result=result)
+
+
+@app.route('/export-transactions')
+@login_required
+def export_transactions():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        abort(400)
+    # Same period or custom range selection and filters as the detailed summary
+    try:
+        custom_range = range_bounds(request.args, datetime.now())
+        filters = parse_filters(request.args)
+    except ValueError:
+        abort(400)
+    year = request.args.get('year', type=int)
+    month = request.args.get('month', type=int)
+    if custom_range:
+        match = period_match(current_user.id, *custom_range[:2])
+    elif year:
+        match = period_match(current_user.id, *period_bounds(year, month))
+    else:
+        match = period_match(current_user.id)
+    match = apply_filters(match, filters)
+
+    rows = (transactions.find(match, LIST_FIELDS)
+            .sort([('date', 1), ('_id', 1)])
+            .batch_size(app.config['STREAM_BATCH_SIZE']))
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    return Response(stream_with_context(export_chunks(rows, fmt)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=transactions.{extension}'})
+
+
+def api_login_required(view):
+    """Like login_required, but answers 401 instead of redirecting to the login page."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return jsonify({'error': 'Authentication required.'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.errorhandler(ApiError)
+def api_error(error):
+    return jsonify({'error': str(error), 'errors': error.errors}), 400
+
+def api_payload():
+    payload = request.get_json(silent=True)
+    if payload is None:
+        raise ApiError('Expected a JSON body.')
+    return payload
+
+@app.route('/api/v1/transactions', methods=['GET'])
+@api_login_required
+def api_list_transactions():
+    page_size = min(request.args.get('size', app.config['PAGE_SIZE'], type=int), app.config['MAX_PAGE_SIZE'])
+    try:
+        custom_range = range_bounds(request.args, datetime.now())
+        start, end = custom_range[:2] if custom_range else (None, None)
+        match = apply_filters(period_match(current_user.id, start, end), parse_filters(request.args))
+        page = fetch_page(transactions, match, max(page_size, 1),
+                          after=request.args.get('after'), before=request.args.get('before'))
+    except ValueError as error:
+        raise ApiError(str(error))
+    response = jsonify({'items': [serialize(t) for t in page.items],
+                        'next': page.next_cursor, 'prev': page.prev_cursor})
+    # Clients sending the ETag back in If-None-Match get an empty 304 when the page is unchanged
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/api/v1/transactions', methods=['POST'])
+@api_login_required
+def api_create_transactions():
+    docs = parse_creates(api_payload(), current_user.id)
+    if app.config['WRITE_BEHIND'] != 'off':
+        queue_transactions(docs)
+        # Accepted, not yet written, when the queue doesn't wait for the batch
+        status = 202 if app.config['WRITE_BEHIND'] == 'async' else 201
+    else:
+        transactions.insert_many(docs)
+        record_inserts(current_user.id, docs)
+        status = 201
+    return jsonify({'items': [serialize(doc) for doc in docs]}), status
+
+@app.route('/api/v1/transactions', methods=['PATCH'])
+@api_login_required
+def api_update_transactions():
+    updates = parse_updates(api_payload())
+
+    def merge(existing):
+        merged, errors = {}, []
+        for _id, transaction in existing.items():
+            try:
+                merged[_id] = merge_update(transaction, updates[_id])
+            except (ValueError, TypeError) as error:
+                errors.append(f'{_id}: {error}')
+        if errors:
+            raise ApiError('Invalid updates.', errors)
+        return merged
+
+    # One claim, read and bulk write whatever the batch size; the rollup deltas
+    # start from the versions the repository actually replaced
+    changes = repository.update_transactions(current_user.id, list(updates), merge)
+    if changes:
+        record_changes(current_user.id, changes)
+    updated = {old['_id']: dict(new_fields, _id=old['_id']) for old, new_fields in changes}
+    return jsonify({'items': [serialize(updated[_id]) for _id in updates if _id in updated],
+                    'missing': [str(_id) for _id in updates if _id not in updated]})
+
+@app.route('/api/v1/transactions', methods=['DELETE'])
+@api_login_required
+def api_delete_transactions():
+    payload = api_payload()
+    ids = parse_ids(payload.get('ids') if isinstance(payload, dict) else None)
+    # Only the documents this request actually deleted contribute a rollup delta
+    found = repository.delete_transactions(current_user.id, ids)
+    if found:
+        record_changes(current_user.id, [(t, None) for t in found])
+    deleted = {t['_id'] for t in found}
+    return jsonify({'deleted': [str(_id) for _id in ids if _id in deleted],
+                    'missing': [str(_id) for _id in ids if _id not in deleted]})
+
+
 @app.route('/edit-transaction/<transaction_id>', methods=['GET', 'POST'])
 @login_required
 def edit_transaction(transaction_id):
-    transaction = transactions.find_one({'_id': ObjectId(transaction_id), 'user_id': current_user.id})
     if request.method == 'POST':
         item_name = request.form.get('item_name')  # Capture the item name from the form
-        amount = float(request.form.get('amount'))
+        amount = request.form.get('amount')
         category = request.form.get('category')
         date = request.form.get('date')
 
-        # Update the transaction document with new values
-        updated_transaction = {
-            'item_name': item_name,
-            'amount': amount,
-            'category': category,
-            'date': date
-        }
-        transactions.update_one({'_id': ObjectId(transaction_id)}, {'$set': updated_transaction})
+        # Update the transaction document with new values, dropping the legacy float amount
+        updated_transaction = transaction_fields(item_name, amount, category, date)
+        transaction = repository.update_transaction(current_user.id, transaction_id, updated_transaction)
+        if transaction:
+            record_change(current_user.id, old=transaction, new=updated_transaction)
         flash('Transaction updated successfully.')
+        flash_budget_status(updated_transaction)
         return redirect(url_for('home'))
 
-    return render_template('edit_transaction.html', transaction=transaction)
+    transaction = repository.get_transaction(current_user.id, transaction_id)
+    return render_template('edit_transaction.html', transaction=to_view(transaction))
 
 
 @app.route('/delete-transaction/<transaction_id>', methods=['POST'])
 @login_required
 def delete_transaction(transaction_id):
-    transactions.delete_one({'_id': ObjectId(transaction_id), 'user_id': current_user.id})
+    deleted = repository.delete_transaction(current_user.id, transaction_id)
+    if deleted:
+        record_change(current_user.id, old=deleted)
     flash('Transaction deleted successfully.')
     # Redirect back to the page the user came from
     referrer = request.headers.get("Referer")
@@ -147,89 +641,220 @@ def delete_transaction(transaction_id):
 @app.route('/detailed-spending-summary')
 @login_required
 def detailed_spending_summary():
+    filters, custom_range = request_filters(), request_range()
+    if custom_range:
+        return range_spending_summary(*custom_range, filters=filters)
+
     year = request.args.get('year', datetime.now().year, type=int)
     month = request.args.get('month', type=int)  # Optional month selection
 
-    # Define the start and end of the period based on user selection
-    if year and month:
-        start_date = datetime(year, month, 1)
-        end_date = datetime(year, month+1, 1) if month < 12 else datetime(year+1, 1, 1)
-    else:
-        start_date = datetime(year, 1, 1)
-        end_date = datetime(year+1, 1, 1)
-
-    # Adjust the aggregation to limit by the selected period
-    summary = list(transactions.aggregate([
-        {'$match': {
-            'user_id': current_user.id,
-            'date': {'$gte': start_date.strftime('%Y-%m-%d'), '$lt': end_date.strftime('%Y-%m-%d')}
-        }},
-        {'$group': {'_id': '$category', 'total': {'$sum': '$amount'}}},
-        {'$sort': {'total': -1}}
-    ]))
+    start_date, end_date = period_bounds(year, month)
+    match = apply_filters(period_match(current_user.id, start_date, end_date), filters)
+    # Only the totals are aggregated; a year of transactions in one $facet document could pass
+    # MongoDB's 16MB limit, so they are listed a page at a time from the (user_id, date) index
+    summary = cached_summary(
+        SummaryCache.key('categories', current_user.id, year, month),
+        lambda: summarize(transactions, match, facets=('categories',))['categories'], filters)
+    page = request_page(match)
 
     total = sum(item['total'] for item in summary)  # Calculate the total spent in the selected period
+    transaction_count = sum(item['count'] for item in summary)
+
+    return render_listing('detailed_spending_summary.html', page.items, summary=summary, total=total,
+                          transaction_count=transaction_count, now=datetime.now(),
+                          filter_query=filter_args(filters), page=page, query_args=page_args(),
+                          export_query=dict(filter_args(filters), year=year, month=month))
+
+
+def range_totals(start, end, filters):
+    if not is_filtered(filters):
+        # Category totals come from the daily buckets: one small document per day with spending
+        return range_summary(spending_daily, current_user.id, start, end)
+    # The buckets know nothing of item names or amounts, so filtered totals come from the transactions
+    match = apply_filters(period_match(current_user.id, start, end), filters)
+    categories = summarize(transactions, match, facets=('categories',))['categories']
+    return {'categories': categories, 'total': sum(row['total'] for row in categories),
+            'count': sum(row['count'] for row in categories)}
+
+
+def range_spending_summary(start, end, label, filters=NO_FILTERS):
+    summary = range_totals(start, end, filters)
+    comparison = None
+    if request.args.get('compare') == 'previous-year':
+        previous = range_totals(shift_years(start, -1), shift_years(end, -1), filters)
+        comparison = {'total': previous['total'],
+                      'categories': {row['_id']: row['total'] for row in previous['categories']}}
+    page = request_page(apply_filters(period_match(current_user.id, start, end), filters))
+    return render_listing('detailed_spending_summary.html', page.items, summary=summary['categories'],
+                          total=summary['total'], transaction_count=summary['count'], now=datetime.now(),
+                          period_label=label, comparison=comparison, filter_query=filter_args(filters),
+                          page=page, query_args=page_args(), export_query=dict(filter_args(filters), **range_args()))
 
-    user_transactions = transactions.find({
-        'user_id': current_user.id,
-        'date': {'$gte': start_date.strftime('%Y-%m-%d'), '$lt': end_date.strftime('%Y-%m-%d')}
-    })
 
-    return render_template('detailed_spending_summary.html', summary=summary, total=total, now=datetime.now(), transactions=list(user_transactions))
+@app.route('/spending-summary')
+@login_required
+def spending_summary():
+    filters = request_filters()
+    if is_filtered(filters):
+        # Rollups hold totals only, so a filtered summary aggregates the matching transactions
+        result = summarize(transactions, apply_filters(period_match(current_user.id), filters),
+                           facets=('weekly', 'monthly', 'yearly'))
+        summary = {f'{name}_spending': result[name] for name in ('weekly', 'monthly', 'yearly')}
+    else:
+        # Totals are maintained incrementally by the write routes, so a cache miss is a single indexed read
+        summary = summary_cache.get_or_compute(SummaryCache.key('spending', current_user.id),
+                                               lambda: read_summary(spending_rollups, current_user.id))
+    return render_template('spending_summary.html', filter_query=filter_args(filters), **summary)
 
 
+def user_analytics(user_id):
+    # One read of the user's (date, amount, category) columns; the figures are computed in NumPy
+    return summary_cache.get_or_compute(SummaryCache.key('analytics', user_id),
+                                        lambda: analyze(load_columns(transactions, user_id), datetime.now()))
 
-@app.route('/spending-summary')
+
+@app.route('/analytics')
 @login_required
-def spending_summary():
-        # Define the pipeline for weekly aggregation
-    weekly_pipeline = [
-        {'$match': {'user_id': current_user.id}},
-        {'$group': {
-            '_id': {
-                'year': {'$year': {'$toDate': '$date'}},
-                'week': {'$week': {'$toDate': '$date'}}
-            },
-            'total': {'$sum': '$amount'}
-        }},
-        {'$sort': {'_id.year': -1, '_id.week': -1}}
-    ]
-
-    # Define the pipeline for monthly aggregation
-    monthly_pipeline = [
-        {'$match': {'user_id': current_user.id}},
-        {'$group': {
-            '_id': {
-                'year': {'$year': {'$toDate': '$date'}},
-                'month': {'$month': {'$toDate': '$date'}}
-            },
-            'total': {'$sum': '$amount'}
-        }},
-        {'$sort': {'_id.year': -1, '_id.month': -1}}
-    ]
-
-    # Define the pipeline for yearly aggregation
-    yearly_pipeline = [
-        {'$match': {'user_id': current_user.id}},
-        {'$group': {
-            '_id': {
-                'year': {'$year': {'$toDate': '$date'}}
-            },
-            'total': {'$sum': '$amount'}
-        }},
-        {'$sort': {'_id.year': -1}}
-    ]
-
-    # Execute the aggregation queries
-    db = client['BudgetTracker']
-    weekly_spending = list(db.transactions.aggregate(weekly_pipeline))
-    monthly_spending = list(db.transactions.aggregate(monthly_pipeline))
-    yearly_spending = list(db.transactions.aggregate(yearly_pipeline))
-
-    return render_template('spending_summary.html',
-                           weekly_spending=weekly_spending,
-                           monthly_spending=monthly_spending,
-                           yearly_spending=yearly_spending)
+def analytics():
+    return render_template('analytics.html', **user_analytics(current_user.id))
+
+
+@app.route('/api/v1/analytics')
+@api_login_required
+def api_analytics():
+    return jsonify(user_analytics(current_user.id))
+
+
+@app.route('/cache-stats')
+@login_required
+def cache_stats():
+    user_stats = user_cache.stats()
+    user_stats['lookups_avoided'] = user_stats['hits']
+    return jsonify({'summaries': summary_cache.stats(), 'users': user_stats})
+
+
+# Live updates for open pages (see events.py): one change stream per process,
+# opened by the first /events request and shared by all of them. Every open
+# page holds an /events request, so pages only subscribe with LIVE_UPDATES=1,
+# which suits threaded workers; the ASGI entry point turns it on by default
+change_feed = ChangeFeed(db)
+app.config['LIVE_UPDATES'] = os.getenv('LIVE_UPDATES', '0') == '1'
+app.config['EVENTS_KEEPALIVE'] = int(os.getenv('EVENTS_KEEPALIVE', 15))
+
+
+@app.route('/events')
+@login_required
+def events():
+    if not app.config['LIVE_UPDATES']:
+        # Also makes the EventSource of a page rendered before the switch give up
+        abort(404)
+    if not app.testing:
+        change_feed.start()
+    subscription = change_feed.subscribe(current_user.id)
+    return Response(event_stream(change_feed, subscription, app.config['EVENTS_KEEPALIVE']),
+                    mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/metrics')
+def metrics():
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    return Response(request_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.cli.command('rebuild-rollups')
+@click.option('--user-id', default=None, help='Only rebuild the rollups of this user.')
+def rebuild_rollups_command(user_id):
+    """Backfill or repair spending rollups and daily buckets from the raw transactions."""
+    buckets = rebuild_rollups(transactions, spending_rollups, user_id=user_id)
+    days = rebuild_daily(transactions, spending_daily, user_id=user_id)
+    click.echo(f'Rebuilt {buckets} rollup buckets and {days} daily buckets.')
+
+
+@app.cli.command('check-daily-buckets')
+@click.option('--user-id', default=None, help='Only check the buckets of this user.')
+def check_daily_buckets_command(user_id):
+    """Compare the daily buckets with the raw transactions."""
+    mismatches = check_daily(transactions, spending_daily, user_id=user_id)
+    for owner, day, category, expected, stored in mismatches:
+        click.echo(f'{owner} {day:%Y-%m-%d} {category!r}: expected {expected}, stored {stored}', err=True)
+    if mismatches:
+        raise click.ClickException(f'{len(mismatches)} daily buckets differ; run `flask rebuild-rollups`.')
+    click.echo('Daily buckets match the transactions.')
+
+
+@app.cli.command('migrate-transactions')
+@click.option('--batch-size', default=500, show_default=True, help='Documents converted per bulk write.')
+@click.option('--restart', is_flag=True, help='Ignore the saved checkpoint and scan from the beginning.')
+def migrate_transactions_command(batch_size, restart):
+    """Convert legacy transactions to BSON dates and integer cents."""
+    migrated, failed = migrate_transactions(transactions, db.migrations, batch_size=batch_size, restart=restart)
+    click.echo(f'Migrated {migrated} transactions ({failed} could not be parsed).')
+    # Rollups built from the legacy float amounts are recomputed in cents
+    buckets = rebuild_rollups(transactions, spending_rollups)
+    days = rebuild_daily(transactions, spending_daily)
+    click.echo(f'Rebuilt {buckets} rollup buckets and {days} daily buckets.')
+
+
+@app.cli.command('import-transactions')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--username', required=True, help='User who will own the imported transactions.')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None, help='Defaults to the file extension.')
+@click.option('--batch-size', default=500, show_default=True, help='Documents per insert_many.')
+def import_transactions_command(path, username, fmt, batch_size):
+    """Import transactions from a CSV or JSON Lines file."""
+    user = repository.find_user(username)
+    if not user:
+        raise click.ClickException(f'No user named {username!r}')
+    user_id = str(user['_id'])
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        result = import_transactions(transactions, stream, fmt or detect_format(path), user_id,
+                                     batch_size=batch_size, on_batch=lambda docs: record_inserts(user_id, docs))
+    for error in result.errors:
+        click.echo(error, err=True)
+    click.echo(f'Imported {result.accepted} transactions, rejected {result.rejected}.')
+
+
+@app.cli.command('materialize-recurring')
+@click.option('--every', type=int, default=None, help='Keep running, materializing every N seconds.')
+def materialize_recurring_command(every):
+    """Add the due occurrences of recurring transactions, including missed ones."""
+    if every is None:
+        click.echo(f'Added {materialize_recurring()} recurring transactions.')
+        return
+    scheduler = RecurringScheduler(lambda: click.echo(f'Added {materialize_recurring()} recurring transactions.'),
+                                   interval=every, lease=recurring_lease(every))
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scheduler.stop()
+
+
+@app.cli.command('ensure-indexes')
+def ensure_indexes_command():
+    """Create the indexes declared in indexes.py."""
+    click.echo('Ensured indexes: ' + ', '.join(ensure_indexes(db)))
+
+
+@app.cli.command('enable-change-events')
+def enable_change_events_command():
+    """Record pre-images of transactions so live updates can push deletes (MongoDB 6.0+)."""
+    db.command('collMod', 'transactions', changeStreamPreAndPostImages={'enabled': True})
+    click.echo('Change stream pre-images enabled for transactions.')
+
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Explain every route query and fail if any falls back to a collection scan."""
+    ensure_indexes(db)
+    failures = check_query_plans(db)
+    if failures:
+        raise click.ClickException('COLLSCAN in: ' + ', '.join(failures))
+    click.echo('All route queries use an index.')
+
 
 if __name__ == '__main__':
     app_port = 3000
@@ -0,0 +1,179 @@
+"""ASGI entry point backed by an async MongoDB driver.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 3000
+
+The two summary pages are served natively on the event loop: their queries
+go through Motor and run concurrently, so a slow aggregation no longer
+occupies a worker thread while it waits on MongoDB. The ``/events`` stream
+of live updates is served on the loop too. Every other route is the
+regular Flask app, run in a thread pool by asgiref's ``WsgiToAsgi``. Both use
+the same templates, sessions, login and summary cache.
+
+Set ``ASYNC_STORE=threaded`` to run the async views on the synchronous client
+in worker threads instead of Motor (e.g. against mongomock).
+"""
+import asyncio
+import os
+from datetime import datetime
+from urllib.parse import parse_qs
+from asgiref.wsgi import WsgiToAsgi
+from bson.objectid import ObjectId
+from flask import render_template, request, session
+from flask_login import current_user
+from werkzeug.test import EnvironBuilder
+import aio
+from cache import MISSING, SummaryCache
+from events import AsyncSubscription, async_event_stream
+from filters import PARAMS as FILTER_PARAMS
+from schema import to_view
+from summary import period_bounds, period_match
+
+# Requests with a custom range, search filters or a page cursor are handled by the Flask views
+WSGI_PARAMS = {'start', 'end', 'range', 'after', 'before', *FILTER_PARAMS}
+
+
+def build_environ(scope):
+    """Translate an ASGI HTTP scope (without body) into a WSGI environ."""
+    headers = [(name.decode('latin1'), value.decode('latin1')) for name, value in scope.get('headers', [])]
+    host = dict((name.lower(), value) for name, value in headers).get('host', 'localhost')
+    builder = EnvironBuilder(
+        path=scope['path'],
+        base_url=f"{scope.get('scheme', 'http')}://{host}{scope.get('root_path', '')}",
+        query_string=scope.get('query_string', b'').decode('latin1'),
+        method=scope['method'],
+        headers=headers,
+        environ_base={'REMOTE_ADDR': (scope.get('client') or ('', 0))[0]},
+    )
+    return builder.get_environ()
+
+
+async def send_response(send, response):
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in response.headers.items()],
+    })
+    await send({'type': 'http.response.body', 'body': response.get_data()})
+
+
+def create_application(webapp, store):
+    """Build the ASGI app around an imported app module (``app`` or ``test.app``)."""
+    flask_app = webapp.app
+    cache = webapp.summary_cache
+
+    async def cached(key, compute):
+        value = cache.backend.get(key)
+        if value is MISSING:
+            value = await compute()
+            cache.backend.set(key, value)
+        return value
+
+    async def spending_summary():
+        key = SummaryCache.key('spending', current_user.id)
+        summary = await cached(key, lambda: aio.read_summary(store, current_user.id))
+        return render_template('spending_summary.html', filter_query={}, **summary)
+
+    async def detailed_spending_summary():
+        year = request.args.get('year', datetime.now().year, type=int)
+        month = request.args.get('month', type=int)
+        match = period_match(current_user.id, *period_bounds(year, month))
+        page_size = max(min(request.args.get('size', flask_app.config['PAGE_SIZE'], type=int),
+                            flask_app.config['MAX_PAGE_SIZE']), 1)
+        summary, page = await asyncio.gather(
+            cached(SummaryCache.key('categories', current_user.id, year, month),
+                   lambda: aio.period_categories(store, match)),
+            aio.first_page(store, match, page_size))
+        return render_template('detailed_spending_summary.html', summary=summary,
+                               total=sum(item['total'] for item in summary),
+                               transaction_count=sum(item['count'] for item in summary),
+                               transactions=[to_view(t) for t in page.items], now=datetime.now(),
+                               filter_query={}, page=page, query_args=dict(request.args),
+                               export_query={'year': year, 'month': month})
+
+    views = {
+        '/spending-summary': spending_summary,
+        '/detailed-spending-summary': detailed_spending_summary,
+    }
+
+    async def load_session_user():
+        # Fill the user cache asynchronously so Flask-Login's loader doesn't block the loop
+        user_id = session.get('_user_id')
+        if user_id and webapp.user_cache.get(user_id) is MISSING:
+            user = await store.find_one('users', {'_id': ObjectId(user_id)})
+            if user:
+                webapp.user_cache.set(user_id, webapp.User(str(user['_id']), user['username']))
+
+    async def stream_events(scope, receive, send):
+        # Served on the loop: an open page costs a queue, not a thread
+        with flask_app.request_context(build_environ(scope)):
+            await load_session_user()
+            if not current_user.is_authenticated:
+                response = flask_app.process_response(flask_app.login_manager.unauthorized())
+                return await send_response(send, response)
+            user_id = current_user.id
+        feed = webapp.change_feed
+        if not flask_app.testing:
+            feed.start()
+        subscription = feed.subscribe(user_id, AsyncSubscription(user_id, asyncio.get_running_loop()))
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no')]})
+        stream = async_event_stream(feed, subscription, flask_app.config['EVENTS_KEEPALIVE'])
+        try:
+            async for chunk in stream:
+                if disconnected.done():
+                    break
+                await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+            else:
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnected.cancel()
+            await stream.aclose()
+
+    wsgi = WsgiToAsgi(flask_app)
+
+    async def application(scope, receive, send):
+        if scope['type'] == 'http' and scope['method'] == 'GET' and scope.get('path') == '/events' \
+                and flask_app.config['LIVE_UPDATES']:
+            return await stream_events(scope, receive, send)
+        view = views.get(scope.get('path')) if scope['type'] == 'http' and scope['method'] == 'GET' else None
+        if view is not None and WSGI_PARAMS.intersection(parse_qs(scope.get('query_string', b'').decode('latin1'))):
+            view = None
+        if view is None:
+            return await wsgi(scope, receive, send)
+        with flask_app.request_context(build_environ(scope)):
+            await load_session_user()
+            if current_user.is_authenticated and webapp.write_queue.pending(current_user.id):
+                # Read-your-writes, as the Flask app's sync_queued_writes
+                await asyncio.to_thread(webapp.write_queue.sync, current_user.id)
+            # The app's before_request hooks (metrics, indexes, scheduler) as for WSGI
+            # views; sync_queued_writes finds nothing left to wait for
+            rv = flask_app.preprocess_request()
+            if rv is not None:
+                response = flask_app.make_response(rv)
+            elif current_user.is_authenticated:
+                response = flask_app.make_response(await view())
+            else:
+                response = flask_app.login_manager.unauthorized()
+            response = flask_app.process_response(response)
+        await send_response(send, response)
+
+    return application
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+def default_store(webapp):
+    if os.getenv('ASYNC_STORE') == 'threaded':
+        return aio.ThreadedStore(webapp.db)
+    return aio.MotorStore(webapp.mongo_uri, webapp.db.name, **webapp.mongo_options)
+
+
+import app as webapp
+# /events runs on the event loop here, so open pages are cheap enough to subscribe by default
+webapp.app.config['LIVE_UPDATES'] = os.getenv('LIVE_UPDATES', '1') == '1'
+application = create_application(webapp, default_store(webapp))
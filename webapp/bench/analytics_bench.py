@@ -0,0 +1,118 @@
+"""Compare the NumPy analytics with the same figures computed row by row.
+
+Runs in memory on generated transactions, so no database is needed:
+
+    python -m bench.analytics_bench --transactions 100000 --repeat 5
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+from analytics import analyze, to_columns
+from bench.seed import generate_transactions
+from schema import amount_cents, parse_date
+
+USER_ID = 'bench-user'
+
+
+def analyze_loop(docs, today, days=90, months=12, top=5, trend_months=6):
+    """Per-row reference implementation of ``analytics.analyze``."""
+    today = datetime(today.year, today.month, today.day)
+    start = today - timedelta(days=days - 1)
+    this_month = (today.year - 1970) * 12 + today.month - 1
+    first_month = this_month - months + 1
+    daily = [0] * days
+    monthly = [0] * months
+    per_month = {}
+    by_category = {}
+    count = 0
+    for doc in docs:
+        date, cents, category = parse_date(doc['date']), amount_cents(doc), doc.get('category') or ''
+        count += 1
+        day = datetime(date.year, date.month, date.day)
+        if start <= day <= today:
+            daily[(day - start).days] += cents
+        month = (date.year - 1970) * 12 + date.month - 1
+        if first_month <= month <= this_month:
+            monthly[month - first_month] += cents
+            row = per_month.setdefault(category, [0] * months)
+            row[month - first_month] += cents
+        by_category[category] = by_category.get(category, 0) + cents
+
+    daily = [cents / 100 for cents in daily]
+
+    def rolling(window):
+        return [round(sum(daily[max(0, i - window + 1):i + 1]) / min(i + 1, window), 2) for i in range(days)]
+
+    totals = [cents / 100 for cents in monthly]
+    month_rows = []
+    for index, total in enumerate(totals):
+        previous = totals[index - 1] if index else None
+        change = None if previous is None else round(total - previous, 2)
+        pct = round((total - previous) / previous * 100, 2) if previous else None
+        label = f'{1970 + (first_month + index) // 12}-{(first_month + index) % 12 + 1:02d}'
+        month_rows.append({'month': label, 'total': round(total, 2), 'change': change, 'change_pct': pct})
+
+    grand_total = sum(by_category.values()) / 100
+    ranked = sorted(by_category.items(), key=lambda item: -item[1])[:top]
+    trends = []
+    for category, row in per_month.items():
+        recent = [cents / 100 for cents in row[-trend_months:]]
+        if not any(recent):
+            continue
+        mean_x, mean_y = (len(recent) - 1) / 2, sum(recent) / len(recent)
+        slope = (sum((x - mean_x) * (y - mean_y) for x, y in enumerate(recent))
+                 / sum((x - mean_x) ** 2 for x in range(len(recent))))
+        trends.append({'category': category, 'monthly': [round(value, 2) for value in recent], 'slope': round(slope, 2)})
+    trends.sort(key=lambda row: row['slope'], reverse=True)
+    return {
+        'as_of': today.strftime('%Y-%m-%d'),
+        'transaction_count': count,
+        'rolling': {
+            'dates': [(start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)],
+            'daily': [round(value, 2) for value in daily],
+            'avg_7': rolling(7),
+            'avg_30': rolling(30),
+        },
+        'months': month_rows,
+        'top_categories': [
+            {'category': category, 'total': round(cents / 100, 2),
+             'share': round(cents / 100 / grand_total * 100, 2) if grand_total else 0.0}
+            for category, cents in ranked if cents
+        ],
+        'trends': trends,
+    }
+
+
+def median_ms(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(timings), 3)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--transactions', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    today = datetime(2024, 5, 1)
+    docs = list(generate_transactions(USER_ID, args.transactions, end=today))
+    columns = to_columns(docs)
+    results = {
+        'transactions': args.transactions,
+        # Building the arrays is paid once per request, like the loop's pass over the documents
+        'columns_ms': median_ms(lambda: to_columns(docs), args.repeat),
+        'numpy_ms': median_ms(lambda: analyze(columns, today), args.repeat),
+        'loop_ms': median_ms(lambda: analyze_loop(docs, today), args.repeat),
+    }
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+"""Command counting shared by the benchmarks."""
+import threading
+from pymongo import monitoring
+
+
+class RoundTripCounter(monitoring.CommandListener):
+    """Counts the commands sent to MongoDB, in total and per thread.
+
+    PyMongo calls ``started`` on the thread that issues the command, so
+    ``thread_count()`` attributes round trips to the request running there.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def started(self, event):
+        with self._lock:
+            self.count += 1
+        self._local.count = self.thread_count() + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def thread_count(self):
+        return getattr(self._local, 'count', 0)
@@ -0,0 +1,232 @@
+"""Load test of the main routes through the Flask test client.
+
+Seeds ``--users`` users with ``--transactions`` transactions each into a
+``BudgetTrackerBench`` database, logs every worker in and replays a weighted
+mix of requests against the dashboard (plain and searched), add-transaction
+and both summary pages. Run from the webapp directory:
+
+    python -m bench.route_bench --users 20 --transactions 2000 --output before.json
+    python -m bench.route_bench --users 20 --transactions 2000 --compare before.json
+
+By default the app talks to a local mongod and the report includes MongoDB
+round trips per request; ``--in-memory`` uses mongomock instead, which is
+handy for a quick run but says little about real latencies.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from bson.objectid import ObjectId
+from pymongo import MongoClient
+from bench.monitor import RoundTripCounter
+from bench.seed import CATEGORIES, ITEMS, seed
+from daily import rebuild_daily
+from indexes import ensure_indexes
+from rollups import rebuild_rollups
+from storage import MongoRepository
+
+DB_NAME = 'BudgetTrackerBench'
+PASSWORD = 'bench-password'
+
+
+def home_request(rng):
+    return 'GET', '/', None
+
+
+def search_request(rng):
+    category = rng.choice(CATEGORIES)
+    word = rng.choice(ITEMS[category]).split()[0]
+    # A word prefix, sometimes narrowed to its category or an amount range
+    args = f'q={word[:rng.randint(2, len(word))]}'
+    if rng.random() < 0.3:
+        args += f'&category={category}'
+    elif rng.random() < 0.3:
+        args += '&min=20&max=200'
+    return 'GET', f'/?{args}', None
+
+
+def add_transaction_request(rng):
+    category = rng.choice(CATEGORIES)
+    return 'POST', '/add-transaction', {
+        'item_name': rng.choice(ITEMS[category]),
+        'amount': f'{rng.uniform(1, 200):.2f}',
+        'category': category,
+        'date': f'2024-{rng.randint(1, 4):02d}-{rng.randint(1, 28):02d}',
+    }
+
+
+def detailed_summary_request(rng):
+    return 'GET', f'/detailed-spending-summary?year={rng.choice([2022, 2023, 2024])}&month={rng.randint(1, 12)}', None
+
+
+def spending_summary_request(rng):
+    return 'GET', '/spending-summary', None
+
+
+# Route name -> (relative weight in the mix, request factory)
+ROUTES = {
+    'home': (30, home_request),
+    'search': (10, search_request),
+    'add_transaction': (20, add_transaction_request),
+    'detailed_spending_summary': (20, detailed_summary_request),
+    'spending_summary': (20, spending_summary_request),
+}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def bind_database(webapp, db):
+    """Point the app module's collections at ``db`` and prepare its indexes."""
+    webapp.db = db
+    webapp.users = db.users
+    webapp.transactions = db.transactions
+    webapp.spending_rollups = db.spending_rollups
+    webapp.spending_daily = db.spending_daily
+    webapp.recurring = db.recurring
+    # Logins and single-transaction writes go through the repository
+    webapp.repository = MongoRepository(db)
+    # No background materializer writing into the real database mid-run
+    webapp.app.config['RECURRING_SCHEDULER'] = 'off'
+    ensure_indexes(db)
+    webapp.indexes_ready = True
+
+
+def seed_users(webapp, db, count, per_user):
+    """Create ``count`` users with generated transactions; returns their usernames."""
+    password = webapp.bcrypt.generate_password_hash(PASSWORD).decode('utf-8')
+    users = [{'_id': ObjectId(), 'username': f'bench-user-{index}', 'password': password}
+             for index in range(count)]
+    db.users.insert_many(users)
+    seed(db.transactions, [str(user['_id']) for user in users], per_user)
+    rebuild_rollups(db.transactions, db.spending_rollups)
+    rebuild_daily(db.transactions, db.spending_daily)
+    return [user['username'] for user in users]
+
+
+def succeeded(response):
+    """Not an error status, nor the redirect to the login page that a lost session gets."""
+    return response.status_code < 400 and not (
+        response.status_code in (301, 302, 303) and urlsplit(response.location).path == '/login')
+
+
+def run_worker(webapp, username, count, routes, counter, seed_value):
+    """Log in as ``username`` and send ``count`` requests; returns (route, ms, round trips, ok) samples."""
+    rng = random.Random(f'{seed_value}:{threading.get_ident()}:{username}')
+    client = webapp.app.test_client()
+    response = client.post('/login', data={'username': username, 'password': PASSWORD})
+    # A failed login renders the form again; timing login redirects would be meaningless
+    if response.status_code != 302:
+        raise RuntimeError(f'Could not log in as {username} (status {response.status_code})')
+    names = list(routes)
+    weights = [ROUTES[name][0] for name in names]
+    samples = []
+    for _ in range(count):
+        name = rng.choices(names, weights)[0]
+        method, path, data = ROUTES[name][1](rng)
+        before = counter.thread_count() if counter else 0
+        started = time.perf_counter()
+        response = client.open(path, method=method, data=data)
+        response.get_data()
+        elapsed = (time.perf_counter() - started) * 1000
+        trips = counter.thread_count() - before if counter else None
+        samples.append((name, elapsed, trips, succeeded(response)))
+    return samples
+
+
+def summarize_samples(samples, wall_seconds):
+    routes = {}
+    for name in sorted({sample[0] for sample in samples}):
+        rows = [sample for sample in samples if sample[0] == name]
+        timings = sorted(sample[1] for sample in rows)
+        trips = [sample[2] for sample in rows if sample[2] is not None]
+        routes[name] = {
+            'requests': len(rows),
+            'errors': sum(1 for sample in rows if not sample[3]),
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'throughput_rps': round(len(rows) / wall_seconds, 1),
+            'round_trips': round(sum(trips) / len(trips), 2) if trips else None,
+        }
+    return {
+        'requests': len(samples),
+        'wall_s': round(wall_seconds, 3),
+        'throughput_rps': round(len(samples) / wall_seconds, 1),
+        'routes': routes,
+    }
+
+
+def compare(baseline, current, out=sys.stderr):
+    """Print per-route latency changes against an earlier report."""
+    print(f"{'route':<28}{'metric':<8}{'before':>10}{'after':>10}{'change':>9}", file=out)
+    for name, after in current['routes'].items():
+        before = baseline.get('routes', {}).get(name)
+        if before is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+            change = (after[metric] - before[metric]) / before[metric] * 100 if before[metric] else 0.0
+            print(f'{name:<28}{metric[:3]:<8}{before[metric]:>10.2f}{after[metric]:>10.2f}{change:>+8.1f}%', file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongo-uri', default=os.getenv('BENCH_MONGO_URI', 'mongodb://localhost:27017'))
+    parser.add_argument('--in-memory', action='store_true', help='use mongomock instead of a mongod')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--transactions', type=int, default=1000, help='per user')
+    parser.add_argument('--requests', type=int, default=1000, help='in total')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--route', action='append', choices=sorted(ROUTES), help='limit the mix (repeatable)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--compare', help='earlier JSON report to compare against')
+    args = parser.parse_args(argv)
+
+    import app as webapp
+    if args.in_memory:
+        import mongomock
+        client, counter = mongomock.MongoClient(), None
+    else:
+        counter = RoundTripCounter()
+        client = MongoClient(args.mongo_uri, event_listeners=[counter])
+    client.drop_database(DB_NAME)
+    bind_database(webapp, client[DB_NAME])
+    usernames = seed_users(webapp, client[DB_NAME], args.users, args.transactions)
+
+    routes = args.route or list(ROUTES)
+    per_worker = [args.requests // args.concurrency + (index < args.requests % args.concurrency)
+                  for index in range(args.concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(run_worker, webapp, usernames[index % len(usernames)], count,
+                               routes, counter, args.seed)
+                   for index, count in enumerate(per_worker)]
+        samples = [sample for future in futures for sample in future.result()]
+    report = summarize_samples(samples, time.perf_counter() - started)
+    report['config'] = {key: getattr(args, key) for key in ('users', 'transactions', 'requests', 'concurrency', 'in_memory')}
+    client.drop_database(DB_NAME)
+
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(report, out, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(json.load(baseline), report)
+    return report
+
+
+if __name__ == '__main__':
+    main()
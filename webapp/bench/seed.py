@@ -0,0 +1,54 @@
+"""Synthetic transaction data for the benchmarks."""
+import random
+from datetime import datetime, timedelta
+from schema import transaction_fields
+
+CATEGORIES = ['Groceries', 'Transport', 'Utilities', 'Entertainment', 'Dining', 'Other']
+# Relative frequency of each category and the (mu, sigma) of its lognormal amount
+WEIGHTS = [30, 20, 5, 10, 25, 10]
+AMOUNTS = {
+    'Groceries': (3.5, 0.6),
+    'Transport': (2.5, 0.7),
+    'Utilities': (4.3, 0.4),
+    'Entertainment': (3.2, 0.8),
+    'Dining': (2.9, 0.6),
+    'Other': (3.0, 1.0),
+}
+ITEMS = {
+    'Groceries': ['Supermarket', 'Farmers market', 'Bakery'],
+    'Transport': ['Metro card', 'Taxi', 'Gas'],
+    'Utilities': ['Electricity', 'Internet', 'Water'],
+    'Entertainment': ['Cinema', 'Concert', 'Streaming'],
+    'Dining': ['Coffee', 'Lunch', 'Dinner'],
+    'Other': ['Gift', 'Pharmacy', 'Haircut'],
+}
+
+
+def generate_transactions(user_id, count, days=3 * 365, end=None, seed=0):
+    """Yield ``count`` transaction documents spread over the last ``days`` days.
+
+    Categories follow ``WEIGHTS`` and amounts a per-category lognormal; days
+    are drawn with a bias towards the recent end, where most activity is.
+    """
+    rng = random.Random(f'{seed}:{user_id}')
+    end = end or datetime(2024, 5, 1)
+    for _ in range(count):
+        category = rng.choices(CATEGORIES, WEIGHTS)[0]
+        date = end - timedelta(days=int(days * rng.betavariate(1, 1.5)))
+        amount = round(rng.lognormvariate(*AMOUNTS[category]), 2)
+        doc = transaction_fields(rng.choice(ITEMS[category]), amount, category, date)
+        doc['user_id'] = user_id
+        yield doc
+
+
+def seed(transactions, user_ids, per_user, batch_size=1000, **kwargs):
+    """Insert ``per_user`` generated transactions for every user id."""
+    for user_id in user_ids:
+        batch = []
+        for doc in generate_transactions(user_id, per_user, **kwargs):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                transactions.insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            transactions.insert_many(batch, ordered=False)
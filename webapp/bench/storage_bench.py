@@ -0,0 +1,101 @@
+"""Time the storage engines on the same repository workload.
+
+Seeds generated transactions through each engine's ``Repository``, then
+times user lookups and single-transaction reads, edits and deletes. MongoDB runs against a local
+mongod (its own ``BudgetTrackerBench`` database, dropped afterwards) or
+mongomock with ``--in-memory``; SQLite uses a temporary file unless
+``--sqlite-path`` is given:
+
+    python -m bench.storage_bench --users 5 --transactions 5000 --repeat 50
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from bench.seed import generate_transactions
+from storage import MongoRepository, SqliteRepository
+
+ENGINES = ('mongo', 'sqlite')
+
+
+def timed(timings, name, fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    timings.setdefault(name, []).append((time.perf_counter() - started) * 1000)
+    return result
+
+
+def run_workload(repository, users=5, per_user=1000, repeat=20, batch_size=1000):
+    """Seed ``users`` users and time each repository operation ``repeat`` times per user."""
+    timings = {}
+    user_ids = [repository.add_user(f'bench-{index}', 'x') for index in range(users)]
+    seeded = {}
+    for user_id in user_ids:
+        docs = list(generate_transactions(user_id, per_user))
+        for offset in range(0, len(docs), batch_size):
+            timed(timings, 'add_transactions', repository.add_transactions, docs[offset:offset + batch_size])
+        seeded[user_id] = [doc['_id'] for doc in docs]
+    for round_index in range(repeat):
+        for index, user_id in enumerate(user_ids):
+            timed(timings, 'find_user', repository.find_user, f'bench-{index}')
+            transaction_id = seeded[user_id][round_index % len(seeded[user_id])]
+            doc = timed(timings, 'get_transaction', repository.get_transaction, user_id, transaction_id)
+            timed(timings, 'update_transaction', repository.update_transaction, user_id, transaction_id,
+                  {'category': 'Other'})
+            copy = {key: value for key, value in doc.items() if key != '_id'}
+            added = repository.add_transactions([copy])
+            timed(timings, 'delete_transaction', repository.delete_transaction, user_id, added[0]['_id'])
+    return {name: {'median_ms': round(statistics.median(values), 3), 'calls': len(values)}
+            for name, values in timings.items()}
+
+
+def open_engine(engine, args, workdir):
+    if engine == 'sqlite':
+        return SqliteRepository(args.sqlite_path or os.path.join(workdir, 'bench.sqlite3')), None
+    if args.in_memory:
+        import mongomock
+        client = mongomock.MongoClient()
+    else:
+        from pymongo import MongoClient
+        client = MongoClient(args.mongo_uri)
+        client.drop_database('BudgetTrackerBench')
+    return MongoRepository(client['BudgetTrackerBench']), client
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--engine', action='append', choices=ENGINES, help='limit to one engine (repeatable)')
+    parser.add_argument('--mongo-uri', default=os.getenv('BENCH_MONGO_URI', 'mongodb://localhost:27017'))
+    parser.add_argument('--in-memory', action='store_true', help='use mongomock instead of a mongod')
+    parser.add_argument('--sqlite-path', help='SQLite file to use (default: a temporary one)')
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--transactions', type=int, default=1000, help='per user')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    report = {'config': {key: getattr(args, key) for key in ('users', 'transactions', 'repeat', 'in_memory')},
+              'engines': {}}
+    with tempfile.TemporaryDirectory() as workdir:
+        for engine in args.engine or ENGINES:
+            repository, client = open_engine(engine, args, workdir)
+            try:
+                report['engines'][engine] = run_workload(repository, args.users, args.transactions, args.repeat)
+            finally:
+                repository.close()
+                if client is not None:
+                    client.drop_database('BudgetTrackerBench')
+                    client.close()
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output)
+    else:
+        print(output)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Compare the legacy summary queries with the single ``$facet`` pipeline.
+
+Run from the webapp directory against a local mongod (the benchmark drops and
+re-seeds its own ``BudgetTrackerBench`` database):
+
+    python -m bench.summary_bench --transactions 20000 --repeat 20
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from pymongo import MongoClient
+from bench.monitor import RoundTripCounter
+from bench.seed import seed
+from pagination import fetch_page
+from summary import period_bounds, period_match, summarize
+
+USER_ID = 'bench-user'
+
+
+def legacy_summary(transactions, start, end):
+    """The three per-granularity pipelines and the aggregate+find the routes used to run."""
+    date = {'$toDate': '$date'}
+    groups = [
+        {'year': {'$year': date}, 'week': {'$week': date}},
+        {'year': {'$year': date}, 'month': {'$month': date}},
+        {'year': {'$year': date}},
+    ]
+    for group in groups:
+        list(transactions.aggregate([
+            {'$match': {'user_id': USER_ID}},
+            {'$group': {'_id': group, 'total': {'$sum': '$amount_cents'}}},
+            {'$sort': {'_id': -1}}
+        ]))
+    match = period_match(USER_ID, start, end)
+    list(transactions.aggregate([
+        {'$match': match},
+        {'$group': {'_id': '$category', 'total': {'$sum': '$amount_cents'}}},
+        {'$sort': {'total': -1}}
+    ]))
+    list(transactions.find(match))
+
+
+def facet_summary(transactions, start, end):
+    summarize(transactions, period_match(USER_ID))
+    match = period_match(USER_ID, start, end)
+    summarize(transactions, match, facets=('categories',))
+    fetch_page(transactions, match, 50)
+
+
+def measure(fn, counter, repeat, *args):
+    timings = []
+    before = counter.count
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(*args)
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        'median_ms': round(statistics.median(timings), 3),
+        'round_trips': (counter.count - before) / repeat,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongo-uri', default=os.getenv('BENCH_MONGO_URI', 'mongodb://localhost:27017'))
+    parser.add_argument('--transactions', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    counter = RoundTripCounter()
+    client = MongoClient(args.mongo_uri, event_listeners=[counter])
+    client.drop_database('BudgetTrackerBench')
+    transactions = client['BudgetTrackerBench'].transactions
+    seed(transactions, [USER_ID], args.transactions)
+
+    start, end = period_bounds(2023)
+    results = {
+        'transactions': args.transactions,
+        'legacy': measure(legacy_summary, counter, args.repeat, transactions, start, end),
+        'facet': measure(facet_summary, counter, args.repeat, transactions, start, end),
+    }
+    print(json.dumps(results, indent=2))
+    client.drop_database('BudgetTrackerBench')
+
+
+if __name__ == '__main__':
+    main()
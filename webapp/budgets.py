@@ -0,0 +1,81 @@
+"""Per-category monthly budgets.
+
+Limits are stored on the user document as ``budgets: {category key: limit
+cents}``. They are read from it, by ``_id``, whenever they are needed rather
+than kept with the cached logged-in user: that cache is per process, so a
+limit changed through one worker would go unseen by the others until it
+expired. What has been spent comes from the ``categories`` map of the
+month's rollup document, which the write path already updates with ``$inc``
+in the same operation as the month total. Checking a transaction against its
+budget is therefore two indexed reads, and only the first for a category
+without a budget.
+"""
+from daily import decode_category, encode_category
+from rollups import CATEGORY_GRANULARITY, bucket_keys
+from schema import amount_cents
+
+# Warn once spending reaches this share of the limit
+WARN_RATIO = 0.8
+
+
+def budgets_from_doc(user):
+    """Decode a user document's limits to ``{category: limit cents}``."""
+    return {decode_category(key): limit for key, limit in (user or {}).get('budgets', {}).items()}
+
+
+def load_budgets(users, user_id):
+    """The user's current limits, ``{category: limit cents}``."""
+    return budgets_from_doc(users.find_one({'_id': user_id}, {'_id': 0, 'budgets': 1}))
+
+
+def set_budget(users, user_id, category, limit_cents):
+    """Set a category's monthly limit; ``None`` removes the budget."""
+    field = f'budgets.{encode_category(category)}'
+    if limit_cents is None:
+        users.update_one({'_id': user_id}, {'$unset': {field: ''}})
+    else:
+        users.update_one({'_id': user_id}, {'$set': {field: limit_cents}})
+
+
+def month_spent(rollups, user_id, date):
+    """Spent cents per category in the month of ``date``, from its rollup document."""
+    doc = rollups.find_one(
+        {'user_id': user_id, 'granularity': CATEGORY_GRANULARITY, 'bucket': bucket_keys(date)[CATEGORY_GRANULARITY]},
+        {'_id': 0, 'categories': 1})
+    return {decode_category(key): figures['total_cents']
+            for key, figures in (doc or {}).get('categories', {}).items()}
+
+
+def budget_status(category, spent_cents, limit_cents):
+    return {
+        'category': category,
+        'spent': spent_cents / 100,
+        'limit': limit_cents / 100,
+        'remaining': (limit_cents - spent_cents) / 100,
+        'over': spent_cents > limit_cents,
+        'warning': spent_cents >= limit_cents * WARN_RATIO,
+    }
+
+
+def check_budget(rollups, user_id, budgets, transaction, pending=()):
+    """Return the budget status of the transaction's category and month, or None without a budget.
+
+    ``pending`` are transactions not in the rollups yet (queued writes); those
+    in the same category and month count as spent too.
+    """
+    category = transaction.get('category') or ''
+    if category not in budgets:
+        return None
+    spent = month_spent(rollups, user_id, transaction['date']).get(category, 0)
+    month = bucket_keys(transaction['date'])[CATEGORY_GRANULARITY]
+    spent += sum(amount_cents(doc) for doc in pending
+                 if (doc.get('category') or '') == category and bucket_keys(doc['date'])[CATEGORY_GRANULARITY] == month)
+    return budget_status(category, spent, budgets[category])
+
+
+def month_report(rollups, user_id, budgets, date):
+    """Status of every budget for the month of ``date``, largest share used first."""
+    spent = month_spent(rollups, user_id, date)
+    rows = [budget_status(category, spent.get(category, 0), limit) for category, limit in budgets.items()]
+    rows.sort(key=lambda row: row['spent'] / row['limit'] if row['limit'] else float('inf'), reverse=True)
+    return rows
@@ -0,0 +1,158 @@
+"""Read-through cache for per-user summaries.
+
+Values live in a pluggable backend: ``LRUCache`` keeps them in process,
+bounded by entry count and by their pickled size, with a TTL, ``RedisCache`` stores them in any client exposing the
+redis-py ``get``/``set``/``delete`` calls. ``SummaryCache`` builds the keys
+from the user and the query parameters and drops exactly the entries a
+changed transaction can affect.
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from schema import parse_date
+
+MISSING = object()
+
+
+class CacheBackend:
+    """Interface of the cache stores; ``get`` returns ``MISSING`` on a miss."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def delete(self, *keys):
+        raise NotImplementedError
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class LRUCache(CacheBackend):
+    """In-process LRU bounded by ``max_entries`` and ``max_bytes``; entries expire ``ttl`` seconds after being set.
+
+    Sizes are those of the pickled values (what ``RedisCache`` would store),
+    so one heavy user's summaries can't pin an unbounded amount of memory.
+    A value larger than ``max_bytes`` on its own is not cached.
+    """
+
+    def __init__(self, max_entries=1024, ttl=300, clock=time.monotonic, max_bytes=None):
+        super().__init__()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.size = 0
+        self._entries = OrderedDict()  # key -> (expires, value, size)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                self._remove(key)
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        size = len(pickle.dumps(value)) if self.max_bytes is not None else 0
+        with self._lock:
+            self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = (self.clock() + self.ttl, value, size)
+            self.size += size
+            while len(self._entries) > self.max_entries or (self.max_bytes is not None and self.size > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCache(CacheBackend):
+    """Backend for a Redis-compatible client; expiry and eviction are left to the server."""
+
+    def __init__(self, client, ttl=300, prefix='budget:'):
+        super().__init__()
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self.misses += 1
+            return MISSING
+        self.hits += 1
+        return pickle.loads(raw)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=self.ttl)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+
+class SummaryCache:
+    """Summary results keyed by user, view and period."""
+
+    # Views cached per period; the others cover the user's whole history
+    PERIOD_VIEWS = ('categories',)
+    HISTORY_VIEWS = ('spending', 'analytics')
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def key(view, user_id, year=None, month=None):
+        if year is None:
+            return f'{view}:{user_id}'
+        return f'{view}:{user_id}:{year}:{month or 0}'
+
+    def get_or_compute(self, key, compute):
+        value = self.backend.get(key)
+        if value is MISSING:
+            value = compute()
+            self.backend.set(key, value)
+        return value
+
+    def invalidate(self, user_id, *changed):
+        """Drop the entries that the given old/new versions of a transaction contribute to."""
+        keys = {self.key(view, user_id) for view in self.HISTORY_VIEWS}
+        for transaction in changed:
+            if transaction is None:
+                continue
+            date = parse_date(transaction['date'])
+            for view in self.PERIOD_VIEWS:
+                keys.add(self.key(view, user_id, date.year))
+                keys.add(self.key(view, user_id, date.year, date.month))
+        self.backend.delete(*keys)
+
+    def stats(self):
+        return self.backend.stats()
@@ -0,0 +1,149 @@
+"""Per-user daily spending buckets for arbitrary date ranges.
+
+The ``spending_daily`` collection holds one document per user and day with
+the day's total, its transaction count and the same two figures per
+category. The write routes keep it current with ``$inc`` upserts next to the
+rollups, so the summary of any range (a custom period, the last 30 days, a
+quarter, the same range a year earlier) sums at most one small document per
+day instead of scanning the range's transactions.
+
+Category names are used as field names, so ``%``, ``.`` and ``$`` are
+percent-encoded in the stored keys and an empty name is stored as ``%00``.
+"""
+from datetime import datetime
+from pymongo import UpdateOne
+from schema import amount_cents, parse_date
+
+
+def day_key(date):
+    date = parse_date(date)
+    return datetime(date.year, date.month, date.day)
+
+
+def encode_category(name):
+    return name.replace('%', '%25').replace('.', '%2E').replace('$', '%24') or '%00'
+
+
+def decode_category(key):
+    if key == '%00':
+        return ''
+    return key.replace('%24', '$').replace('%2E', '.').replace('%25', '%')
+
+
+def _inc(category, cents, count):
+    prefix = f'categories.{encode_category(category)}'
+    return {
+        'total_cents': cents, 'count': count,
+        f'{prefix}.total_cents': cents, f'{prefix}.count': count,
+    }
+
+
+def apply_daily_changes(daily, user_id, changes):
+    """Apply a batch of ``(old, new)`` transaction pairs in one ``bulk_write``."""
+    totals = {}
+    for old, new in changes:
+        if old is not None:
+            _add(totals, user_id, old, -1)
+        if new is not None:
+            _add(totals, user_id, new, 1)
+    _write(daily, totals)
+
+
+def apply_daily_inserts(daily, user_id, inserted):
+    apply_daily_changes(daily, user_id, [(None, transaction) for transaction in inserted])
+
+
+def _add(totals, user_id, transaction, sign):
+    key = (user_id, day_key(transaction['date']), transaction['category'])
+    total, count = totals.get(key, (0, 0))
+    totals[key] = (total + sign * amount_cents(transaction), count + sign)
+
+
+def _write(daily, totals):
+    ops = [
+        UpdateOne({'user_id': user_id, 'day': day}, {'$inc': _inc(category, total, count)}, upsert=True)
+        for (user_id, day, category), (total, count) in totals.items()
+        if total or count
+    ]
+    if ops:
+        daily.bulk_write(ops, ordered=False)
+
+
+def range_summary(daily, user_id, start, end):
+    """Category totals of the days in [start, end), shaped like the ``categories`` facet.
+
+    Returns ``{'categories': [{'_id', 'total', 'count'}, ...], 'total', 'count', 'days'}``
+    with dollar totals, categories ordered by total, largest first.
+    """
+    categories = {}
+    days = 0
+    for doc in daily.find({'user_id': user_id, 'day': {'$gte': start, '$lt': end}},
+                          {'_id': 0, 'categories': 1}):
+        days += 1
+        for key, figures in doc.get('categories', {}).items():
+            total, count = categories.get(key, (0, 0))
+            categories[key] = (total + figures['total_cents'], count + figures['count'])
+    rows = [{'_id': decode_category(key), 'total': total / 100, 'count': count}
+            for key, (total, count) in categories.items() if count]
+    rows.sort(key=lambda row: row['total'], reverse=True)
+    return {
+        'categories': rows,
+        'total': sum(total for total, count in categories.values() if count) / 100,
+        'count': sum(count for total, count in categories.values()),
+        'days': days,
+    }
+
+
+def compute_daily(transactions, user_id=None, batch_size=1000):
+    """Daily totals from the raw transactions: ``{(user_id, day, category): (cents, count)}``."""
+    query = {} if user_id is None else {'user_id': user_id}
+    projection = {'_id': 0, 'user_id': 1, 'date': 1, 'category': 1, 'amount': 1, 'amount_cents': 1}
+    totals = {}
+    for doc in transactions.find(query, projection, batch_size=batch_size):
+        if doc.get('date') is None or (doc.get('amount') is None and doc.get('amount_cents') is None):
+            continue
+        _add(totals, doc['user_id'], dict(doc, category=doc.get('category') or ''), 1)
+    return totals
+
+
+def stored_daily(daily, user_id=None):
+    """The stored buckets in the same shape as ``compute_daily``, leaving out zeroed entries."""
+    totals = {}
+    for doc in daily.find({} if user_id is None else {'user_id': user_id}):
+        for key, figures in doc.get('categories', {}).items():
+            if figures['total_cents'] or figures['count']:
+                totals[(doc['user_id'], doc['day'], decode_category(key))] = (figures['total_cents'], figures['count'])
+    return totals
+
+
+def rebuild_daily(transactions, daily, user_id=None, batch_size=1000):
+    """Recompute the daily buckets from the raw transactions; returns the number of days written."""
+    totals = compute_daily(transactions, user_id, batch_size)
+    days = {}
+    for (owner, day, category), (total, count) in totals.items():
+        doc = days.setdefault((owner, day), {'user_id': owner, 'day': day, 'total_cents': 0, 'count': 0,
+                                             'categories': {}})
+        doc['total_cents'] += total
+        doc['count'] += count
+        doc['categories'][encode_category(category)] = {'total_cents': total, 'count': count}
+    daily.delete_many({} if user_id is None else {'user_id': user_id})
+    docs = list(days.values())
+    for index in range(0, len(docs), batch_size):
+        daily.insert_many(docs[index:index + batch_size], ordered=False)
+    return len(docs)
+
+
+def check_daily(transactions, daily, user_id=None):
+    """Compare the buckets with the raw data.
+
+    Returns ``(user_id, day, category, expected, stored)`` tuples for every
+    bucket that differs, where ``expected`` and ``stored`` are
+    ``(cents, count)`` pairs and ``None`` means absent.
+    """
+    expected = compute_daily(transactions, user_id)
+    stored = stored_daily(daily, user_id)
+    return sorted(
+        (key[0], key[1], key[2], expected.get(key), stored.get(key))
+        for key in expected.keys() | stored.keys()
+        if expected.get(key) != stored.get(key)
+    )
@@ -0,0 +1,206 @@
+"""Live updates for open pages, from one change stream per process.
+
+``ChangeFeed`` watches the database on a single background thread for
+changes to ``transactions`` and ``spending_rollups`` and hands each one to
+the subscriptions of the user it belongs to, so any number of open pages
+cost one change stream per process. A page receives the changed transaction
+(``transaction`` events) and the rollup totals the write moved (``totals``
+events) as Server-Sent Events and patches itself, instead of reloading and
+re-running its queries. Totals come from the rollup documents' own changes,
+so they are the values actually written.
+
+Change streams need a replica set; a single-node one is enough (see the
+README). A delete event carries only the document's ``_id``, so deleted
+transactions are routed by their pre-image, which ``flask
+enable-change-events`` turns on (MongoDB 6.0+); without it deletes are not
+pushed. The thread resumes after the last event it saw when the stream
+fails, waiting ``retry_delay`` seconds at first and twice as long after
+each further failure, up to ``max_retry_delay``; a subscriber that falls ``max_events`` behind is sent
+``resync`` and dropped, so its page reloads.
+"""
+import asyncio
+import json
+import logging
+import queue
+import threading
+from api import serialize
+
+logger = logging.getLogger(__name__)
+
+WATCHED = ('transactions', 'spending_rollups')
+PIPELINE = [{'$match': {
+    'ns.coll': {'$in': list(WATCHED)},
+    'operationType': {'$in': ['insert', 'update', 'replace', 'delete']},
+}}]
+
+
+def to_event(change):
+    """Translate a change document to ``(user_id, event name, data)``, or None if it can't be routed."""
+    operation = change['operationType']
+    doc = change.get('fullDocument') or change.get('fullDocumentBeforeChange')
+    if doc is None or 'user_id' not in doc:
+        return None
+    if change['ns']['coll'] == 'transactions':
+        if operation == 'delete':
+            return doc['user_id'], 'transaction', {'op': 'delete', 'id': str(change['documentKey']['_id'])}
+        if change.get('fullDocument') is None:
+            return None
+        return doc['user_id'], 'transaction', {'op': 'insert' if operation == 'insert' else 'update',
+                                               'transaction': serialize(change['fullDocument'])}
+    if operation == 'delete' or change.get('fullDocument') is None:
+        return None
+    return doc['user_id'], 'totals', {'granularity': doc['granularity'], 'bucket': doc['bucket'],
+                                      'total': doc['total_cents'] / 100, 'count': doc['count']}
+
+
+def format_event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data)}\n\n'
+
+
+class Subscription:
+    """One open page's events, read from a request thread."""
+
+    def __init__(self, user_id, max_events=100):
+        self.user_id = user_id
+        self.closed = False
+        self._queue = queue.Queue(max_events)
+
+    def put(self, event):
+        """Called on the feed thread; a full queue closes the subscription."""
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.closed = True
+
+    def get(self, timeout):
+        """The next ``(name, data)`` event, or None after ``timeout`` seconds."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription(Subscription):
+    """A subscription read on an event loop, so an open page doesn't hold a thread."""
+
+    def __init__(self, user_id, loop, max_events=100):
+        self.user_id = user_id
+        self.closed = False
+        self._loop = loop
+        self._queue = asyncio.Queue(max_events)
+
+    def put(self, event):
+        self._loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.closed = True
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+def event_stream(feed, subscription, keepalive=15):
+    """Server-Sent Events for a subscription, with a comment every ``keepalive`` seconds."""
+    try:
+        yield 'retry: 3000\n\n'
+        while not subscription.closed:
+            event = subscription.get(keepalive)
+            yield format_event(*event) if event else ': keepalive\n\n'
+        yield format_event('resync', {})
+    finally:
+        feed.unsubscribe(subscription)
+
+
+async def async_event_stream(feed, subscription, keepalive=15):
+    """``event_stream`` for an ``AsyncSubscription``."""
+    try:
+        yield 'retry: 3000\n\n'
+        while not subscription.closed:
+            event = await subscription.get(keepalive)
+            yield format_event(*event) if event else ': keepalive\n\n'
+        yield format_event('resync', {})
+    finally:
+        feed.unsubscribe(subscription)
+
+
+class ChangeFeed:
+    def __init__(self, db, retry_delay=1.0, max_await_ms=1000, max_retry_delay=60.0):
+        self.db = db
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_await_ms = max_await_ms
+        self.resume_token = None
+        self._subscribers = {}  # user_id -> set of subscriptions
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, user_id, subscription=None):
+        subscription = subscription or Subscription(user_id)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.user_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscribers.pop(subscription.user_id, None)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscribers.values())
+
+    def publish(self, change):
+        """Hand one change document to the subscriptions of its user."""
+        event = to_event(change)
+        if event is None:
+            return
+        user_id, name, data = event
+        with self._lock:
+            subscriptions = list(self._subscribers.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.put((name, data))
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='change-feed', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+
+    def watch(self):
+        """Open the change stream, resuming after the last event seen."""
+        return self.db.watch(PIPELINE, full_document='updateLookup', full_document_before_change='whenAvailable',
+                             resume_after=self.resume_token, max_await_time_ms=self.max_await_ms)
+
+    def _run(self):
+        delay = self.retry_delay
+        while not self._stop.is_set():
+            try:
+                with self.watch() as stream:
+                    delay = self.retry_delay  # opened, so a later failure starts the backoff over
+                    while not self._stop.is_set() and stream.alive:
+                        change = stream.try_next()
+                        if change is not None:
+                            self.publish(change)
+                        self.resume_token = stream.resume_token
+            except Exception:
+                # Keep the thread alive; the stream resumes from resume_token. Backing
+                # off keeps a server without a replica set from being retried every second
+                logger.exception('Change stream failed, retrying in %.0fs', delay)
+                self._stop.wait(delay)
+                delay = min(delay * 2, self.max_retry_delay)
@@ -0,0 +1,51 @@
+"""Streaming export of transactions as CSV or JSON Lines.
+
+The generators here pull documents from a batched cursor and yield encoded
+chunks as they go, so an export starts downloading at once and holds at
+most one chunk of rows in memory. The columns match what the importer reads.
+"""
+import csv
+import io
+import json
+from schema import amount_cents, to_view
+
+COLUMNS = ('item_name', 'amount', 'category', 'date')
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+}
+
+
+def export_row(transaction):
+    view = to_view(transaction)
+    cents = amount_cents(transaction)
+    sign = '-' if cents < 0 else ''
+    view['amount'] = f'{sign}{abs(cents) // 100}.{abs(cents) % 100:02d}'
+    return {column: view.get(column) for column in COLUMNS}
+
+
+def csv_chunks(cursor, rows_per_chunk=100):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=COLUMNS)
+    writer.writeheader()
+    for count, transaction in enumerate(cursor, start=1):
+        writer.writerow(export_row(transaction))
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def jsonl_chunks(cursor, rows_per_chunk=100):
+    lines = []
+    for transaction in cursor:
+        lines.append(json.dumps(export_row(transaction)) + '\n')
+        if len(lines) >= rows_per_chunk:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
+
+
+def export_chunks(cursor, fmt):
+    return csv_chunks(cursor) if fmt == 'csv' else jsonl_chunks(cursor)
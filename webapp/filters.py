@@ -0,0 +1,71 @@
+"""Search and filters over a user's transactions.
+
+The dashboard, the summaries, the export and the JSON API all read the same
+query arguments: ``q`` (words matched as prefixes of the item name's words),
+``category`` and ``min``/``max`` amounts. Dates are selected by each route
+as before (``year``/``month`` or ``start``/``end``/``range``).
+``apply_filters`` adds them to a ``period_match`` query, where every clause
+is backed by an index with ``user_id`` as its prefix: search words by the
+multikey ``user_search`` index on ``search_terms``, categories by
+``user_category`` and amounts by ``user_amount``.
+"""
+import re
+from collections import namedtuple
+from schema import search_terms, to_cents
+
+PARAMS = ('q', 'category', 'min', 'max')
+# Only the first words of a search bound the index scan; more just filter further
+MAX_TERMS = 5
+
+Filters = namedtuple('Filters', 'terms category min_cents max_cents')
+NO_FILTERS = Filters((), None, None, None)
+
+
+def parse_filters(args):
+    """Read ``Filters`` from query arguments; raises ValueError for a bad amount or range."""
+    category = (args.get('category') or '').strip() or None
+    min_cents = to_cents(args['min']) if args.get('min') else None
+    max_cents = to_cents(args['max']) if args.get('max') else None
+    if min_cents is not None and max_cents is not None and min_cents > max_cents:
+        raise ValueError('min is above max')
+    return Filters(tuple(search_terms(args.get('q'))[:MAX_TERMS]), category, min_cents, max_cents)
+
+
+def is_filtered(filters):
+    return filters != NO_FILTERS
+
+
+def apply_filters(match, filters):
+    """Return a copy of ``match`` narrowed by ``filters``."""
+    match = dict(match)
+    if filters.terms:
+        # Anchored, case-sensitive regexes on the lower-cased words become index range scans
+        patterns = [re.compile('^' + re.escape(term)) for term in filters.terms]
+        match['search_terms'] = patterns[0]
+        if len(patterns) > 1:
+            match['$and'] = [{'search_terms': pattern} for pattern in patterns[1:]]
+    if filters.category is not None:
+        match['category'] = filters.category
+    if filters.min_cents is not None or filters.max_cents is not None:
+        # Legacy float amounts get amount_cents from `flask migrate-transactions`
+        amount = {}
+        if filters.min_cents is not None:
+            amount['$gte'] = filters.min_cents
+        if filters.max_cents is not None:
+            amount['$lte'] = filters.max_cents
+        match['amount_cents'] = amount
+    return match
+
+
+def filter_args(filters):
+    """The query arguments that reproduce ``filters``, for links and forms."""
+    args = {}
+    if filters.terms:
+        args['q'] = ' '.join(filters.terms)
+    if filters.category is not None:
+        args['category'] = filters.category
+    if filters.min_cents is not None:
+        args['min'] = f'{filters.min_cents / 100:.2f}'
+    if filters.max_cents is not None:
+        args['max'] = f'{filters.max_cents / 100:.2f}'
+    return args
@@ -0,0 +1,80 @@
+"""Gunicorn settings for running the web app in production.
+
+    gunicorn app:app
+
+Gunicorn reads this file from the working directory. Every worker imports
+the app itself after the fork (``preload_app = False``), so each one builds
+its own MongoClient and connection pool; sizes and timeouts come from the
+``MONGO_*`` variables read in ``app.py``. Several workers are only started
+with ``CACHE_BACKEND=redis``. A worker pings MongoDB before it
+accepts requests. When it exits it stops its recurring-transaction
+scheduler (handing its lease to another worker), password hashing pool and
+change stream, writes any queued transactions and closes its client.
+"""
+import glob
+import multiprocessing
+import os
+import sys
+import tempfile
+
+bind = os.getenv('BIND', '0.0.0.0:3000')
+# A write invalidates cached summaries only in the worker that handled it, so
+# several workers need the shared Redis cache; the in-memory one gets one
+# worker with threads instead
+shared_cache = os.getenv('CACHE_BACKEND', 'memory') == 'redis'
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1 if shared_cache else 1))
+threads = int(os.getenv('WEB_THREADS', 1 if shared_cache else 4))
+if workers > 1 and not shared_cache:
+    sys.exit('WEB_CONCURRENCY > 1 needs CACHE_BACKEND=redis: with the in-memory cache, '
+             'other workers would serve stale summaries until CACHE_TTL expires')
+# Tell the app how many workers share the load (see WRITE_BEHIND in app.py)
+os.environ['WEB_CONCURRENCY'] = str(workers)
+if workers > 1:
+    # Workers share their /metrics numbers through snapshot files (see metrics.py)
+    os.environ.setdefault('METRICS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'budget-metrics'))
+# Every open /events stream holds a thread here; with live updates in use, run
+# `gunicorn -k uvicorn.workers.UvicornWorker asgi:application` (or raise WEB_THREADS)
+worker_class = os.getenv('WEB_WORKER_CLASS', 'sync')
+if os.getenv('LIVE_UPDATES') == '1' and worker_class == 'sync' and threads == 1:
+    sys.exit('LIVE_UPDATES=1 needs WEB_THREADS > 1 or the uvicorn worker: '
+             'each open page would hold a whole sync worker')
+timeout = int(os.getenv('WEB_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+# Restart workers now and then to cap the growth of long-lived processes
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+preload_app = False
+accesslog = '-'
+
+
+def on_starting(server):
+    directory = os.getenv('METRICS_MULTIPROC_DIR')
+    if directory:
+        # Start the counters from zero, not from the last run's snapshots
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            os.remove(path)
+
+
+def post_worker_init(worker):
+    from app import warm_up_pool
+    try:
+        warm_up_pool()
+    except Exception:
+        # The pool fills on the first request instead
+        worker.log.exception('MongoDB warm-up failed')
+
+
+def worker_exit(server, worker):
+    app = sys.modules.get('app')
+    if app is not None:
+        if app.request_metrics.multiprocess_dir:
+            # Keep this worker's counts in the totals after it is gone
+            app.request_metrics.dump()
+        app.recurring_scheduler.stop(timeout=5)
+        app.password_hasher.shutdown()
+        # Queued transactions must be written before the client goes away
+        app.write_queue.close(timeout=10)
+        app.change_feed.stop(timeout=2)
+        app.client.close()
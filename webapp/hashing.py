@@ -0,0 +1,78 @@
+"""Password hashing on a bounded worker pool.
+
+bcrypt is slow on purpose, so hashing on the request thread lets a burst of
+logins take every CPU the dashboard needs. ``PasswordHasher`` runs the
+Flask-Bcrypt calls on a small thread pool instead (bcrypt releases the GIL
+while it hashes, so threads run in parallel without forking). At most
+``workers`` hashes run at once and at most ``max_pending`` more wait for a
+worker; past that, ``HasherBusy`` is raised at once and the route answers
+503, so excess logins are shed instead of queueing behind each other.
+
+The work factor is Flask-Bcrypt's ``BCRYPT_LOG_ROUNDS``. ``needs_rehash``
+tells the login route when a stored hash was made with a different cost, so
+it can be replaced with the password the user just typed.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class HasherBusy(RuntimeError):
+    """The hashing pool and its queue are full."""
+
+
+def hash_cost(hashed):
+    """The log2 work factor of a bcrypt hash ('$2b$12$...' -> 12), or None if it is not one."""
+    if isinstance(hashed, bytes):
+        hashed = hashed.decode('utf-8', 'replace')
+    parts = str(hashed).split('$')
+    try:
+        return int(parts[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    def __init__(self, bcrypt, rounds, workers=2, max_pending=16, metrics=None):
+        self.bcrypt = bcrypt
+        self.rounds = rounds
+        self.metrics = metrics
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+
+    def hash(self, password):
+        """A new hash of ``password`` at the configured cost, as a string."""
+        return self._run('hash', lambda: self.bcrypt.generate_password_hash(password, self.rounds).decode('utf-8'))
+
+    def check(self, hashed, password):
+        return self._run('check', lambda: self.bcrypt.check_password_hash(hashed, password))
+
+    def needs_rehash(self, hashed):
+        return hash_cost(hashed) != self.rounds
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def _run(self, operation, work):
+        if not self._slots.acquire(blocking=False):
+            if self.metrics:
+                self.metrics.increment('password_hash_rejected_total', operation)
+            raise HasherBusy(f'Too many password {operation} jobs in progress')
+        submitted = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            try:
+                return work()
+            finally:
+                if self.metrics:
+                    self.metrics.observe('password_hash_wait_seconds', operation, started - submitted)
+                    self.metrics.observe('password_hash_seconds', operation, time.perf_counter() - started)
+                self._slots.release()
+
+        try:
+            future = self._executor.submit(job)
+        except RuntimeError:
+            self._slots.release()
+            raise
+        return future.result()
@@ -0,0 +1,102 @@
+"""Streaming bulk import of transactions from CSV or JSON Lines.
+
+Rows are parsed one at a time from the uploaded stream, validated into the
+same fields the add-transaction form writes, and inserted in unordered
+``insert_many`` batches, so neither the file nor the result set is ever
+held in memory whole.
+"""
+import csv
+import json
+from pymongo.errors import BulkWriteError
+from schema import transaction_fields
+
+FIELDS = ('item_name', 'amount', 'category', 'date')
+FORMATS = ('csv', 'jsonl')
+MAX_REPORTED_ERRORS = 20
+
+
+class ImportResult:
+    def __init__(self):
+        self.accepted = 0
+        self.rejected = 0
+        self.errors = []
+
+    def reject(self, line, message):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f'line {line}: {message}')
+
+
+def detect_format(filename):
+    """Guess the format from a file name, defaulting to CSV."""
+    name = (filename or '').lower()
+    return 'jsonl' if name.endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def iter_rows(stream, fmt):
+    """Yield ``(line number, row dict)`` pairs from a text stream."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_num, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_num, row if isinstance(row, dict) else None
+
+
+def parse_row(row):
+    """Validate a row and return the typed transaction fields; raises ValueError."""
+    if row is None:
+        raise ValueError('not a JSON object')
+    # Only absent or blank values are missing: a JSON amount of 0 is a value
+    missing = [field for field in FIELDS if row.get(field) is None or not str(row[field]).strip()]
+    if missing:
+        raise ValueError('missing ' + ', '.join(missing))
+    return transaction_fields(str(row['item_name']).strip(), row['amount'],
+                              str(row['category']).strip(), str(row['date']).strip())
+
+
+def import_transactions(transactions, stream, fmt, user_id, batch_size=500, on_batch=None):
+    """Import every valid row of ``stream`` for ``user_id``.
+
+    ``on_batch`` is called with the documents of each batch that were
+    actually inserted, so derived data can be updated per batch.
+    """
+    result = ImportResult()
+    batch, lines = [], []
+    for line_num, row in iter_rows(stream, fmt):
+        try:
+            doc = parse_row(row)
+        except (ValueError, TypeError) as error:
+            result.reject(line_num, str(error))
+            continue
+        doc['user_id'] = user_id
+        batch.append(doc)
+        lines.append(line_num)
+        if len(batch) >= batch_size:
+            _insert_batch(transactions, batch, lines, result, on_batch)
+            batch, lines = [], []
+    if batch:
+        _insert_batch(transactions, batch, lines, result, on_batch)
+    return result
+
+
+def _insert_batch(transactions, batch, lines, result, on_batch):
+    """Insert one batch; ``lines`` holds the source line of each document, for error reports."""
+    try:
+        transactions.insert_many(batch, ordered=False)
+        inserted = batch
+    except BulkWriteError as error:
+        failed = {write_error['index'] for write_error in error.details['writeErrors']}
+        inserted = [doc for index, doc in enumerate(batch) if index not in failed]
+        for index in sorted(failed):
+            result.reject(lines[index], f"write failed for {batch[index]['item_name']!r}")
+    result.accepted += len(inserted)
+    if on_batch and inserted:
+        on_batch(inserted)
@@ -0,0 +1,99 @@
+"""Index declarations and query-plan checks.
+
+``INDEXES`` lists every index the routes rely on. ``ensure_indexes`` creates
+them idempotently (MongoDB ignores a ``createIndexes`` for an index that
+already exists with the same definition), and ``check_query_plans`` runs the
+routes' queries through ``explain`` and reports any that fall back to a
+collection scan.
+"""
+from datetime import datetime
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from filters import Filters, apply_filters
+from summary import build_pipeline, period_bounds, period_match
+
+INDEXES = {
+    'users': [
+        IndexModel([('username', ASCENDING)], name='username_unique', unique=True),
+    ],
+    'transactions': [
+        # Serves the per-user listing, the date range match and (date, _id) ordering
+        IndexModel([('user_id', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)], name='user_date'),
+        # Search and filters (see filters.py); search_terms is an array, so user_search is multikey
+        IndexModel([('user_id', ASCENDING), ('search_terms', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)],
+                   name='user_search'),
+        IndexModel([('user_id', ASCENDING), ('category', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)],
+                   name='user_category'),
+        IndexModel([('user_id', ASCENDING), ('amount_cents', ASCENDING)], name='user_amount'),
+        # Idempotency key of materialized recurring occurrences; other transactions don't have one
+        IndexModel([('recurrence_key', ASCENDING)], name='recurrence_key_unique', unique=True, sparse=True),
+    ],
+    'spending_rollups': [
+        IndexModel([('user_id', ASCENDING), ('granularity', ASCENDING), ('bucket', ASCENDING)],
+                   name='user_granularity_bucket', unique=True),
+    ],
+    'recurring': [
+        IndexModel([('next_due', ASCENDING)], name='next_due'),
+        IndexModel([('user_id', ASCENDING)], name='user_id'),
+    ],
+    'spending_daily': [
+        IndexModel([('user_id', ASCENDING), ('day', ASCENDING)], name='user_day', unique=True),
+    ],
+}
+
+
+def ensure_indexes(db):
+    """Create every declared index; returns the names reported by the server."""
+    created = []
+    for collection, models in INDEXES.items():
+        created.extend(db[collection].create_indexes(models))
+    return created
+
+
+def route_queries(user_id='000000000000000000000000'):
+    """The queries the routes issue, as ``(label, explain command)`` pairs."""
+    start, end = period_bounds(datetime.now().year, 1)
+    return [
+        ('load_user', {'find': 'users', 'filter': {'_id': ObjectId(user_id)}}),
+        ('login/register', {'find': 'users', 'filter': {'username': 'someone'}}),
+        ('home', {'find': 'transactions', 'filter': {'user_id': user_id},
+                  'sort': {'date': -1, '_id': -1}, 'limit': 51}),
+        ('home (search)', {'find': 'transactions', 'sort': {'date': -1, '_id': -1}, 'limit': 51,
+                           'filter': apply_filters({'user_id': user_id}, Filters(('coff',), None, None, None))}),
+        ('home (category)', {'find': 'transactions', 'sort': {'date': -1, '_id': -1}, 'limit': 51,
+                             'filter': apply_filters({'user_id': user_id}, Filters((), 'Food', None, None))}),
+        ('home (amount)', {'find': 'transactions', 'sort': {'date': -1, '_id': -1}, 'limit': 51,
+                           'filter': apply_filters({'user_id': user_id}, Filters((), None, 10000, None))}),
+        ('edit/delete', {'find': 'transactions', 'filter': {'_id': ObjectId(), 'user_id': user_id}}),
+        ('detailed_spending_summary', {
+            'aggregate': 'transactions',
+            'pipeline': build_pipeline(period_match(user_id, start, end), ('categories',)),
+            'cursor': {},
+        }),
+        ('detailed_spending_summary (page)', {'find': 'transactions', 'filter': period_match(user_id, start, end),
+                                              'sort': {'date': -1, '_id': -1}, 'limit': 51}),
+        ('spending_summary', {'find': 'spending_rollups', 'filter': {'user_id': user_id, 'count': {'$gt': 0}}}),
+        ('detailed_spending_summary (range)', {'find': 'spending_daily',
+                                               'filter': {'user_id': user_id, 'day': {'$gte': start, '$lt': end}}}),
+    ]
+
+
+def find_collscans(explain):
+    """Return True if the winning plan of an explain result contains a COLLSCAN stage."""
+    if isinstance(explain, dict):
+        if explain.get('stage') == 'COLLSCAN':
+            return True
+        return any(find_collscans(value) for key, value in explain.items() if key != 'rejectedPlans')
+    if isinstance(explain, list):
+        return any(find_collscans(value) for value in explain)
+    return False
+
+
+def check_query_plans(db, queries=None):
+    """Explain each route query and return the labels of those that scan a whole collection."""
+    failures = []
+    for label, command in queries or route_queries():
+        explain = db.command('explain', command, verbosity='queryPlanner')
+        if find_collscans(explain):
+            failures.append(label)
+    return failures
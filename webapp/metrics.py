@@ -0,0 +1,282 @@
+"""Per-request performance metrics in the Prometheus text format.
+
+``RequestMetrics`` is both a Flask extension and a PyMongo command listener.
+Each request gets a trace on its thread; the listener adds every MongoDB
+command issued from that thread to it (round trips and time spent waiting on
+the server) and the template signals add rendering time. When the request
+finishes, the trace is folded into per-route histograms, and requests slower
+than ``slow_threshold`` seconds are logged with the commands they ran,
+aggregation pipelines included.
+
+Every worker process keeps its own numbers. With ``multiprocess_dir`` set
+(``METRICS_MULTIPROC_DIR``), each process writes a snapshot of them to
+``<pid>.json`` in that directory at most every ``dump_interval`` seconds
+and when it exits, and ``render`` sums the snapshots of every process, so
+a scrape that lands on any worker sees the totals of all of them and the
+counters of restarted workers are kept.
+"""
+import glob
+import json
+import os
+import threading
+import time
+from bson import json_util
+from flask import request, before_render_template, template_rendered
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+MAX_TRACED_COMMANDS = 50
+# Command fields worth showing in the slow log, besides the collection name
+COMMAND_DETAILS = ('filter', 'pipeline', 'sort', 'updates', 'deletes', 'q', 'u')
+
+HISTOGRAMS = {
+    'request_duration_seconds': ('Request latency by route.', LATENCY_BUCKETS),
+    'request_mongo_seconds': ('Time spent waiting on MongoDB per request.', LATENCY_BUCKETS),
+    'request_template_seconds': ('Time spent rendering templates per request.', LATENCY_BUCKETS),
+    'request_mongo_round_trips': ('MongoDB commands sent per request.', ROUND_TRIP_BUCKETS),
+    'password_hash_seconds': ('Time spent computing password hashes, by operation.', LATENCY_BUCKETS),
+    'password_hash_wait_seconds': ('Time password hash jobs waited for a worker, by operation.', LATENCY_BUCKETS),
+}
+# Series label of each histogram other than the per-route request ones
+HISTOGRAM_LABELS = {'password_hash_seconds': 'operation', 'password_hash_wait_seconds': 'operation'}
+COUNTERS = {
+    'password_hash_rejected_total': ('Password hash jobs refused because the pool was full.', 'operation'),
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+    def merge(self, counts, count, total):
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, counts)]
+        self.count += count
+        self.sum += total
+
+
+class Trace:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.mongo_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_started = None
+        self.round_trips = 0
+        self.commands = []
+
+
+def describe_command(event):
+    command = event.command
+    details = {'command': event.command_name, 'collection': command.get(event.command_name)}
+    details.update((field, command[field]) for field in COMMAND_DETAILS if field in command)
+    return details
+
+
+def label_string(labels):
+    return ','.join(f'{name}="{value}"' for name, value in labels)
+
+
+class RequestMetrics(monitoring.CommandListener):
+    def __init__(self, prefix='budget_', slow_threshold=None, logger=None, multiprocess_dir=None, dump_interval=1.0):
+        self.prefix = prefix
+        self.slow_threshold = slow_threshold
+        self.logger = logger
+        self.multiprocess_dir = multiprocess_dir
+        self.dump_interval = dump_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._last_dump = 0.0
+        self.histograms = {}
+        self.requests = {}
+        self.commands = {}
+        self.counters = {}
+
+    def init_app(self, app):
+        if self.logger is None:
+            self.logger = app.logger
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_finished, app)
+
+    # Request lifecycle
+
+    def start_trace(self):
+        self._local.trace = Trace()
+        return self._local.trace
+
+    def current_trace(self):
+        return getattr(self._local, 'trace', None)
+
+    def finish_trace(self, route, method, status, path=None):
+        trace = self.current_trace()
+        if trace is None:
+            return None
+        self._local.trace = None
+        duration = time.perf_counter() - trace.started
+        with self._lock:
+            for name, value in (('request_duration_seconds', duration),
+                                ('request_mongo_seconds', trace.mongo_seconds),
+                                ('request_template_seconds', trace.template_seconds),
+                                ('request_mongo_round_trips', trace.round_trips)):
+                self._observe(name, route, value)
+            key = (route, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+        if self.slow_threshold is not None and duration >= self.slow_threshold:
+            self.log_slow(trace, duration, route, method, path)
+        if self.multiprocess_dir and time.monotonic() - self._last_dump >= self.dump_interval:
+            self.dump()
+        return trace
+
+    def observe(self, name, label, value):
+        """Add ``value`` to the series ``label`` of one of ``HISTOGRAMS``."""
+        with self._lock:
+            self._observe(name, label, value)
+
+    def increment(self, name, label):
+        with self._lock:
+            self.counters[(name, label)] = self.counters.get((name, label), 0) + 1
+
+    def _observe(self, name, label, value):
+        key = (name, label)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram(HISTOGRAMS[name][1])
+        self.histograms[key].observe(value)
+
+    def log_slow(self, trace, duration, route, method, path):
+        self.logger.warning('Slow request %s %s (%s): %.1f ms total, %.1f ms MongoDB in %d round trips, '
+                            '%.1f ms templates; commands: %s',
+                            method, path, route, duration * 1000, trace.mongo_seconds * 1000,
+                            trace.round_trips, trace.template_seconds * 1000, json_util.dumps(trace.commands))
+
+    def _before_request(self):
+        self.start_trace()
+
+    def _after_request(self, response):
+        route, method, path = request.endpoint or 'unmatched', request.method, request.path
+        finish = lambda: self.finish_trace(route, method, response.status_code, path)
+        if response.is_streamed:
+            # The body (and its queries) is produced after this hook returns
+            response.call_on_close(finish)
+        else:
+            finish()
+        return response
+
+    def _template_started(self, sender, **extra):
+        trace = self.current_trace()
+        if trace is not None:
+            trace.template_started = time.perf_counter()
+
+    def _template_finished(self, sender, **extra):
+        trace = self.current_trace()
+        if trace is not None and trace.template_started is not None:
+            trace.template_seconds += time.perf_counter() - trace.template_started
+            trace.template_started = None
+
+    # CommandListener
+
+    def started(self, event):
+        with self._lock:
+            self.commands[event.command_name] = self.commands.get(event.command_name, 0) + 1
+        trace = self.current_trace()
+        if trace is not None:
+            trace.round_trips += 1
+            if len(trace.commands) < MAX_TRACED_COMMANDS:
+                trace.commands.append(describe_command(event))
+
+    def succeeded(self, event):
+        trace = self.current_trace()
+        if trace is not None:
+            trace.mongo_seconds += event.duration_micros / 1e6
+
+    def failed(self, event):
+        self.succeeded(event)
+
+    # Sharing between worker processes
+
+    def snapshot(self):
+        """This process's numbers as JSON-serializable lists."""
+        with self._lock:
+            return {
+                'histograms': [[list(key), h.counts, h.count, h.sum] for key, h in self.histograms.items()],
+                'requests': [[list(key), count] for key, count in self.requests.items()],
+                'commands': [[name, count] for name, count in self.commands.items()],
+                'counters': [[list(key), count] for key, count in self.counters.items()],
+            }
+
+    def dump(self):
+        """Write this process's snapshot to ``multiprocess_dir`` (atomically replacing the last one)."""
+        self._last_dump = time.monotonic()
+        path = os.path.join(self.multiprocess_dir, f'{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as handle:
+            json.dump(self.snapshot(), handle)
+        os.replace(path + '.tmp', path)
+
+    def combined(self):
+        """A ``RequestMetrics`` holding the sum of every process's last snapshot, this one's current."""
+        self.dump()
+        total = RequestMetrics(self.prefix)
+        for path in glob.glob(os.path.join(self.multiprocess_dir, '*.json')):
+            try:
+                with open(path) as handle:
+                    snapshot = json.load(handle)
+            except (OSError, ValueError):
+                continue  # a process exiting mid-write; its previous snapshot is gone with it
+            for (name, label), counts, count, value_sum in snapshot['histograms']:
+                key = (name, label)
+                if key not in total.histograms:
+                    total.histograms[key] = Histogram(HISTOGRAMS[name][1])
+                total.histograms[key].merge(counts, count, value_sum)
+            for target, rows in ((total.requests, snapshot['requests']), (total.counters, snapshot['counters'])):
+                for key, count in rows:
+                    target[tuple(key)] = target.get(tuple(key), 0) + count
+            for name, count in snapshot['commands']:
+                total.commands[name] = total.commands.get(name, 0) + count
+        return total
+
+    # Exposition
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format, summed over processes if shared."""
+        if self.multiprocess_dir:
+            return self.combined().render()
+        lines = []
+        with self._lock:
+            for name, (help_text, buckets) in HISTOGRAMS.items():
+                metric = self.prefix + name
+                label = HISTOGRAM_LABELS.get(name, 'route')
+                lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} histogram']
+                for (hist_name, value), histogram in sorted(self.histograms.items()):
+                    if hist_name != name:
+                        continue
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f'{metric}_bucket{{{label}="{value}",le="{bound}"}} {count}')
+                    lines.append(f'{metric}_bucket{{{label}="{value}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{metric}_sum{{{label}="{value}"}} {histogram.sum}')
+                    lines.append(f'{metric}_count{{{label}="{value}"}} {histogram.count}')
+            metric = self.prefix + 'requests_total'
+            lines += [f'# HELP {metric} Requests by route, method and status.', f'# TYPE {metric} counter']
+            for (route, method, status), count in sorted(self.requests.items()):
+                labels = label_string((('route', route), ('method', method), ('status', status)))
+                lines.append(f'{metric}{{{labels}}} {count}')
+            metric = self.prefix + 'mongo_commands_total'
+            lines += [f'# HELP {metric} MongoDB commands by name.', f'# TYPE {metric} counter']
+            for command, count in sorted(self.commands.items()):
+                lines.append(f'{metric}{{command="{command}"}} {count}')
+            for name, (help_text, label) in COUNTERS.items():
+                metric = self.prefix + name
+                lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+                for (counter_name, value), count in sorted(self.counters.items()):
+                    if counter_name == name:
+                        lines.append(f'{metric}{{{label}="{value}"}} {count}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,57 @@
+"""Batch migration of legacy transactions to the typed storage format.
+
+Legacy documents (string ``date``, float ``amount`` or no ``search_terms``)
+are streamed in ``_id`` order and converted with one ``bulk_write`` per
+batch. The last converted ``_id`` is checkpointed after every batch, so an
+interrupted run resumes where it stopped instead of rescanning the
+collection.
+"""
+from pymongo import UpdateOne
+from schema import typed_fields
+
+MIGRATION_ID = 'typed-transactions'
+LEGACY_QUERY = {'$or': [{'amount_cents': {'$exists': False}}, {'date': {'$type': 'string'}},
+                        {'search_terms': {'$exists': False}}]}
+
+
+def migrate_transactions(transactions, checkpoints, batch_size=500, restart=False):
+    """Convert legacy transactions in place and return ``(migrated, failed)`` counts.
+
+    Documents whose date or amount cannot be parsed are left untouched and
+    counted as failed.
+    """
+    if restart:
+        checkpoints.delete_one({'_id': MIGRATION_ID})
+    checkpoint = checkpoints.find_one({'_id': MIGRATION_ID}) or {}
+    query = dict(LEGACY_QUERY)
+    if checkpoint.get('last_id') is not None:
+        query['_id'] = {'$gt': checkpoint['last_id']}
+
+    migrated = failed = 0
+    cursor = transactions.find(query, {'amount': 1, 'amount_cents': 1, 'date': 1, 'item_name': 1}).sort('_id', 1).batch_size(batch_size)
+    ops = []
+    last_id = None
+    for doc in cursor:
+        last_id = doc['_id']
+        try:
+            fields = typed_fields(doc)
+        except (KeyError, TypeError, ValueError):
+            failed += 1
+            continue
+        ops.append(UpdateOne({'_id': doc['_id']}, {'$set': fields, '$unset': {'amount': ''}}))
+        if len(ops) >= batch_size:
+            migrated += _flush(transactions, checkpoints, ops, last_id)
+            ops = []
+    if ops or last_id is not None:
+        migrated += _flush(transactions, checkpoints, ops, last_id)
+    # A finished run starts from the beginning next time, picking up legacy
+    # documents written by app instances that were still on the old format
+    checkpoints.delete_one({'_id': MIGRATION_ID})
+    return migrated, failed
+
+
+def _flush(transactions, checkpoints, ops, last_id):
+    if ops:
+        transactions.bulk_write(ops, ordered=False)
+    checkpoints.update_one({'_id': MIGRATION_ID}, {'$set': {'last_id': last_id}}, upsert=True)
+    return len(ops)
@@ -0,0 +1,88 @@
+"""Keyset (seek) pagination over a user's transactions.
+
+Pages are ordered newest first on ``(date, _id)`` and a page boundary is
+encoded as an opaque cursor holding the boundary document's date and id.
+Fetching a page is an index range scan from that boundary, never a
+``skip()``, so every page costs the same however deep into the history it is.
+"""
+import base64
+import json
+from collections import namedtuple
+from datetime import datetime
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING
+
+# Only the fields the listing templates display
+LIST_FIELDS = {'item_name': 1, 'amount': 1, 'amount_cents': 1, 'category': 1, 'date': 1}
+
+Page = namedtuple('Page', ['items', 'next_cursor', 'prev_cursor'])
+
+
+def encode_cursor(transaction):
+    date = transaction['date']
+    if isinstance(date, datetime):
+        key = {'d': date.isoformat(), 't': 'date'}
+    else:
+        key = {'d': date, 't': 'str'}
+    key['id'] = str(transaction['_id'])
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Return the ``(date, _id)`` boundary of a cursor; raises ValueError if it is malformed."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        date = datetime.fromisoformat(key['d']) if key['t'] == 'date' else key['d']
+        return date, ObjectId(key['id'])
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise ValueError(f'Invalid page cursor: {token!r}')
+
+
+def seek_filter(date, _id, older):
+    """Match the documents strictly after (older=True) or before a boundary in newest-first order.
+
+    BSON sorts every date above every string, so while legacy string dates
+    remain, the older side of a date boundary also includes all string dates
+    and the newer side of a string boundary all BSON dates.
+    """
+    op = '$lt' if older else '$gt'
+    clauses = [{'date': {op: date}}, {'date': date, '_id': {op: _id}}]
+    if older and isinstance(date, datetime):
+        clauses.append({'date': {'$type': 'string'}})
+    elif not older and not isinstance(date, datetime):
+        clauses.append({'date': {'$type': 'date'}})
+    return {'$or': clauses}
+
+
+def fetch_page(collection, query, page_size, after=None, before=None, projection=LIST_FIELDS):
+    """Return the page of ``query`` results after or before a cursor (newest first)."""
+    older = before is None
+    if after or before:
+        seek = seek_filter(*decode_cursor(after or before), older=older)
+        query = {'$and': [query, seek]}
+    direction = DESCENDING if older else ASCENDING
+    docs = list(collection.find(query, projection)
+                .sort([('date', direction), ('_id', direction)])
+                .limit(page_size + 1))
+    return page_from_docs(docs, page_size, after, before)
+
+
+def page_from_docs(docs, page_size, after=None, before=None):
+    """Build the ``Page`` from up to ``page_size + 1`` documents read in the direction of the cursor."""
+    older = before is None
+    has_more = len(docs) > page_size
+    docs = docs[:page_size]
+    if not older:
+        docs.reverse()
+    if not docs:
+        return Page([], None, None)
+
+    # Coming from one side means that side has a page, the other side exists if we over-fetched
+    more_older = has_more if older else True
+    more_newer = bool(after) if older else has_more
+    return Page(
+        docs,
+        encode_cursor(docs[-1]) if more_older else None,
+        encode_cursor(docs[0]) if more_newer else None,
+    )
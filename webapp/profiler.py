@@ -0,0 +1,83 @@
+"""Opt-in cProfile runs of individual requests.
+
+A request to one of the profiled endpoints is run under ``cProfile`` either
+by chance (``sample_rate``, e.g. 0.01 for one request in a hundred) or
+because an admin sent the ``X-Profile: 1`` header. The stats are dumped in
+pstats format to ``directory`` as ``<endpoint>-<user>-<timestamp>-<pid>.prof``,
+ready for ``python -m pstats``, snakeviz or flameprof.
+
+Only one request per process is profiled at a time; a request that would be
+sampled while another is being profiled simply runs unprofiled.
+"""
+import cProfile
+import os
+import random
+import threading
+from datetime import datetime
+from flask import g, request
+
+HEADER = 'X-Profile'
+
+
+class RequestProfiler:
+    def __init__(self, directory, endpoints, sample_rate=0.0, is_admin=None, user_id=None, rng=random.random):
+        self.directory = directory
+        self.endpoints = set(endpoints)
+        self.sample_rate = sample_rate
+        self.is_admin = is_admin or (lambda: False)
+        self.user_id = user_id or (lambda: None)
+        self.rng = rng
+        self.profiled = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def wants_profile(self):
+        if request.endpoint not in self.endpoints:
+            return False
+        if request.headers.get(HEADER) == '1' and self.is_admin():
+            return True
+        return self.sample_rate > 0 and self.rng() < self.sample_rate
+
+    def _before_request(self):
+        if not self.wants_profile() or not self._lock.acquire(blocking=False):
+            return
+        g.profile = cProfile.Profile()
+        g.profile.enable()
+
+    def _after_request(self, response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        path = self.profile_path(request.endpoint, self.user_id())
+        if request.headers.get(HEADER) == '1':
+            response.headers['X-Profile-File'] = os.path.basename(path)
+
+        def finish():
+            profile.disable()
+            self._lock.release()
+            os.makedirs(self.directory, exist_ok=True)
+            profile.dump_stats(path)
+            self.profiled += 1
+
+        if response.is_streamed:
+            # Keep profiling until the streamed body has been produced
+            response.call_on_close(finish)
+        else:
+            finish()
+        return response
+
+    def _teardown_request(self, error):
+        # after_request didn't run (e.g. an error escaped it): stop without dumping
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profile.disable()
+            self._lock.release()
+
+    def profile_path(self, endpoint, user_id):
+        stamp = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+        name = f'{endpoint}-{user_id or "anonymous"}-{stamp}-{os.getpid()}.prof'
+        return os.path.join(self.directory, name)
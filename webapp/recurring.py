@@ -0,0 +1,222 @@
+"""Recurring transaction templates and their materialization.
+
+A template in the ``recurring`` collection describes a transaction that
+repeats every ``interval`` days, weeks or months from ``start``, and keeps
+the date of its next occurrence in ``next_due``. ``materialize_due`` turns
+every occurrence up to now into a transaction, which also catches up on
+periods missed while nothing was running. Occurrences are written in
+batched ``bulk_write`` upserts keyed by ``recurrence_key`` (template id and
+date, unique index), so running twice, or in two processes at once, never
+creates a duplicate, and only the documents actually inserted are reported
+to ``on_inserted``.
+
+``RecurringScheduler`` runs materialization on a background thread so it
+stays off the request path; ``flask materialize-recurring`` does the same
+from a separate process. Every web worker has a scheduler, but with a
+``SchedulerLease`` only the one holding the lease document runs it; the
+others take over once the holder stops renewing it.
+"""
+import calendar
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from schema import parse_date, search_terms, to_cents
+
+FREQUENCIES = ('daily', 'weekly', 'monthly')
+
+logger = logging.getLogger(__name__)
+
+
+def new_template(user_id, item_name, amount, category, start, frequency, interval=1, end=None):
+    """Validate form values into a template document; raises ValueError."""
+    if frequency not in FREQUENCIES:
+        raise ValueError(f'Unknown frequency {frequency!r}')
+    interval = int(interval)
+    if interval < 1:
+        raise ValueError('interval must be at least 1')
+    if not item_name or not category:
+        raise ValueError('item name and category are required')
+    start = parse_date(start)
+    end = parse_date(end) if end else None
+    if end is not None and end < start:
+        raise ValueError('end is before start')
+    return {
+        'user_id': user_id,
+        'item_name': item_name,
+        'amount_cents': to_cents(amount),
+        'category': category,
+        'frequency': frequency,
+        'interval': interval,
+        'start': start,
+        'end': end,
+        'next_due': start,
+    }
+
+
+def add_months(date, months, day):
+    """``date`` moved by ``months``, on ``day`` or the month's last day if shorter."""
+    index = date.year * 12 + date.month - 1 + months
+    year, month = divmod(index, 12)
+    month += 1
+    return date.replace(year=year, month=month, day=min(day, calendar.monthrange(year, month)[1]))
+
+
+def following(template, date):
+    """The occurrence after ``date``."""
+    interval = template['interval']
+    if template['frequency'] == 'daily':
+        return date + timedelta(days=interval)
+    if template['frequency'] == 'weekly':
+        return date + timedelta(weeks=interval)
+    return add_months(date, interval, template['start'].day)
+
+
+def due_occurrences(template, now):
+    """Dates from ``next_due`` up to ``now``, and the next due date (None once past the end)."""
+    dates = []
+    date = template['next_due']
+    end = template.get('end')
+    while date <= now and (end is None or date <= end):
+        dates.append(date)
+        date = following(template, date)
+    return dates, None if end is not None and date > end else date
+
+
+def occurrence(template, date):
+    return {
+        'user_id': template['user_id'],
+        'item_name': template['item_name'],
+        'search_terms': search_terms(template['item_name']),
+        'amount_cents': template['amount_cents'],
+        'category': template['category'],
+        'date': date,
+        'recurrence_key': f"{template['_id']}:{date:%Y-%m-%d}",
+    }
+
+
+def materialize_due(recurring, transactions, now=None, batch_size=500, on_inserted=None):
+    """Insert every due occurrence of every template; returns the number inserted.
+
+    ``on_inserted(user_id, docs)`` is called per batch with the documents
+    that were new, so derived data is updated exactly once per transaction.
+    """
+    now = now or datetime.now()
+    inserted = 0
+    batch = []
+    advances = []
+    for template in recurring.find({'next_due': {'$lte': now}}):
+        dates, next_due = due_occurrences(template, now)
+        batch.extend(occurrence(template, date) for date in dates)
+        advances.append((template, next_due))
+        if len(batch) >= batch_size:
+            inserted += _write_batch(transactions, batch, on_inserted)
+            batch = []
+    if batch:
+        inserted += _write_batch(transactions, batch, on_inserted)
+    for template, next_due in advances:
+        # Only advance from the date we read; a concurrent run that got there first wins
+        recurring.update_one({'_id': template['_id'], 'next_due': template['next_due']},
+                             {'$set': {'next_due': next_due}})
+    return inserted
+
+
+def _write_batch(transactions, batch, on_inserted):
+    ops = [UpdateOne({'recurrence_key': doc['recurrence_key']}, {'$setOnInsert': doc}, upsert=True)
+           for doc in batch]
+    try:
+        upserted = transactions.bulk_write(ops, ordered=False).upserted_ids
+    except BulkWriteError as error:
+        # Another run upserted the same keys concurrently: those occurrences exist already
+        if any(write_error['code'] != 11000 for write_error in error.details['writeErrors']):
+            raise
+        upserted = {row['index']: row['_id'] for row in error.details['upserted']}
+    new = []
+    for index, _id in upserted.items():
+        batch[index]['_id'] = _id
+        new.append(batch[index])
+    if on_inserted:
+        by_user = {}
+        for doc in new:
+            by_user.setdefault(doc['user_id'], []).append(doc)
+        for user_id, docs in by_user.items():
+            on_inserted(user_id, docs)
+    return len(new)
+
+
+class SchedulerLease:
+    """A lease on the ``name`` document of ``locks``, held by one process at a time for ``ttl`` seconds.
+
+    Expiry times are epoch seconds, so processes on different hosts agree on
+    them as far as their clocks do.
+    """
+
+    def __init__(self, locks, name='recurring', ttl=180, clock=time.time):
+        self.locks = locks
+        self.name = name
+        self.ttl = ttl
+        self.clock = clock
+        self.owner = uuid.uuid4().hex
+
+    def acquire(self):
+        """Take the lease if it is free or expired, or renew it if held; returns whether it is held."""
+        now = self.clock()
+        try:
+            self.locks.update_one(
+                {'_id': self.name, '$or': [{'owner': self.owner}, {'expires': {'$lte': now}}]},
+                {'$set': {'owner': self.owner, 'expires': now + self.ttl}}, upsert=True)
+        except DuplicateKeyError:
+            # Another process holds an unexpired lease, so the upsert hit the existing document
+            return False
+        return True
+
+    def release(self):
+        self.locks.delete_one({'_id': self.name, 'owner': self.owner})
+
+
+class RecurringScheduler:
+    """Calls ``run()`` every ``interval`` seconds on a daemon thread until stopped.
+
+    With a ``lease``, a round only runs while the lease is held.
+    """
+
+    def __init__(self, run, interval=60, lease=None):
+        self.run = run
+        self.interval = interval
+        self.lease = lease
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='recurring-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self.lease is not None:
+            # Let another process take over without waiting for the expiry
+            try:
+                self.lease.release()
+            except Exception:
+                logger.exception('Releasing the recurring scheduler lease failed')
+
+    def run_forever(self):
+        """Run the loop on the calling thread (for a dedicated worker process)."""
+        self._loop()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if self.lease is None or self.lease.acquire():
+                    self.run()
+            except Exception:
+                # Keep the thread alive; the next run catches up
+                logger.exception('Materializing recurring transactions failed')
+            self._stop.wait(self.interval)
@@ -0,0 +1,155 @@
+"""Incrementally maintained per-user spending rollups.
+
+Every document in the ``spending_rollups`` collection holds the running total
+for one user and one week, month or year bucket. The write routes apply
+``$inc`` deltas here so the summary page can read its totals back with a
+single indexed query instead of re-aggregating the user's whole history.
+
+Month documents also carry a ``categories`` map of per-category totals and
+counts (keys encoded as in ``daily``), which the budget checks read.
+"""
+from pymongo import UpdateOne
+from daily import encode_category
+from schema import amount_cents, parse_date
+
+GRANULARITIES = ('week', 'month', 'year')
+# Granularity whose documents are broken down by category
+CATEGORY_GRANULARITY = 'month'
+
+
+def bucket_keys(date):
+    """Map a date to its bucket for each granularity.
+
+    Weeks follow MongoDB's ``$week`` numbering (weeks start on Sunday, days
+    before the first Sunday fall in week 0), which is ``%U`` in strftime.
+    """
+    date = parse_date(date)
+    return {
+        'week': {'year': date.year, 'week': int(date.strftime('%U'))},
+        'month': {'year': date.year, 'month': date.month},
+        'year': {'year': date.year},
+    }
+
+
+def rollup_ops(user_id, transaction, sign=1):
+    """Build the upserts that add (sign=1) or remove (sign=-1) one transaction."""
+    cents = amount_cents(transaction)
+    ops = []
+    for granularity, bucket in bucket_keys(transaction['date']).items():
+        inc = {'total_cents': sign * cents, 'count': sign}
+        if granularity == CATEGORY_GRANULARITY:
+            inc.update(_category_inc(transaction.get('category') or '', sign * cents, sign))
+        ops.append(UpdateOne(
+            {'user_id': user_id, 'granularity': granularity, 'bucket': bucket},
+            {'$inc': inc},
+            upsert=True
+        ))
+    return ops
+
+
+def _category_inc(category, cents, count):
+    prefix = f'categories.{encode_category(category)}'
+    return {f'{prefix}.total_cents': cents, f'{prefix}.count': count}
+
+
+def apply_change(rollups, user_id, old=None, new=None):
+    """Move a transaction's contribution from ``old`` to ``new``.
+
+    Pass only ``new`` for an insert, only ``old`` for a delete and both for an
+    edit; all buckets are updated in one ``bulk_write`` round-trip.
+    """
+    apply_changes(rollups, user_id, [(old, new)])
+
+
+def apply_changes(rollups, user_id, changes):
+    """Apply a batch of ``(old, new)`` pairs in one ``bulk_write``."""
+    ops = []
+    for old, new in changes:
+        if old is not None:
+            ops.extend(rollup_ops(user_id, old, -1))
+        if new is not None:
+            ops.extend(rollup_ops(user_id, new, 1))
+    if ops:
+        rollups.bulk_write(ops, ordered=False)
+
+
+def apply_inserts(rollups, user_id, inserted):
+    """Add a batch of new transactions with one upsert per bucket they touch."""
+    totals = {}
+    for transaction in inserted:
+        _add_to_totals(totals, user_id, transaction)
+    ops = []
+    for (owner, granularity, bucket), (total, count, categories) in totals.items():
+        inc = {'total_cents': total, 'count': count}
+        for category, (category_total, category_count) in categories.items():
+            inc.update(_category_inc(category, category_total, category_count))
+        ops.append(UpdateOne({'user_id': owner, 'granularity': granularity, 'bucket': dict(bucket)},
+                             {'$inc': inc}, upsert=True))
+    if ops:
+        rollups.bulk_write(ops, ordered=False)
+
+
+def _add_to_totals(totals, user_id, transaction):
+    cents = amount_cents(transaction)
+    for granularity, bucket in bucket_keys(transaction['date']).items():
+        key = (user_id, granularity, tuple(bucket.items()))
+        total, count, categories = totals.get(key, (0, 0, {}))
+        if granularity == CATEGORY_GRANULARITY:
+            category = transaction.get('category') or ''
+            category_total, category_count = categories.get(category, (0, 0))
+            categories[category] = (category_total + cents, category_count + 1)
+        totals[key] = (total + cents, count + 1, categories)
+
+
+# Fields a summary page reads from each rollup document
+SUMMARY_FIELDS = {'_id': 0, 'granularity': 1, 'bucket': 1, 'total_cents': 1}
+
+
+def read_summary(rollups, user_id):
+    """Return the weekly/monthly/yearly totals shaped like the old aggregation output."""
+    return summary_from_docs(rollups.find({'user_id': user_id, 'count': {'$gt': 0}}, SUMMARY_FIELDS))
+
+
+def summary_from_docs(docs):
+    """Group rollup documents into the template's newest-first weekly/monthly/yearly lists."""
+    summary = {granularity: [] for granularity in GRANULARITIES}
+    for doc in docs:
+        summary[doc['granularity']].append({'_id': doc['bucket'], 'total': doc['total_cents'] / 100})
+    for granularity, rows in summary.items():
+        rows.sort(key=lambda row: (row['_id']['year'], row['_id'].get(granularity, 0)), reverse=True)
+    return {
+        'weekly_spending': summary['week'],
+        'monthly_spending': summary['month'],
+        'yearly_spending': summary['year'],
+    }
+
+
+def rebuild_rollups(transactions, rollups, user_id=None, batch_size=1000):
+    """Recompute rollups from the raw transactions collection.
+
+    Streams the transactions once (optionally for a single user), replaces the
+    affected rollup documents and returns the number of buckets written.
+    """
+    query = {} if user_id is None else {'user_id': user_id}
+    totals = {}
+    projection = {'_id': 0, 'user_id': 1, 'date': 1, 'category': 1, 'amount': 1, 'amount_cents': 1}
+    for doc in transactions.find(query, projection, batch_size=batch_size):
+        if doc.get('date') is None or (doc.get('amount') is None and doc.get('amount_cents') is None):
+            continue
+        _add_to_totals(totals, doc['user_id'], doc)
+
+    rollups.delete_many(query)
+    batch = []
+    for (owner, granularity, bucket), (total, count, categories) in totals.items():
+        doc = {'user_id': owner, 'granularity': granularity, 'bucket': dict(bucket),
+               'total_cents': total, 'count': count}
+        if granularity == CATEGORY_GRANULARITY:
+            doc['categories'] = {encode_category(category): {'total_cents': category_total, 'count': category_count}
+                                 for category, (category_total, category_count) in categories.items()}
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            rollups.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        rollups.insert_many(batch, ordered=False)
+    return len(totals)
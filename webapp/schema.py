@@ -0,0 +1,97 @@
+"""Typed storage format for transactions.
+
+Transactions are stored with ``date`` as a BSON date and the amount as an
+integer number of cents in ``amount_cents``. Documents written before this
+format kept ``date`` as a 'YYYY-MM-DD' string and ``amount`` as a float; the
+helpers here read both, so the app keeps working while ``flask
+migrate-transactions`` converts the old documents.
+
+``search_terms`` holds the lower-cased words of ``item_name`` so searches can
+match word prefixes through an index (see ``filters``).
+"""
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# Aggregation expression for a transaction's amount in cents, for either format
+CENTS_EXPR = {'$ifNull': ['$amount_cents', {'$multiply': ['$amount', 100]}]}
+# BSON integers are signed 64-bit
+MAX_CENTS = 2 ** 63 - 1
+
+
+def parse_date(value):
+    """Return the transaction date as a ``datetime`` (accepts 'YYYY-MM-DD' strings)."""
+    if isinstance(value, datetime):
+        return value
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d')
+
+
+def to_cents(value):
+    """Convert a form value or legacy float amount to integer cents."""
+    try:
+        cents = (Decimal(str(value)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP)
+    except InvalidOperation:
+        raise ValueError(f'Invalid amount: {value!r}')
+    if not cents.is_finite() or not -MAX_CENTS <= cents <= MAX_CENTS:
+        raise ValueError(f'Amount out of range: {value!r}')
+    return int(cents)
+
+
+def amount_cents(transaction):
+    """Return a stored transaction's amount in cents, whichever format it uses."""
+    if transaction.get('amount_cents') is not None:
+        return transaction['amount_cents']
+    return to_cents(transaction['amount'])
+
+
+def search_terms(item_name):
+    """The distinct lower-cased words of an item name, in order."""
+    terms = []
+    for word in re.findall(r'\w+', str(item_name or '').lower()):
+        if word not in terms:
+            terms.append(word)
+    return terms
+
+
+def transaction_fields(item_name, amount, category, date):
+    """Build the typed fields written by the add and edit routes."""
+    return {
+        'item_name': item_name,
+        'search_terms': search_terms(item_name),
+        'amount_cents': to_cents(amount),
+        'category': category,
+        'date': parse_date(date),
+    }
+
+
+def typed_fields(transaction):
+    """Return the ``$set`` that converts a stored transaction to the typed format."""
+    return {
+        'amount_cents': amount_cents(transaction),
+        'date': parse_date(transaction['date']),
+        'search_terms': search_terms(transaction.get('item_name')),
+    }
+
+
+def date_range(start, end):
+    """Match [start, end) against both BSON dates and legacy date strings.
+
+    MongoDB only compares values of the same type, so each branch of the
+    ``$or`` can use the ``(user_id, date)`` index.
+    """
+    return {'$or': [
+        {'date': {'$gte': start, '$lt': end}},
+        {'date': {'$gte': start.strftime('%Y-%m-%d'), '$lt': end.strftime('%Y-%m-%d')}},
+    ]}
+
+
+def to_view(transaction):
+    """Return a copy of a transaction with a dollar ``amount`` and a 'YYYY-MM-DD' ``date`` for templates."""
+    if transaction is None:
+        return None
+    view = dict(transaction)
+    if 'amount_cents' in view or 'amount' in view:
+        view['amount'] = amount_cents(view) / 100
+    if isinstance(view.get('date'), datetime):
+        view['date'] = view['date'].strftime('%Y-%m-%d')
+    return view
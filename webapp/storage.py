@@ -0,0 +1,298 @@
+"""Storage engines behind one repository interface.
+
+``Repository`` covers the app's reads and writes of single records: user
+lookup, registration and password changes, and adding, reading, editing
+and deleting one transaction. ``MongoRepository`` is the engine the app
+runs on, over the ``users`` and ``transactions`` collections.
+``SqliteRepository`` keeps the same records in an embedded SQLite file (or
+``:memory:``), so tools and tests can use them without a MongoDB server.
+
+Both engines take and return the same documents: ids are ``ObjectId``s
+(stored as hex text in SQLite), dates are ``datetime``s and amounts are
+integer ``amount_cents``. ``test/test_storage.py`` runs one conformance
+suite against both, and ``bench.storage_bench`` times them on the same
+workload.
+
+Listings, search, summaries and the derived collections (rollups, daily
+buckets, search terms, budgets) are not part of the interface: the app
+reads them from MongoDB directly, so it needs MongoDB whichever engine
+this module offers.
+"""
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from schema import amount_cents, parse_date
+
+# A batch write claims its documents first (see MongoRepository); a claim
+# older than this was abandoned by a request that died, and is ignored
+CLAIM_TIMEOUT = timedelta(seconds=60)
+
+
+def unclaimed(now):
+    """Match the transactions no batch write has claimed."""
+    return {'$or': [{'claim': {'$exists': False}}, {'claim.at': {'$lt': now - CLAIM_TIMEOUT}}]}
+
+
+class Repository:
+    def find_user(self, username):
+        """The user document with this username, or None."""
+        raise NotImplementedError
+
+    def get_user(self, user_id):
+        raise NotImplementedError
+
+    def add_user(self, username, password):
+        """Store a user with an already hashed password; returns the new id as a string."""
+        raise NotImplementedError
+
+    def set_password(self, user_id, password, expected=None):
+        """Replace the password hash, only if it is still ``expected`` when given; returns whether it did."""
+        raise NotImplementedError
+
+    def add_transactions(self, docs):
+        """Insert documents with a ``user_id`` and the ``transaction_fields``; sets their ``_id``."""
+        raise NotImplementedError
+
+    def get_transaction(self, user_id, transaction_id):
+        raise NotImplementedError
+
+    def update_transaction(self, user_id, transaction_id, fields):
+        """Overwrite the fields of one of the user's transactions; returns it as it was, or None."""
+        raise NotImplementedError
+
+    def delete_transaction(self, user_id, transaction_id):
+        """Delete one of the user's transactions; returns it, or None if there was none."""
+        raise NotImplementedError
+
+    def update_transactions(self, user_id, ids, merge):
+        """Edit several of the user's transactions in one batch; returns ``[(old, new fields)]`` for those written.
+
+        ``merge`` gets the current documents by id and returns the new fields by
+        id; if it raises, nothing is written. Ids that aren't the user's, or are
+        being written by another batch, are left out.
+        """
+        raise NotImplementedError
+
+    def delete_transactions(self, user_id, ids):
+        """Delete several of the user's transactions in one batch; returns the deleted documents."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def _new_transaction(doc):
+    doc.setdefault('_id', ObjectId())
+    return doc
+
+
+class MongoRepository(Repository):
+    def __init__(self, db):
+        self.users = db.users
+        self.transactions = db.transactions
+
+    def find_user(self, username):
+        return self.users.find_one({'username': username})
+
+    def get_user(self, user_id):
+        return self.users.find_one({'_id': ObjectId(user_id)})
+
+    def add_user(self, username, password):
+        return str(self.users.insert_one({'username': username, 'password': password}).inserted_id)
+
+    def set_password(self, user_id, password, expected=None):
+        query = {'_id': ObjectId(user_id)}
+        if expected is not None:
+            query['password'] = expected
+        return self.users.update_one(query, {'$set': {'password': password}}).modified_count == 1
+
+    def add_transactions(self, docs):
+        docs = [_new_transaction(doc) for doc in docs]
+        if docs:
+            self.transactions.insert_many(docs)
+        return docs
+
+    def get_transaction(self, user_id, transaction_id):
+        return self._document(self.transactions.find_one({'_id': ObjectId(transaction_id), 'user_id': user_id}))
+
+    def update_transaction(self, user_id, transaction_id, fields):
+        # Typed fields replace the legacy float amount
+        return self._document(self.transactions.find_one_and_update(
+            {'_id': ObjectId(transaction_id), 'user_id': user_id, **unclaimed(datetime.now())},
+            {'$set': fields, '$unset': {'amount': ''}}, return_document=ReturnDocument.BEFORE))
+
+    def delete_transaction(self, user_id, transaction_id):
+        return self._document(self.transactions.find_one_and_delete(
+            {'_id': ObjectId(transaction_id), 'user_id': user_id, **unclaimed(datetime.now())}))
+
+    # A batch is claimed with one update_many that sets a per-request token on
+    # the unclaimed documents, and then read and written by that token. Other
+    # writers skip claimed documents, so the documents read are exactly the
+    # versions the batch replaces or deletes and each rollup delta is applied
+    # once. It costs three round trips whatever the number of ids.
+
+    def _claim(self, user_id, ids):
+        token, now = ObjectId(), datetime.now()
+        self.transactions.update_many({'_id': {'$in': ids}, 'user_id': user_id, **unclaimed(now)},
+                                      {'$set': {'claim': {'token': token, 'at': now}}})
+        return token, {doc['_id']: self._document(doc) for doc in self.transactions.find({'claim.token': token})}
+
+    def update_transactions(self, user_id, ids, merge):
+        token, existing = self._claim(user_id, ids)
+        try:
+            merged = merge(existing)
+        except Exception:
+            self.transactions.update_many({'claim.token': token}, {'$unset': {'claim': ''}})
+            raise
+        if merged:
+            self.transactions.bulk_write(
+                [UpdateOne({'_id': _id, 'claim.token': token}, {'$set': fields, '$unset': {'amount': '', 'claim': ''}})
+                 for _id, fields in merged.items()], ordered=False)
+        return [(existing[_id], fields) for _id, fields in merged.items()]
+
+    def delete_transactions(self, user_id, ids):
+        token, existing = self._claim(user_id, ids)
+        if existing:
+            self.transactions.delete_many({'claim.token': token})
+        return list(existing.values())
+
+    @staticmethod
+    def _document(doc):
+        """Only the repository fields, in the typed format even for a legacy document."""
+        if doc is None:
+            return None
+        return {'_id': doc['_id'], 'user_id': doc['user_id'], 'item_name': doc.get('item_name'),
+                'category': doc.get('category'), 'amount_cents': amount_cents(doc), 'date': parse_date(doc['date'])}
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    item_name TEXT,
+    category TEXT,
+    amount_cents INTEGER NOT NULL,
+    date TEXT NOT NULL
+);
+"""
+
+
+class SqliteRepository(Repository):
+    def __init__(self, path=':memory:'):
+        # One connection shared by the request threads, one statement at a time
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def find_user(self, username):
+        return self._user(self._query('SELECT * FROM users WHERE username = ?', (username,)))
+
+    def get_user(self, user_id):
+        return self._user(self._query('SELECT * FROM users WHERE id = ?', (str(ObjectId(user_id)),)))
+
+    def add_user(self, username, password):
+        user_id = str(ObjectId())
+        with self._lock, self._conn:
+            self._conn.execute('INSERT INTO users (id, username, password) VALUES (?, ?, ?)',
+                               (user_id, username, password))
+        return user_id
+
+    def set_password(self, user_id, password, expected=None):
+        sql, params = 'UPDATE users SET password = ? WHERE id = ?', [password, str(ObjectId(user_id))]
+        if expected is not None:
+            sql += ' AND password = ?'
+            params.append(expected)
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params).rowcount == 1
+
+    def add_transactions(self, docs):
+        docs = [_new_transaction(doc) for doc in docs]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT INTO transactions (id, user_id, item_name, category, amount_cents, date) VALUES (?, ?, ?, ?, ?, ?)',
+                [self._row(doc) for doc in docs])
+        return docs
+
+    def get_transaction(self, user_id, transaction_id):
+        rows = self._query('SELECT * FROM transactions WHERE id = ? AND user_id = ?', (str(ObjectId(transaction_id)), user_id))
+        return self._document(rows[0]) if rows else None
+
+    def update_transaction(self, user_id, transaction_id, fields):
+        key = (str(ObjectId(transaction_id)), user_id)
+        with self._lock, self._conn:
+            rows = self._conn.execute('SELECT * FROM transactions WHERE id = ? AND user_id = ?', key).fetchall()
+            if not rows:
+                return None
+            old = self._document(rows[0])
+            _, _, item_name, category, cents, date = self._row(dict(old, **fields))
+            self._conn.execute('UPDATE transactions SET item_name = ?, category = ?, amount_cents = ?, date = ? '
+                               'WHERE id = ? AND user_id = ?', (item_name, category, cents, date, *key))
+        return old
+
+    def delete_transaction(self, user_id, transaction_id):
+        key = (str(ObjectId(transaction_id)), user_id)
+        with self._lock, self._conn:
+            rows = self._conn.execute('SELECT * FROM transactions WHERE id = ? AND user_id = ?', key).fetchall()
+            if rows:
+                self._conn.execute('DELETE FROM transactions WHERE id = ? AND user_id = ?', key)
+        return self._document(rows[0]) if rows else None
+
+    # Batches run in one SQLite transaction under the connection lock, which
+    # is what the claims achieve on MongoDB
+
+    def _select(self, user_id, ids):
+        keys = [str(ObjectId(_id)) for _id in ids]
+        rows = self._conn.execute(f'SELECT * FROM transactions WHERE user_id = ? AND id IN ({", ".join("?" * len(keys))})',
+                                  (user_id, *keys)).fetchall()
+        return {doc['_id']: doc for doc in map(self._document, rows)}
+
+    def update_transactions(self, user_id, ids, merge):
+        with self._lock, self._conn:
+            existing = self._select(user_id, ids)
+            merged = merge(existing)
+            self._conn.executemany(
+                'UPDATE transactions SET item_name = ?, category = ?, amount_cents = ?, date = ? WHERE id = ? AND user_id = ?',
+                [(*self._row(dict(existing[_id], **fields))[2:], str(_id), user_id) for _id, fields in merged.items()])
+        return [(existing[_id], fields) for _id, fields in merged.items()]
+
+    def delete_transactions(self, user_id, ids):
+        with self._lock, self._conn:
+            existing = self._select(user_id, ids)
+            self._conn.executemany('DELETE FROM transactions WHERE id = ? AND user_id = ?',
+                                   [(str(_id), user_id) for _id in existing])
+        return list(existing.values())
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _row(doc):
+        return (str(doc['_id']), doc['user_id'], doc.get('item_name'), doc.get('category'),
+                amount_cents(doc), f"{parse_date(doc['date']):%Y-%m-%d}")
+
+    @staticmethod
+    def _user(rows):
+        if not rows:
+            return None
+        return {'_id': ObjectId(rows[0]['id']), 'username': rows[0]['username'], 'password': rows[0]['password']}
+
+    @staticmethod
+    def _document(row):
+        return {'_id': ObjectId(row['id']), 'user_id': row['user_id'], 'item_name': row['item_name'],
+                'category': row['category'], 'amount_cents': row['amount_cents'],
+                'date': datetime.strptime(row['date'], '%Y-%m-%d')}
+
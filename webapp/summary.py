@@ -0,0 +1,123 @@
+"""Single-pass spending summaries.
+
+All granularities and the per-category breakdown are computed by one
+``$facet`` aggregation, so a summary costs one scan of the user's matching
+transactions and one round-trip, however many views of it a page needs.
+"""
+from datetime import datetime, timedelta
+from schema import CENTS_EXPR, date_range
+
+
+def _date():
+    return {'$toDate': '$date'}
+
+
+FACETS = {
+    'weekly': [
+        {'$group': {
+            '_id': {'year': {'$year': _date()}, 'week': {'$week': _date()}},
+            'total': {'$sum': CENTS_EXPR}
+        }},
+        {'$sort': {'_id.year': -1, '_id.week': -1}}
+    ],
+    'monthly': [
+        {'$group': {
+            '_id': {'year': {'$year': _date()}, 'month': {'$month': _date()}},
+            'total': {'$sum': CENTS_EXPR}
+        }},
+        {'$sort': {'_id.year': -1, '_id.month': -1}}
+    ],
+    'yearly': [
+        {'$group': {'_id': {'year': {'$year': _date()}}, 'total': {'$sum': CENTS_EXPR}}},
+        {'$sort': {'_id.year': -1}}
+    ],
+    'categories': [
+        {'$group': {'_id': '$category', 'total': {'$sum': CENTS_EXPR}, 'count': {'$sum': 1}}},
+        {'$sort': {'total': -1}}
+    ],
+}
+
+
+def period_bounds(year, month=None):
+    """Return the [start, end) datetimes of a whole year or a single month."""
+    if month:
+        start = datetime(year, month, 1)
+        end = datetime(year, month + 1, 1) if month < 12 else datetime(year + 1, 1, 1)
+    else:
+        start = datetime(year, 1, 1)
+        end = datetime(year + 1, 1, 1)
+    return start, end
+
+
+RANGES = ('last-7-days', 'last-30-days', 'quarter', 'year-to-date')
+
+
+def range_bounds(args, today):
+    """Return ``(start, end, label)`` for a custom or named range in the query args.
+
+    ``start`` and ``end`` are inclusive 'YYYY-MM-DD' dates; ``range`` names one
+    of ``RANGES`` relative to ``today`` (``quarter`` also reads ``year`` and
+    ``quarter``). Returns None when neither is given and raises ValueError for
+    malformed or reversed dates.
+    """
+    today = datetime(today.year, today.month, today.day)
+    name = args.get('range')
+    if args.get('start') or args.get('end'):
+        start = datetime.strptime(args.get('start', ''), '%Y-%m-%d')
+        last = datetime.strptime(args.get('end', ''), '%Y-%m-%d')
+        if last < start:
+            raise ValueError('end is before start')
+        return start, last + timedelta(days=1), f"{start:%Y-%m-%d} to {last:%Y-%m-%d}"
+    if name in ('last-7-days', 'last-30-days'):
+        days = 7 if name == 'last-7-days' else 30
+        return today - timedelta(days=days - 1), today + timedelta(days=1), f'Last {days} days'
+    if name == 'quarter':
+        year = int(args.get('year') or today.year)
+        quarter = int(args.get('quarter') or (today.month - 1) // 3 + 1)
+        if not 1 <= quarter <= 4:
+            raise ValueError('quarter must be 1-4')
+        start = datetime(year, 3 * quarter - 2, 1)
+        end = datetime(year + 1, 1, 1) if quarter == 4 else datetime(year, 3 * quarter + 1, 1)
+        return start, end, f'Q{quarter} {year}'
+    if name == 'year-to-date':
+        return datetime(today.year, 1, 1), today + timedelta(days=1), f'{today.year} to date'
+    if name:
+        raise ValueError(f'unknown range {name!r}')
+    return None
+
+
+def shift_years(date, years):
+    """The same calendar date ``years`` later (Feb 29 becomes Feb 28)."""
+    try:
+        return date.replace(year=date.year + years)
+    except ValueError:
+        return date.replace(year=date.year + years, day=28)
+
+
+def period_match(user_id, start=None, end=None):
+    """Build the ``$match`` filter for a user's transactions in [start, end)."""
+    match = {'user_id': user_id}
+    if start is not None and end is not None:
+        match.update(date_range(start, end))
+    return match
+
+
+def build_pipeline(match, facets):
+    return [
+        {'$match': match},
+        {'$facet': {name: FACETS[name] for name in facets}}
+    ]
+
+
+def summarize(transactions, match, facets=('weekly', 'monthly', 'yearly', 'categories')):
+    """Run the requested facets over ``match`` in one aggregation round-trip.
+
+    Returns a dict with one list per facet name. Totals are summed in cents
+    on the server and returned in dollars.
+    """
+    result = next(transactions.aggregate(build_pipeline(match, facets)), None)
+    result = result or {name: [] for name in facets}
+    for name in facets:
+        for row in result[name]:
+            row['total'] = round(row['total']) / 100
+    return result
@@ -0,0 +1,56 @@
+import numpy as np
+from datetime import datetime, timedelta
+from mongomock import MongoClient
+from analytics import analyze, load_columns, rolling_mean, to_columns, trend_slopes
+from bench.analytics_bench import analyze_loop
+from bench.seed import generate_transactions
+
+def test_to_columns_reads_both_storage_formats():
+    """ Test that typed and legacy transactions become the same columns """
+    columns = to_columns([
+        {'date': datetime(2024, 1, 2), 'amount_cents': 450, 'category': 'Food'},
+        {'date': '2024-01-03', 'amount': 10.25, 'category': 'Fun'},
+        {'date': '2024-01-03', 'amount': 1.0},
+        {'amount': 5.0},
+    ])
+    assert list(columns.days) == [np.datetime64('2024-01-02'), np.datetime64('2024-01-03'), np.datetime64('2024-01-03')]
+    assert list(columns.cents) == [450, 1025, 100]
+    assert [columns.names[code] for code in columns.categories] == ['Food', 'Fun', '']
+
+def test_rolling_mean_and_trend_slopes():
+    """ Test the trailing mean warm-up and per-row least-squares slopes """
+    assert list(rolling_mean(np.array([2.0, 4.0, 6.0, 8.0]), 2)) == [2.0, 3.0, 5.0, 7.0]
+    slopes = trend_slopes(np.array([[1.0, 2.0, 3.0], [5.0, 5.0, 5.0], [6.0, 4.0, 2.0]]))
+    assert list(slopes) == [1.0, 0.0, -2.0]
+
+def test_analyze_matches_row_by_row_reference():
+    """ Test that the vectorized analytics equal the per-row loop used by the benchmark """
+    today = datetime(2024, 5, 1)
+    docs = list(generate_transactions('u1', 2000, end=today))
+    assert analyze(to_columns(docs), today) == analyze_loop(docs, today)
+
+def test_analyze_month_over_month_and_top():
+    """ Test month deltas, the first month without a predecessor and top categories """
+    today = datetime(2024, 3, 15)
+    columns = to_columns([
+        {'date': datetime(2024, 1, 5), 'amount_cents': 10000, 'category': 'Rent'},
+        {'date': datetime(2024, 2, 5), 'amount_cents': 15000, 'category': 'Rent'},
+        {'date': datetime(2024, 3, 14), 'amount_cents': 500, 'category': 'Food'},
+    ])
+    result = analyze(columns, today, months=3, top=1)
+    assert result['months'] == [
+        {'month': '2024-01', 'total': 100.0, 'change': None, 'change_pct': None},
+        {'month': '2024-02', 'total': 150.0, 'change': 50.0, 'change_pct': 50.0},
+        {'month': '2024-03', 'total': 5.0, 'change': -145.0, 'change_pct': -96.67},
+    ]
+    assert result['top_categories'] == [{'category': 'Rent', 'total': 250.0, 'share': 98.04}]
+    assert result['rolling']['daily'][-2:] == [5.0, 0.0]
+    assert result['rolling']['dates'][-1] == '2024-03-15'
+
+def test_load_columns_only_reads_the_user():
+    """ Test loading one user's columns from the collection """
+    transactions = MongoClient().db.transactions
+    transactions.insert_many([dict(doc, user_id=user) for user in ('u1', 'u2')
+                              for doc in generate_transactions(user, 10, end=datetime(2024, 1, 1))])
+    assert len(load_columns(transactions, 'u1').cents) == 10
+    assert analyze(load_columns(transactions, 'nobody'), datetime(2024, 1, 1))['top_categories'] == []
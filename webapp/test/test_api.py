@@ -0,0 +1,40 @@
+import pytest
+from bson import ObjectId
+from datetime import datetime
+from api import ApiError, MAX_BATCH, serialize, parse_ids, parse_creates, parse_updates, merge_update
+
+def test_serialize():
+    """ Test the JSON shape of a stored transaction """
+    _id = ObjectId()
+    doc = {'_id': _id, 'item_name': 'Coffee', 'amount_cents': 250, 'category': 'Dining',
+           'date': datetime(2023, 1, 10), 'user_id': 'u1'}
+    assert serialize(doc) == {'id': str(_id), 'item_name': 'Coffee', 'amount': '2.50',
+                              'category': 'Dining', 'date': '2023-01-10'}
+
+def test_parse_creates_accepts_object_or_list():
+    """ Test validation of single and batch create bodies """
+    item = {'item_name': 'Coffee', 'amount': 2.5, 'category': 'Dining', 'date': '2023-01-10'}
+    assert parse_creates(item, 'u1')[0]['amount_cents'] == 250
+    assert len(parse_creates([item, item], 'u1')) == 2
+    with pytest.raises(ApiError) as error:
+        parse_creates([item, {'item_name': 'Tea'}], 'u1')
+    assert error.value.errors == ['item 1: missing amount, category, date']
+    with pytest.raises(ApiError):
+        parse_creates([item] * (MAX_BATCH + 1), 'u1')
+
+def test_parse_updates_and_ids():
+    """ Test validation of batch update and delete bodies """
+    _id = ObjectId()
+    assert parse_updates([{'id': str(_id), 'amount': '3'}]) == {_id: {'amount': '3'}}
+    with pytest.raises(ApiError) as error:
+        parse_updates([{'id': 'nope'}, {'id': str(_id), 'user_id': 'u2'}])
+    assert error.value.errors == ['item 0: invalid id', 'item 1: unknown fields user_id']
+    assert parse_ids([str(_id)]) == [_id]
+    with pytest.raises(ApiError):
+        parse_ids(str(_id))
+
+def test_merge_update_keeps_unchanged_fields():
+    """ Test a partial update of a legacy document """
+    legacy = {'item_name': 'Coffee', 'amount': 4.5, 'category': 'Dining', 'date': '2023-01-10'}
+    assert merge_update(legacy, {'amount': '5'}) == {'item_name': 'Coffee', 'search_terms': ['coffee'], 'amount_cents': 500,
+                                                     'category': 'Dining', 'date': datetime(2023, 1, 10)}
@@ -1,10 +1,13 @@
 import warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning, module='mongomock.__version__')
+import io
+import re
 import pytest
 from flask_login import login_user, current_user, logout_user
 from test.app import app, bcrypt, users, db, User, load_user
 from mongomock import MongoClient
 from datetime import datetime
+from budgets import set_budget
 from bson import ObjectId
 
 @pytest.fixture
@@ -83,6 +86,74 @@ def test_add_transaction(client, logged_in_user):
     }, follow_redirects=True)
     assert response.status_code == 200
 
+def test_import_transactions(client, logged_in_user):
+    """ Test uploading a CSV file of transactions """
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    csv_file = (io.BytesIO(b'item_name,amount,category,date\nCoffee,2.50,Dining,2023-01-10\nBad,x,Dining,2023-01-10\n'), 'bank.csv')
+    response = client.post('/import-transactions', data={'file': csv_file},
+                           content_type='multipart/form-data', follow_redirects=True)
+    assert response.status_code == 200
+    assert 'Imported 1 transactions, rejected 1.' in response.get_data(as_text=True)
+
+def test_import_jsonl_upload_with_byte_order_mark(client, logged_in_user):
+    """ Test a JSON Lines upload, decoded from Werkzeug's spooled file on every supported Python """
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    lines = '{"item_name": "Caf\u00e9", "amount": "3", "category": "ImportDining", "date": "2023-01-12"}\n' * 3
+    upload = (io.BytesIO(b'\xef\xbb\xbf' + lines.encode('utf-8')), 'bank.jsonl')
+    response = client.post('/import-transactions', data={'file': upload}, content_type='multipart/form-data')
+    assert 'Imported 3 transactions, rejected 0.' in response.get_data(as_text=True)
+    assert db.transactions.count_documents({'item_name': 'Caf\u00e9', 'category': 'ImportDining'}) == 3
+
+def test_export_transactions(client, logged_in_user):
+    """ Test streaming a CSV export filtered by period and category """
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    for date, category in (('2023-01-10', 'Dining'), ('2023-01-11', 'Transport'), ('2024-01-10', 'Dining')):
+        client.post('/add-transaction', data={'item_name': 'Item', 'amount': '1.50', 'category': category, 'date': date})
+    response = client.get('/export-transactions?year=2023&category=Dining')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'text/csv'
+    assert response.get_data(as_text=True).splitlines()[1:] == ['Item,1.50,Dining,2023-01-10']
+
+def test_export_follows_the_summary_range(client):
+    """ Test that a custom-range summary links to an export of that range only """
+    users.delete_many({'username': 'rangeexport'})
+    users.insert_one({'username': 'rangeexport', 'password': bcrypt.generate_password_hash('pw').decode('utf-8')})
+    client.post('/login', data={'username': 'rangeexport', 'password': 'pw'})
+    for date in ('2023-01-10', '2023-02-15', '2023-03-20'):
+        client.post('/add-transaction', data={'item_name': 'Ranged', 'amount': '2', 'category': 'RangeFood', 'date': date})
+    body = client.get('/detailed-spending-summary?start=2023-02-01&end=2023-03-31&category=RangeFood').get_data(as_text=True)
+    link = re.search(r'href="(/export-transactions[^"]*)"', body).group(1).replace('&amp;', '&')
+    assert 'start=2023-02-01' in link and 'end=2023-03-31' in link and 'category=RangeFood' in link
+    rows = client.get(link).get_data(as_text=True).splitlines()[1:]
+    assert rows == ['Ranged,2.00,RangeFood,2023-02-15', 'Ranged,2.00,RangeFood,2023-03-20']
+    assert client.get('/export-transactions?start=2023-03-01&end=2023-02-01').status_code == 400
+
+def test_api_transactions(client, logged_in_user):
+    """ Test the JSON API: batch create, conditional list, batch update and batch delete """
+    assert client.get('/api/v1/transactions').status_code == 401
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    created = client.post('/api/v1/transactions', json=[
+        {'item_name': 'Coffee', 'amount': '2.50', 'category': 'Dining', 'date': '2023-01-10'},
+        {'item_name': 'Taxi', 'amount': 12, 'category': 'Transport', 'date': '2023-01-11'},
+    ])
+    assert created.status_code == 201
+    coffee, taxi = created.get_json()['items']
+
+    listing = client.get('/api/v1/transactions')
+    assert [t['item_name'] for t in listing.get_json()['items']] == ['Taxi', 'Coffee']
+    assert client.get('/api/v1/transactions', headers={'If-None-Match': listing.headers['ETag']}).status_code == 304
+
+    updated = client.patch('/api/v1/transactions', json=[{'id': coffee['id'], 'amount': '3'}, {'id': str(ObjectId())}])
+    assert updated.get_json()['items'][0]['amount'] == '3.00'
+    assert len(updated.get_json()['missing']) == 1
+    assert client.get('/api/v1/transactions', headers={'If-None-Match': listing.headers['ETag']}).status_code == 200
+
+    deleted = client.delete('/api/v1/transactions', json={'ids': [coffee['id'], taxi['id']]})
+    assert deleted.get_json()['deleted'] == [coffee['id'], taxi['id']]
+    assert client.get('/api/v1/transactions').get_json()['items'] == []
+    assert client.post('/api/v1/transactions', json={'item_name': 'Tea'}).status_code == 400
+
 def create_transaction_for_test_user(db, user_id):
     """ Helper function to create a transaction for testing. """
     transaction_data = {
@@ -165,6 +236,20 @@ def test_load_user_non_existing(client, mocker):
     user = load_user(non_existing_id)
     assert user is None
 
+def test_load_user_is_cached(client, mocker):
+    """ Test that a loaded user is served from the cache until forgotten """
+    from webapp.app import load_user, forget_user, user_cache
+    mock_find_one = mocker.patch('webapp.app.users.find_one')
+    mock_find_one.return_value = {'_id': ObjectId('507f191e810c19729de860eb'), 'username': 'cacheduser'}
+    hits = user_cache.hits
+    assert load_user('507f191e810c19729de860eb').username == 'cacheduser'
+    assert load_user('507f191e810c19729de860eb').username == 'cacheduser'
+    assert mock_find_one.call_count == 1
+    assert user_cache.hits == hits + 1
+    forget_user('507f191e810c19729de860eb')
+    load_user('507f191e810c19729de860eb')
+    assert mock_find_one.call_count == 2
+
 def test_register_existing_user(client, logged_in_user):
     """ Test user registration with an existing username """
     response = client.post('/register', data={
@@ -258,11 +343,37 @@ def test_detailed_spending_summary(client, logged_in_user):
     assert response.status_code == 200
     print(response.get_data(as_text=True))
     assert 'Total' in response.get_data(as_text=True)
-    assert '$0' in response.get_data(as_text=True)
+    assert '$400.0' in response.get_data(as_text=True)
     assert 'Month' in response.get_data(as_text=True)
     assert 'Selected Period Spending' in response.get_data(as_text=True)
 
 
+def test_detailed_spending_summary_streaming(client, logged_in_user):
+    """ Test the detailed summary rendered as a stream """
+    insert_transactions_for_summary()
+    app.config['STREAM_TEMPLATES'] = True
+    try:
+        response = client.get('/detailed-spending-summary?year=2023&month=2', follow_redirects=True)
+        assert response.status_code == 200
+        assert response.is_streamed
+        body = response.get_data(as_text=True)
+    finally:
+        app.config['STREAM_TEMPLATES'] = False
+    assert '2 transactions found.' in body
+    assert '$350.0' in body
+
+
+def test_streamed_page_consumes_its_flashes(client, monkeypatch):
+    """ Test that a flash shown on a streamed page is not shown again on the next one """
+    users.delete_many({'username': 'streamuser'})
+    users.insert_one({'username': 'streamuser', 'password': bcrypt.generate_password_hash('pw').decode('utf-8')})
+    client.post('/login', data={'username': 'streamuser', 'password': 'pw'})
+    monkeypatch.setitem(app.config, 'STREAM_TEMPLATES', True)
+    response = client.get('/?min=abc')
+    assert response.is_streamed and 'Invalid search filters.' in response.get_data(as_text=True)
+    assert 'Invalid search filters.' not in client.get('/').get_data(as_text=True)
+
+
 def insert_transactions_for_summary():
     transactions = [
         {'user_id': str(current_user.id), 'date': datetime(2023, 1, 1), 'amount': 200.00, 'category': 'Food'},
@@ -283,3 +394,311 @@ def test_add_transaction_get(client, logged_in_user):
     #print(response.get_data(as_text=True))
 
     assert 'Add Transaction' in response.get_data(as_text=True)
+
+
+def test_mongo_client_options_from_env(monkeypatch):
+    """ Test that pool sizes and timeouts are read from the environment """
+    from test.app import mongo_client_options
+    monkeypatch.setenv('MONGO_MAX_POOL_SIZE', '20')
+    monkeypatch.setenv('MONGO_MIN_POOL_SIZE', '5')
+    monkeypatch.setenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '2000')
+    monkeypatch.delenv('MONGO_CONNECT_TIMEOUT_MS', raising=False)
+    options = mongo_client_options()
+    assert options['maxPoolSize'] == 20 and options['minPoolSize'] == 5
+    assert options['waitQueueTimeoutMS'] == 2000
+    assert 'connectTimeoutMS' not in options
+    assert options['connect'] is False
+
+
+def test_metrics_endpoint(client):
+    """ Test that /metrics serves Prometheus text and honours METRICS_TOKEN """
+    client.get('/login')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert 'budget_requests_total{route="login",method="GET",status="200"}' in response.get_data(as_text=True)
+    app.config['METRICS_TOKEN'] = 'secret'
+    try:
+        assert client.get('/metrics').status_code == 401
+        assert client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code == 200
+    finally:
+        app.config['METRICS_TOKEN'] = None
+
+
+def test_admin_can_profile_spending_summary(client, logged_in_user, tmp_path):
+    """ Test that an admin's X-Profile header dumps a profile of the summary route """
+    from test.app import request_profiler
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    request_profiler.directory = str(tmp_path)
+    app.config['ADMIN_USERNAMES'] = {'testuser'}
+    try:
+        response = client.get('/spending-summary', headers={'X-Profile': '1'})
+    finally:
+        app.config['ADMIN_USERNAMES'] = set()
+    assert response.status_code == 200
+    name = response.headers['X-Profile-File']
+    assert name.startswith('spending_summary-') and (tmp_path / name).exists()
+
+
+def test_detailed_spending_summary_custom_range(client, logged_in_user):
+    """ Test a custom range summed from the daily buckets, with the previous year for comparison """
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    for item_name, amount, category, date in (('Groceries', '42.50', 'RangeFood', '2031-04-02'),
+                                              ('Bus', '2.75', 'RangeTransport', '2031-04-03'),
+                                              ('Late', '99', 'RangeFood', '2031-04-20'),
+                                              ('Old groceries', '30', 'RangeFood', '2030-04-02')):
+        client.post('/add-transaction', data={'item_name': item_name, 'amount': amount,
+                                              'category': category, 'date': date})
+    response = client.get('/detailed-spending-summary?start=2031-04-01&end=2031-04-10&compare=previous-year')
+    body = response.get_data(as_text=True)
+    assert response.status_code == 200
+    assert '2031-04-01 to 2031-04-10 Spending' in body
+    assert 'RangeFood: $42.5' in body and 'previous year $30.0' in body
+    assert '<strong>Total:</strong> $45.25' in body
+    assert '2 transactions found.' in body
+    assert 'Late' not in body
+
+
+def test_detailed_spending_summary_invalid_range(client, logged_in_user):
+    """ Test that a reversed range falls back to the year view with a message """
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    response = client.get('/detailed-spending-summary?start=2031-04-10&end=2031-04-01')
+    assert response.status_code == 200
+    assert 'Invalid date range.' in response.get_data(as_text=True)
+
+
+def test_analytics_page_and_json(client, logged_in_user):
+    """ Test the analytics page and its JSON endpoint """
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    today = datetime.now().strftime('%Y-%m-%d')
+    client.post('/add-transaction', data={'item_name': 'Lunch', 'amount': '12.00',
+                                          'category': 'AnalyticsFood', 'date': today})
+    response = client.get('/analytics')
+    assert response.status_code == 200
+    assert 'AnalyticsFood' in response.get_data(as_text=True)
+    data = client.get('/api/v1/analytics').get_json()
+    assert data['as_of'] == today
+    assert data['rolling']['daily'][-1] >= 12.0
+    assert 'AnalyticsFood' in [trend['category'] for trend in data['trends']]
+
+
+def test_budget_warning_after_add_transaction(client):
+    """ Test setting a budget and the warning flashed when a transaction exceeds it """
+    users.delete_many({'username': 'budgetuser'})
+    users.insert_one({'username': 'budgetuser', 'password': bcrypt.generate_password_hash('pw').decode('utf-8')})
+    client.post('/login', data={'username': 'budgetuser', 'password': 'pw'})
+    response = client.post('/budgets', data={'category': 'BudgetFood', 'limit': '50'}, follow_redirects=True)
+    assert 'Budget for BudgetFood saved.' in response.get_data(as_text=True)
+    assert 'BudgetFood: $0.00 of $50.00' in response.get_data(as_text=True)
+
+    response = client.post('/add-transaction', data={'item_name': 'Dinner', 'amount': '30', 'category': 'BudgetFood',
+                                                     'date': '2031-06-01'}, follow_redirects=True)
+    assert 'flash warning' not in response.get_data(as_text=True)
+    response = client.post('/add-transaction', data={'item_name': 'Party', 'amount': '25', 'category': 'BudgetFood',
+                                                     'date': '2031-06-02'}, follow_redirects=True)
+    assert 'Over budget: $55.00 spent on BudgetFood in June 2031, limit $50.00.' in response.get_data(as_text=True)
+
+    # A limit raised through another worker applies at once, though this one still caches the user
+    set_budget(users, users.find_one({'username': 'budgetuser'})['_id'], 'BudgetFood', 10000)
+    response = client.post('/add-transaction', data={'item_name': 'Snack', 'amount': '5', 'category': 'BudgetFood',
+                                                     'date': '2031-06-03'}, follow_redirects=True)
+    assert 'flash warning' not in response.get_data(as_text=True)
+    assert 'BudgetFood: $0.00 of $100.00' in client.get('/budgets').get_data(as_text=True)
+
+    response = client.post('/budgets', data={'category': 'BudgetFood', 'limit': ''}, follow_redirects=True)
+    assert 'Budget for BudgetFood removed.' in response.get_data(as_text=True)
+    assert client.post('/budgets', data={'category': 'BudgetFood', 'limit': 'abc'},
+                       follow_redirects=True).status_code == 200
+
+
+def test_recurring_transaction_is_materialized(client):
+    """ Test creating a recurring transaction and materializing its due occurrences into summaries """
+    from test.app import materialize_recurring
+    users.delete_many({'username': 'recurringuser'})
+    user_id = str(users.insert_one({'username': 'recurringuser',
+                                    'password': bcrypt.generate_password_hash('pw').decode('utf-8')}).inserted_id)
+    client.post('/login', data={'username': 'recurringuser', 'password': 'pw'})
+    response = client.post('/recurring', data={'item_name': 'Gym', 'amount': '40', 'category': 'Fitness',
+                                               'start': '2030-01-31', 'end': '2030-03-31', 'frequency': 'monthly',
+                                               'interval': '1'}, follow_redirects=True)
+    assert 'Recurring transaction Gym saved' in response.get_data(as_text=True)
+    assert 'Gym - Fitness - $40.0' in response.get_data(as_text=True)
+
+    materialize_recurring(now=datetime(2030, 6, 1))
+    materialize_recurring(now=datetime(2030, 6, 1))
+    dates = [doc['date'] for doc in db.transactions.find({'user_id': user_id}).sort('date', 1)]
+    assert dates == [datetime(2030, 1, 31), datetime(2030, 2, 28), datetime(2030, 3, 31)]
+    response = client.get('/detailed-spending-summary?year=2030&month=2')
+    assert 'Gym' in response.get_data(as_text=True)
+    assert '(finished)' in client.get('/recurring').get_data(as_text=True)
+
+    template_id = db.recurring.find_one({'user_id': user_id})['_id']
+    client.post(f'/recurring/{template_id}/delete')
+    assert db.recurring.count_documents({'user_id': user_id}) == 0
+    assert client.post('/recurring', data={'item_name': 'Gym', 'amount': '40', 'category': 'Fitness',
+                                           'start': '2030-01-31', 'frequency': 'hourly'},
+                       follow_redirects=True).status_code == 200
+
+
+def test_search_and_filters_are_shared_by_dashboard_and_summaries(client, logged_in_user):
+    """ Test searching the dashboard and filtering the summaries and API with the same arguments """
+    client.post('/login', data={'username': 'testuser', 'password': 'testpassword'})
+    for item_name, amount, category in [('Flat White', '4', 'SearchDining'), ('Flat rent', '950', 'SearchHousing'),
+                                        ('White paint', '35', 'SearchHome'), ('Espresso', '3', 'SearchDining')]:
+        client.post('/add-transaction', data={'item_name': item_name, 'amount': amount, 'category': category,
+                                              'date': '2029-05-10'})
+
+    body = client.get('/?q=fla&size=1').get_data(as_text=True)
+    assert 'Matching Transactions' in body and 'q=fla' in body and 'size=1' in body
+    body = client.get('/?q=white').get_data(as_text=True)
+    assert 'Flat White' in body and 'White paint' in body and 'Espresso' not in body
+    body = client.get('/?q=flat&max=100&start=2029-05-01&end=2029-05-31').get_data(as_text=True)
+    assert 'Flat White' in body and 'Flat rent' not in body
+    assert 'No transactions match your search.' in client.get('/?q=nothing-like-this').get_data(as_text=True)
+    assert 'Invalid search filters.' in client.get('/?min=abc').get_data(as_text=True)
+
+    body = client.get('/detailed-spending-summary?year=2029&month=5&category=SearchDining').get_data(as_text=True)
+    assert 'SearchDining: $7.0' in body and 'SearchHousing' not in body and '2 transactions found.' in body
+    body = client.get('/detailed-spending-summary?start=2029-05-01&end=2029-05-31&q=white').get_data(as_text=True)
+    assert 'SearchHome: $35.0' in body and 'SearchDining: $4.0' in body and 'Espresso' not in body
+
+    items = client.get('/api/v1/transactions?q=flat&min=100').get_json()['items']
+    assert [item['item_name'] for item in items] == ['Flat rent']
+    assert client.get('/api/v1/transactions?min=10&max=1').status_code == 400
+    export = client.get('/export-transactions?format=csv&year=2029&q=espresso').get_data(as_text=True)
+    assert 'Espresso' in export and 'Flat White' not in export
+
+
+def test_login_rehashes_password_at_configured_cost(client):
+    """ Test that a login upgrades a hash made with another work factor """
+    from test.app import password_hasher
+    from hashing import hash_cost
+    users.delete_many({'username': 'rehashuser'})
+    old_hash = bcrypt.generate_password_hash('pw', 4).decode('utf-8')
+    users.insert_one({'username': 'rehashuser', 'password': old_hash})
+    response = client.post('/login', data={'username': 'rehashuser', 'password': 'pw'})
+    assert response.status_code == 302
+    new_hash = users.find_one({'username': 'rehashuser'})['password']
+    assert hash_cost(new_hash) == app.config['BCRYPT_LOG_ROUNDS'] == password_hasher.rounds
+    assert bcrypt.check_password_hash(new_hash, 'pw')
+
+
+def test_login_is_refused_when_hash_pool_is_full(client, monkeypatch):
+    """ Test the 503 answered when the password hashing pool is saturated """
+    from test.app import password_hasher
+    from hashing import HasherBusy
+    def busy(*args):
+        raise HasherBusy('full')
+    users.delete_many({'username': 'busyuser'})
+    users.insert_one({'username': 'busyuser', 'password': bcrypt.generate_password_hash('pw').decode('utf-8')})
+    monkeypatch.setattr(password_hasher, 'check', busy)
+    response = client.post('/login', data={'username': 'busyuser', 'password': 'pw'})
+    assert response.status_code == 503 and response.headers['Retry-After'] == '1'
+    assert 'The server is busy' in response.get_data(as_text=True)
+
+
+def test_write_behind_adds_are_visible_to_their_user(client, monkeypatch):
+    """ Test fire-and-forget adds through the write-behind queue with read-your-writes """
+    from test.app import write_queue
+    monkeypatch.setitem(app.config, 'WRITE_BEHIND', 'async')
+    monkeypatch.setattr(write_queue, 'max_delay', 60)
+    users.delete_many({'username': 'queueuser'})
+    user_id = str(users.insert_one({'username': 'queueuser',
+                                    'password': bcrypt.generate_password_hash('pw').decode('utf-8')}).inserted_id)
+    client.post('/login', data={'username': 'queueuser', 'password': 'pw'})
+    response = client.post('/add-transaction', data={'item_name': 'Queued lunch', 'amount': '12.50',
+                                                     'category': 'QueueFood', 'date': '2028-03-02'})
+    assert response.status_code == 302
+    response = client.post('/api/v1/transactions', json=[{'item_name': 'Queued taxi', 'amount': '20',
+                                                          'category': 'QueueTravel', 'date': '2028-03-03'}])
+    assert response.status_code == 202 and response.get_json()['items'][0]['id']
+    assert len(write_queue.pending(user_id)) == 2
+
+    body = client.get('/').get_data(as_text=True)
+    assert 'Queued lunch' in body and 'Queued taxi' in body and write_queue.pending(user_id) == []
+    body = client.get('/detailed-spending-summary?year=2028&month=3').get_data(as_text=True)
+    assert 'QueueFood: $12.5' in body and 'QueueTravel: $20.0' in body
+
+
+def test_async_write_behind_falls_back_to_ack_with_several_workers(monkeypatch):
+    """ Test that async write-behind is only used by a single worker """
+    from test.app import write_behind_mode
+    monkeypatch.setenv('WRITE_BEHIND', 'async')
+    monkeypatch.setenv('WEB_CONCURRENCY', '1')
+    assert write_behind_mode() == 'async'
+    monkeypatch.setenv('WEB_CONCURRENCY', '4')
+    assert write_behind_mode() == 'ack'
+    monkeypatch.setenv('WRITE_BEHIND', 'off')
+    assert write_behind_mode() == 'off'
+
+
+def test_live_updates_are_off_unless_enabled(client, monkeypatch):
+    """ Test that pages only open an EventSource, and /events only streams, with LIVE_UPDATES on """
+    users.delete_many({'username': 'liveuser'})
+    users.insert_one({'username': 'liveuser', 'password': bcrypt.generate_password_hash('pw').decode('utf-8')})
+    client.post('/login', data={'username': 'liveuser', 'password': 'pw'})
+    monkeypatch.setitem(app.config, 'LIVE_UPDATES', False)
+    assert 'EventSource' not in client.get('/').get_data(as_text=True)
+    assert 'EventSource' not in client.get('/spending-summary').get_data(as_text=True)
+    assert client.get('/events').status_code == 404
+    monkeypatch.setitem(app.config, 'LIVE_UPDATES', True)
+    assert 'EventSource' in client.get('/').get_data(as_text=True)
+    assert 'EventSource' in client.get('/spending-summary').get_data(as_text=True)
+
+
+def test_events_stream_pushes_the_users_changes(client, monkeypatch):
+    """ Test the /events Server-Sent Events stream """
+    from test.app import change_feed
+    monkeypatch.setitem(app.config, 'LIVE_UPDATES', True)
+    users.delete_many({'username': 'eventsuser'})
+    user_id = str(users.insert_one({'username': 'eventsuser',
+                                    'password': bcrypt.generate_password_hash('pw').decode('utf-8')}).inserted_id)
+    client.post('/login', data={'username': 'eventsuser', 'password': 'pw'})
+    response = client.get('/events')
+    assert response.status_code == 200 and response.mimetype == 'text/event-stream'
+    chunks = iter(response.response)
+    assert next(chunks) == b'retry: 3000\n\n'
+    change_feed.publish({'operationType': 'update', 'ns': {'coll': 'spending_rollups'},
+                         'fullDocument': {'user_id': user_id, 'granularity': 'year', 'bucket': {'year': 2029},
+                                          'total_cents': 500, 'count': 1}})
+    assert next(chunks).startswith(b'event: totals\ndata: {"granularity": "year"')
+    response.close()
+    assert change_feed.subscriber_count() == 0
+
+
+def test_detailed_spending_summary_is_paginated(client):
+    """ Test that a year's transactions are listed a page at a time under the full-period totals """
+    users.delete_many({'username': 'pageuser'})
+    users.insert_one({'username': 'pageuser', 'password': bcrypt.generate_password_hash('pw').decode('utf-8')})
+    client.post('/login', data={'username': 'pageuser', 'password': 'pw'})
+    for day in range(1, 6):
+        client.post('/add-transaction', data={'item_name': f'Page item {day}', 'amount': '10',
+                                              'category': 'PageFood', 'date': f'2027-06-0{day}'})
+    body = client.get('/detailed-spending-summary?year=2027&size=2').get_data(as_text=True)
+    assert '5 transactions found.' in body and 'PageFood: $50.0' in body
+    assert 'Page item 5' in body and 'Page item 4' in body and 'Page item 3' not in body
+    older = re.search(r'href="([^"]*after=[^"]*)"', body).group(1).replace('&amp;', '&')
+    body = client.get(older).get_data(as_text=True)
+    assert 'Page item 3' in body and 'Page item 2' in body and 'Page item 5' not in body
+    assert 'year=2027' in older and 'size=2' in older
+
+
+def test_api_batch_skips_transactions_another_batch_claimed(client):
+    """ Test that ids claimed by a concurrent batch are reported missing and leave the rollups alone """
+    import test.app as webapp
+    users.delete_many({'username': 'raceuser'})
+    user_id = str(users.insert_one({'username': 'raceuser',
+                                    'password': bcrypt.generate_password_hash('pw').decode('utf-8')}).inserted_id)
+    client.post('/login', data={'username': 'raceuser', 'password': 'pw'})
+    created = client.post('/api/v1/transactions', json=[{'item_name': 'Race', 'amount': '10', 'category': 'Race',
+                                                         'date': '2026-02-03'}]).get_json()['items'][0]
+    month = {'user_id': user_id, 'granularity': 'month', 'bucket': {'year': 2026, 'month': 2}}
+    # What a concurrent PATCH or DELETE holds between its claim and its write
+    webapp.transactions.update_one({'_id': ObjectId(created['id'])},
+                                   {'$set': {'claim': {'token': ObjectId(), 'at': datetime.now()}}})
+    response = client.patch('/api/v1/transactions', json=[{'id': created['id'], 'amount': '25'}])
+    assert response.get_json() == {'items': [], 'missing': [created['id']]}
+    assert client.delete('/api/v1/transactions', json={'ids': [created['id']]}).get_json()['missing'] == [created['id']]
+    client.post(f"/delete-transaction/{created['id']}")
+    assert webapp.transactions.find_one({'_id': ObjectId(created['id'])}) is not None
+    assert webapp.spending_rollups.find_one(month)['total_cents'] == 1000
@@ -0,0 +1,138 @@
+import os
+os.environ.setdefault('ASYNC_STORE', 'threaded')
+import asyncio
+from datetime import datetime
+from http.cookies import SimpleCookie
+import mongomock
+from bson import ObjectId
+import aio
+from asgi import build_environ, create_application
+from pagination import fetch_page
+from rollups import apply_inserts, read_summary
+from schema import transaction_fields
+from summary import period_bounds, period_match, summarize
+import test.app as webapp
+
+def seed(db, user_id):
+    docs = [dict(transaction_fields('Coffee', '3.50', 'Food', '2024-03-04'), user_id=user_id),
+            dict(transaction_fields('Rent', '900', 'Housing', '2024-03-01'), user_id=user_id),
+            dict(transaction_fields('Book', '12.25', 'Fun', '2023-11-20'), user_id=user_id)]
+    db.transactions.insert_many(docs)
+    apply_inserts(db.spending_rollups, user_id, docs)
+
+def call(application, path, query=b'', cookie=None):
+    headers = [(b'host', b'localhost')]
+    if cookie:
+        headers.append((b'cookie', cookie.encode('latin1')))
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query, 'headers': headers}
+    messages = []
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+    async def send(message):
+        messages.append(message)
+    asyncio.run(application(scope, receive, send))
+    return messages[0]['status'], b''.join(m.get('body', b'') for m in messages[1:])
+
+def test_async_read_summary_matches_sync():
+    """ Test that the concurrent rollup read returns the same summary as rollups.read_summary """
+    db = mongomock.MongoClient().db
+    seed(db, 'u1')
+    assert asyncio.run(aio.read_summary(aio.ThreadedStore(db), 'u1')) == read_summary(db.spending_rollups, 'u1')
+
+def test_async_period_categories_and_page_match_sync():
+    """ Test that the async detailed summary has the same categories as summarize and the same page as fetch_page """
+    db = mongomock.MongoClient().db
+    seed(db, 'u1')
+    match = period_match('u1', *period_bounds(2024))
+    expected = summarize(db.transactions, match, facets=('categories',))['categories']
+    result = asyncio.run(aio.period_categories(aio.ThreadedStore(db), match))
+    assert sorted(result, key=lambda row: row['_id']) == sorted(expected, key=lambda row: row['_id'])
+    assert asyncio.run(aio.first_page(aio.ThreadedStore(db), match, 1)) == fetch_page(db.transactions, match, 1)
+
+def test_build_environ_keeps_query_and_cookies():
+    """ Test translating an ASGI scope into a WSGI environ """
+    environ = build_environ({'type': 'http', 'method': 'GET', 'path': '/detailed-spending-summary',
+                             'query_string': b'year=2024&month=3',
+                             'headers': [(b'host', b'example.com'), (b'cookie', b'session=abc')]})
+    assert environ['PATH_INFO'] == '/detailed-spending-summary'
+    assert environ['QUERY_STRING'] == 'year=2024&month=3'
+    assert environ['HTTP_HOST'] == 'example.com'
+    assert environ['HTTP_COOKIE'] == 'session=abc'
+
+def test_asgi_summary_requires_login():
+    """ Test that the async summary view redirects anonymous users to the login page """
+    application = create_application(webapp, aio.ThreadedStore(webapp.db))
+    status, _ = call(application, '/spending-summary')
+    assert status == 302
+
+def test_asgi_serves_summaries_for_logged_in_user():
+    """ Test the async summary views with a session from the regular login route """
+    webapp.app.config['TESTING'] = True
+    webapp.users.delete_many({'username': 'asgiuser'})
+    user_id = ObjectId()
+    webapp.users.insert_one({'_id': user_id, 'username': 'asgiuser',
+                             'password': webapp.bcrypt.generate_password_hash('pw').decode('utf-8')})
+    webapp.transactions.delete_many({'user_id': str(user_id)})
+    webapp.spending_rollups.delete_many({'user_id': str(user_id)})
+    seed(webapp.db, str(user_id))
+    webapp.summary_cache.invalidate(str(user_id))
+    webapp.user_cache.delete(str(user_id))
+    login = webapp.app.test_client().post('/login', data={'username': 'asgiuser', 'password': 'pw'})
+    cookie = SimpleCookie(login.headers['Set-Cookie'])['session'].OutputString(attrs=[])
+    application = create_application(webapp, aio.ThreadedStore(webapp.db))
+
+    status, body = call(application, '/spending-summary', cookie=cookie)
+    assert status == 200
+    assert b'Yearly Spending' in body
+    traced = webapp.request_metrics.requests.get(('detailed_spending_summary', 'GET', '200'), 0)
+    status, body = call(application, '/detailed-spending-summary', b'year=2024&month=3', cookie=cookie)
+    assert status == 200
+    assert b'Rent' in body and b'Book' not in body
+    # The app's before_request hooks ran, so the metrics traced the native view
+    assert webapp.request_metrics.requests[('detailed_spending_summary', 'GET', '200')] == traced + 1
+    webapp.users.delete_many({'username': 'asgiuser'})
+
+def test_asgi_events_stream_until_disconnect(monkeypatch):
+    """ Test the native /events stream: anonymous users are refused, a subscriber gets its events """
+    monkeypatch.setitem(webapp.app.config, 'LIVE_UPDATES', True)
+    application = create_application(webapp, aio.ThreadedStore(webapp.db))
+    status, _ = call(application, '/events')
+    assert status == 302
+
+    webapp.app.config['TESTING'] = True
+    webapp.users.delete_many({'username': 'asgievents'})
+    user_id = str(webapp.users.insert_one({'username': 'asgievents',
+                                           'password': webapp.bcrypt.generate_password_hash('pw').decode('utf-8')}).inserted_id)
+    login = webapp.app.test_client().post('/login', data={'username': 'asgievents', 'password': 'pw'})
+    cookie = SimpleCookie(login.headers['Set-Cookie'])['session'].OutputString(attrs=[])
+    change = {'operationType': 'update', 'ns': {'coll': 'spending_rollups'},
+              'fullDocument': {'user_id': user_id, 'granularity': 'year', 'bucket': {'year': 2030},
+                               'total_cents': 700, 'count': 1}}
+    scope = {'type': 'http', 'method': 'GET', 'path': '/events', 'query_string': b'',
+             'headers': [(b'host', b'localhost'), (b'cookie', cookie.encode('latin1'))]}
+    messages = []
+
+    async def run():
+        gone = asyncio.Event()
+        async def receive():
+            await gone.wait()
+            return {'type': 'http.disconnect'}
+        async def send(message):
+            messages.append(message)
+            body = message.get('body', b'')
+            if body.startswith(b'retry:'):
+                webapp.change_feed.publish(change)
+            elif body.startswith(b'event: totals'):
+                gone.set()
+        await asyncio.wait_for(application(scope, receive, send), 5)
+
+    keepalive = webapp.app.config['EVENTS_KEEPALIVE']
+    webapp.app.config['EVENTS_KEEPALIVE'] = 0.05
+    try:
+        asyncio.run(run())
+    finally:
+        webapp.app.config['EVENTS_KEEPALIVE'] = keepalive
+    assert messages[0]['status'] == 200 and (b'content-type', b'text/event-stream; charset=utf-8') in messages[0]['headers']
+    assert b'"total": 7.0' in b''.join(m.get('body', b'') for m in messages[1:])
+    assert webapp.change_feed.subscriber_count() == 0
+    webapp.users.delete_many({'username': 'asgievents'})
@@ -0,0 +1,38 @@
+import json
+from types import SimpleNamespace
+from bench.route_bench import ROUTES, main, percentile, succeeded
+from bench.seed import CATEGORIES, generate_transactions
+
+def test_generated_transactions_are_deterministic_and_typed():
+    """ Test that the generator is seeded per user and writes the typed fields """
+    first = list(generate_transactions('u1', 50))
+    assert first == list(generate_transactions('u1', 50))
+    assert first != list(generate_transactions('u2', 50))
+    assert all(doc['category'] in CATEGORIES and doc['amount_cents'] > 0 for doc in first)
+
+def test_percentile_nearest_rank():
+    """ Test nearest-rank percentiles """
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([7], 95) == 7
+    assert percentile([], 50) is None
+
+def test_redirects_to_login_count_as_errors():
+    """ Test that a request bounced to the login page is not a success """
+    assert succeeded(SimpleNamespace(status_code=200, location=None))
+    assert succeeded(SimpleNamespace(status_code=302, location='/'))
+    assert not succeeded(SimpleNamespace(status_code=302, location='/login?next=%2F'))
+    assert not succeeded(SimpleNamespace(status_code=500, location=None))
+
+def test_route_bench_in_memory_report(tmp_path):
+    """ Test a small in-memory run reports every route without errors """
+    output = tmp_path / 'report.json'
+    main(['--in-memory', '--users', '2', '--transactions', '20', '--requests', '60',
+          '--concurrency', '2', '--output', str(output)])
+    report = json.loads(output.read_text())
+    assert report['requests'] == 60
+    assert set(report['routes']) == set(ROUTES)
+    for route in report['routes'].values():
+        assert route['errors'] == 0
+        assert route['p50_ms'] <= route['p95_ms'] <= route['p99_ms']
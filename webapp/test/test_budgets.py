@@ -0,0 +1,62 @@
+import pytest
+from mongomock import MongoClient
+from datetime import datetime
+from bson import ObjectId
+from budgets import check_budget, load_budgets, month_report, month_spent, set_budget
+from rollups import apply_change, apply_inserts, rebuild_rollups
+
+@pytest.fixture
+def db():
+    return MongoClient().db
+
+def test_month_spent_follows_writes(db):
+    """ Test that per-category month totals are maintained by the rollup writes """
+    lunch = {'amount_cents': 1200, 'category': 'Food', 'date': datetime(2024, 5, 3)}
+    apply_inserts(db.spending_rollups, 'u1', [lunch, {'amount_cents': 800, 'category': 'a.b', 'date': datetime(2024, 5, 9)}])
+    apply_change(db.spending_rollups, 'u1', new={'amount_cents': 300, 'category': 'Food', 'date': datetime(2024, 5, 20)})
+    assert month_spent(db.spending_rollups, 'u1', datetime(2024, 5, 1)) == {'Food': 1500, 'a.b': 800}
+    apply_change(db.spending_rollups, 'u1', old=lunch, new=dict(lunch, category='Fun'))
+    assert month_spent(db.spending_rollups, 'u1', datetime(2024, 5, 1))['Food'] == 300
+    assert month_spent(db.spending_rollups, 'u1', datetime(2024, 6, 1)) == {}
+
+def test_rebuild_keeps_category_totals(db):
+    """ Test that rebuilt rollups carry the same month breakdown """
+    rows = [{'user_id': 'u1', 'amount': 20.0, 'category': 'Food', 'date': '2024-05-01'},
+            {'user_id': 'u1', 'amount_cents': 550, 'category': 'Food', 'date': datetime(2024, 5, 2)}]
+    db.transactions.insert_many(rows)
+    rebuild_rollups(db.transactions, db.spending_rollups)
+    assert month_spent(db.spending_rollups, 'u1', datetime(2024, 5, 15)) == {'Food': 2550}
+
+def test_set_budget_and_check(db):
+    """ Test storing limits on the user and the warning/over thresholds """
+    user_id = db.users.insert_one({'username': 'u'}).inserted_id
+    set_budget(db.users, user_id, 'Food', 2000)
+    set_budget(db.users, user_id, 'a.b', 100)
+    set_budget(db.users, user_id, 'a.b', None)
+    budgets = load_budgets(db.users, user_id)
+    assert budgets == {'Food': 2000}
+
+    apply_inserts(db.spending_rollups, 'u1', [{'amount_cents': 1500, 'category': 'Food', 'date': datetime(2024, 5, 3)}])
+    status = check_budget(db.spending_rollups, 'u1', budgets, {'category': 'Food', 'date': datetime(2024, 5, 3)})
+    assert (status['spent'], status['limit'], status['warning'], status['over']) == (15.0, 20.0, False, False)
+    apply_inserts(db.spending_rollups, 'u1', [{'amount_cents': 600, 'category': 'Food', 'date': datetime(2024, 5, 4)}])
+    status = check_budget(db.spending_rollups, 'u1', budgets, {'category': 'Food', 'date': datetime(2024, 5, 4)})
+    assert status['over'] and status['remaining'] == -1.0
+    assert check_budget(db.spending_rollups, 'u1', budgets, {'category': 'Fun', 'date': datetime(2024, 5, 4)}) is None
+
+def test_month_report_orders_by_share_used(db):
+    """ Test the report lists every budget, fullest first, including unused ones """
+    apply_inserts(db.spending_rollups, 'u1', [{'amount_cents': 900, 'category': 'Fun', 'date': datetime(2024, 5, 3)}])
+    report = month_report(db.spending_rollups, 'u1', {'Food': 5000, 'Fun': 1000}, datetime(2024, 5, 31))
+    assert [(row['category'], row['spent']) for row in report] == [('Fun', 9.0), ('Food', 0.0)]
+    assert report[0]['warning'] and not report[0]['over']
+
+def test_check_budget_counts_pending_writes(db):
+    """ Test that queued transactions of the same category and month count as spent """
+    apply_inserts(db.spending_rollups, 'u1', [{'amount_cents': 4000, 'category': 'Food', 'date': datetime(2024, 5, 3)}])
+    new = {'amount_cents': 2000, 'category': 'Food', 'date': datetime(2024, 5, 20)}
+    pending = [new, {'amount_cents': 500, 'category': 'Fun', 'date': datetime(2024, 5, 20)},
+               {'amount_cents': 500, 'category': 'Food', 'date': datetime(2024, 6, 1)}]
+    assert check_budget(db.spending_rollups, 'u1', {'Food': 5000}, new)['over'] is False
+    status = check_budget(db.spending_rollups, 'u1', {'Food': 5000}, new, pending=pending)
+    assert status['spent'] == 60.0 and status['over']
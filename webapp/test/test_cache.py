@@ -0,0 +1,92 @@
+from cache import MISSING, LRUCache, RedisCache, SummaryCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+class FakeRedis:
+    """ Minimal stand-in for the redis-py calls RedisCache uses """
+    def __init__(self):
+        self.data = {}
+    def get(self, key):
+        return self.data.get(key)
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+def test_lru_cache_bounds_size_and_counts():
+    """ Test LRU eviction order and the hit/miss/eviction counters """
+    cache = LRUCache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is MISSING
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'evictions': 1}
+
+def test_lru_cache_bounds_pickled_bytes():
+    """ Test eviction by total pickled size and that an oversized value is not cached """
+    cache = LRUCache(max_bytes=250)
+    cache.set('a', 'x' * 100)
+    cache.set('b', 'y' * 100)
+    assert cache.get('a') == 'x' * 100
+    cache.set('c', 'z' * 100)
+    assert cache.get('b') is MISSING and len(cache) == 2 and cache.size <= 250
+    cache.set('d', 'w' * 1000)
+    assert cache.get('d') is MISSING and cache.get('a') == 'x' * 100
+    cache.delete('a', 'c')
+    assert cache.size == 0
+
+def test_lru_cache_expires_entries():
+    """ Test that entries older than the TTL are misses """
+    clock = FakeClock()
+    cache = LRUCache(ttl=10, clock=clock)
+    cache.set('a', 1)
+    clock.now = 9
+    assert cache.get('a') == 1
+    clock.now = 10
+    assert cache.get('a') is MISSING
+    assert len(cache) == 0
+
+def test_summary_cache_read_through():
+    """ Test that the value is computed once and then served from the cache """
+    cache = SummaryCache(LRUCache())
+    calls = []
+    compute = lambda: calls.append(1) or {'total': 5}
+    key = SummaryCache.key('spending', 'u1')
+    assert cache.get_or_compute(key, compute) == {'total': 5}
+    assert cache.get_or_compute(key, compute) == {'total': 5}
+    assert len(calls) == 1
+
+def test_summary_cache_invalidates_only_affected_periods():
+    """ Test that an edit drops the old and new periods of that user only """
+    cache = SummaryCache(LRUCache())
+    keys = [
+        SummaryCache.key('spending', 'u1'),
+        SummaryCache.key('analytics', 'u1'),
+        SummaryCache.key('categories', 'u1', 2023),
+        SummaryCache.key('categories', 'u1', 2023, 1),
+        SummaryCache.key('categories', 'u1', 2024, 3),
+        SummaryCache.key('categories', 'u1', 2023, 2),
+        SummaryCache.key('categories', 'u2', 2023, 1),
+    ]
+    for key in keys:
+        cache.backend.set(key, 'cached')
+    cache.invalidate('u1', {'date': '2023-01-10'}, {'date': '2024-03-02'})
+    remaining = [key for key in keys if cache.backend.get(key) is not MISSING]
+    assert remaining == [SummaryCache.key('categories', 'u1', 2023, 2), SummaryCache.key('categories', 'u2', 2023, 1)]
+
+def test_redis_cache_backend():
+    """ Test the Redis backend against a stand-in client """
+    cache = SummaryCache(RedisCache(FakeRedis()))
+    key = SummaryCache.key('categories', 'u1', 2023, 1)
+    assert cache.get_or_compute(key, lambda: {'categories': []}) == {'categories': []}
+    assert cache.backend.get(key) == {'categories': []}
+    cache.invalidate('u1', {'date': '2023-01-05'})
+    assert cache.backend.get(key) is MISSING
+    assert cache.stats() == {'hits': 1, 'misses': 2, 'evictions': 0}
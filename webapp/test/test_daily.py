@@ -0,0 +1,54 @@
+import pytest
+from mongomock import MongoClient
+from datetime import datetime
+from daily import (apply_daily_changes, apply_daily_inserts, check_daily, decode_category, encode_category,
+                   range_summary, rebuild_daily)
+
+@pytest.fixture
+def db():
+    return MongoClient().db
+
+def test_category_keys_round_trip():
+    """ Test that names with dots, dollars, percent signs and empty names survive as field names """
+    for name in ('Food', 'a.b', '$x', '100%', '%2E', ''):
+        key = encode_category(name)
+        assert '.' not in key and not key.startswith('$') and key
+        assert decode_category(key) == name
+
+def test_range_summary_follows_inserts_edits_and_deletes(db):
+    """ Test that daily buckets track writes and sum over an arbitrary range """
+    coffee = {'amount_cents': 450, 'category': 'Dining', 'date': datetime(2024, 1, 10)}
+    rent = {'amount_cents': 90000, 'category': 'Housing', 'date': datetime(2024, 1, 1)}
+    apply_daily_inserts(db.spending_daily, 'u1', [coffee, rent, dict(coffee, date=datetime(2024, 2, 3))])
+    summary = range_summary(db.spending_daily, 'u1', datetime(2024, 1, 1), datetime(2024, 1, 31))
+    assert summary['categories'] == [{'_id': 'Housing', 'total': 900.0, 'count': 1},
+                                     {'_id': 'Dining', 'total': 4.5, 'count': 1}]
+    assert (summary['total'], summary['count'], summary['days']) == (904.5, 2, 2)
+
+    apply_daily_changes(db.spending_daily, 'u1', [(coffee, dict(coffee, category='Food')), (rent, None)])
+    summary = range_summary(db.spending_daily, 'u1', datetime(2024, 1, 1), datetime(2024, 3, 1))
+    assert summary['categories'] == [{'_id': 'Dining', 'total': 4.5, 'count': 1}, {'_id': 'Food', 'total': 4.5, 'count': 1}]
+    assert summary['total'] == 9.0
+    assert range_summary(db.spending_daily, 'u2', datetime(2024, 1, 1), datetime(2024, 3, 1))['categories'] == []
+
+def test_rebuild_matches_incremental_and_checker(db):
+    """ Test that a rebuild equals incremental updates and the checker spots drift """
+    rows = [
+        {'user_id': 'u1', 'amount': 200.0, 'category': 'Food', 'date': '2023-01-01'},
+        {'user_id': 'u1', 'amount_cents': 1500, 'category': 'a.b', 'date': datetime(2023, 1, 1)},
+        {'user_id': 'u2', 'amount': 30.0, 'category': 'Food', 'date': '2023-02-01'},
+    ]
+    db.transactions.insert_many([dict(row) for row in rows])
+    for row in rows:
+        apply_daily_inserts(db.spending_daily, row['user_id'], [row])
+    assert check_daily(db.transactions, db.spending_daily) == []
+    incremental = range_summary(db.spending_daily, 'u1', datetime(2023, 1, 1), datetime(2024, 1, 1))
+
+    assert rebuild_daily(db.transactions, db.spending_daily) == 2
+    assert range_summary(db.spending_daily, 'u1', datetime(2023, 1, 1), datetime(2024, 1, 1)) == incremental
+    assert check_daily(db.transactions, db.spending_daily) == []
+
+    db.spending_daily.update_one({'user_id': 'u2'}, {'$inc': {'categories.Food.total_cents': 1}})
+    assert check_daily(db.transactions, db.spending_daily) == [
+        ('u2', datetime(2023, 2, 1), 'Food', (3000, 1), (3001, 1))]
+    assert check_daily(db.transactions, db.spending_daily, user_id='u1') == []
@@ -0,0 +1,212 @@
+import asyncio
+import os
+import threading
+import time
+import pytest
+from bson import ObjectId
+from events import AsyncSubscription, ChangeFeed, async_event_stream, event_stream, format_event, to_event
+from schema import transaction_fields
+
+
+def transaction_change(operation, doc, before=None):
+    change = {'operationType': operation, 'ns': {'db': 'mydatabase', 'coll': 'transactions'},
+              'documentKey': {'_id': (doc or before)['_id']}}
+    if doc is not None:
+        change['fullDocument'] = doc
+    if before is not None:
+        change['fullDocumentBeforeChange'] = before
+    return change
+
+
+def rollup_change(user_id, total_cents=1250, count=2):
+    doc = {'_id': ObjectId(), 'user_id': user_id, 'granularity': 'month',
+           'bucket': {'year': 2024, 'month': 3}, 'total_cents': total_cents, 'count': count}
+    return {'operationType': 'update', 'ns': {'db': 'mydatabase', 'coll': 'spending_rollups'},
+            'documentKey': {'_id': doc['_id']}, 'fullDocument': doc}
+
+
+def transaction(user_id='u1', name='Coffee'):
+    return dict(transaction_fields(name, '3.50', 'Food', '2024-03-04'), _id=ObjectId(), user_id=user_id)
+
+
+class FakeStream:
+    def __init__(self, changes, fail=False):
+        self.changes = list(changes)
+        self.fail = fail
+        self.alive = True
+        self.resume_token = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def try_next(self):
+        if not self.changes:
+            if self.fail:
+                raise ConnectionError('stream lost')
+            time.sleep(0.01)
+            return None
+        change = self.changes.pop(0)
+        self.resume_token = change['_id']
+        return change
+
+
+class FakeFeed(ChangeFeed):
+    def __init__(self, streams):
+        super().__init__(db=None, retry_delay=0.01)
+        self.streams = list(streams)
+        self.resumed_from = []
+
+    def watch(self):
+        self.resumed_from.append(self.resume_token)
+        return self.streams.pop(0) if self.streams else FakeStream([])
+
+
+def test_to_event_routes_transaction_changes():
+    """ Test translating inserts, updates and deletes of transactions """
+    doc = transaction()
+    user_id, name, data = to_event(transaction_change('insert', doc))
+    assert (user_id, name, data['op']) == ('u1', 'transaction', 'insert')
+    assert data['transaction']['item_name'] == 'Coffee' and data['transaction']['id'] == str(doc['_id'])
+    assert to_event(transaction_change('update', doc))[2]['op'] == 'update'
+    assert to_event(transaction_change('delete', None, before=doc)) == ('u1', 'transaction', {'op': 'delete', 'id': str(doc['_id'])})
+
+
+def test_to_event_skips_changes_it_cannot_route():
+    """ Test that deletes without a pre-image and rollup deletes are dropped """
+    doc = transaction()
+    assert to_event(transaction_change('delete', None, before={'_id': doc['_id']})) is None
+    change = rollup_change('u1')
+    change['operationType'] = 'delete'
+    del change['fullDocument']
+    assert to_event(change) is None
+
+
+def test_to_event_reports_rollup_totals():
+    """ Test that a rollup change becomes a totals event in dollars """
+    assert to_event(rollup_change('u1')) == ('u1', 'totals', {'granularity': 'month', 'bucket': {'year': 2024, 'month': 3},
+                                                             'total': 12.5, 'count': 2})
+
+
+def test_publish_reaches_only_the_users_subscriptions():
+    """ Test fan-out of one change to every open page of its user """
+    feed = ChangeFeed(db=None)
+    first, second, other = feed.subscribe('u1'), feed.subscribe('u1'), feed.subscribe('u2')
+    feed.publish(rollup_change('u1'))
+    assert first.get(0)[0] == second.get(0)[0] == 'totals'
+    assert other.get(0) is None
+    feed.unsubscribe(first)
+    feed.unsubscribe(second)
+    assert feed.subscriber_count() == 1
+
+
+def test_slow_subscriber_is_closed_and_told_to_resync():
+    """ Test that a subscription that falls too far behind ends with a resync event """
+    feed = ChangeFeed(db=None)
+    subscription = feed.subscribe('u1')
+    subscription._queue.maxsize = 2
+    for _ in range(3):
+        feed.publish(rollup_change('u1'))
+    assert subscription.closed
+    chunks = list(event_stream(feed, subscription, keepalive=0))
+    assert chunks[0] == 'retry: 3000\n\n'
+    assert chunks[-1] == format_event('resync', {})
+    assert feed.subscriber_count() == 0
+
+
+def test_event_stream_sends_keepalives_and_unsubscribes_on_close():
+    """ Test the keepalive comment and cleanup when the client goes away """
+    feed = ChangeFeed(db=None)
+    stream = event_stream(feed, feed.subscribe('u1'), keepalive=0.01)
+    assert next(stream) == 'retry: 3000\n\n'
+    assert next(stream) == ': keepalive\n\n'
+    feed.publish(rollup_change('u1'))
+    assert next(stream).startswith('event: totals\ndata: {"granularity": "month"')
+    stream.close()
+    assert feed.subscriber_count() == 0
+
+
+def test_async_event_stream_delivers_events_from_another_thread():
+    """ Test an AsyncSubscription fed from the feed thread """
+    feed = ChangeFeed(db=None)
+
+    async def read():
+        subscription = feed.subscribe('u1', AsyncSubscription('u1', asyncio.get_running_loop()))
+        stream = async_event_stream(feed, subscription, keepalive=1)
+        assert await stream.__anext__() == 'retry: 3000\n\n'
+        threading.Thread(target=feed.publish, args=(rollup_change('u1'),)).start()
+        chunk = await stream.__anext__()
+        await stream.aclose()
+        return chunk
+
+    assert asyncio.run(read()).startswith('event: totals\n')
+    assert feed.subscriber_count() == 0
+
+
+def test_change_feed_resumes_after_a_failed_stream():
+    """ Test that the feed thread reopens the stream after the last event it saw """
+    first, second = transaction(name='First'), transaction(name='Second')
+    feed = FakeFeed([FakeStream([dict(transaction_change('insert', first), _id='token-1')], fail=True),
+                     FakeStream([dict(transaction_change('insert', second), _id='token-2')])])
+    subscription = feed.subscribe('u1')
+    feed.start()
+    try:
+        names = [subscription.get(2)[1]['transaction']['item_name'] for _ in range(2)]
+    finally:
+        feed.stop(2)
+    assert names == ['First', 'Second']
+    assert feed.resumed_from[:2] == [None, 'token-1']
+
+
+class RecordedStop:
+    """ Stands in for the feed's stop event: records the waits and stops after ``count`` of them """
+    def __init__(self, count):
+        self.count = count
+        self.waits = []
+
+    def is_set(self):
+        return len(self.waits) >= self.count
+
+    def wait(self, timeout):
+        self.waits.append(timeout)
+
+
+def test_change_feed_backs_off_while_the_stream_cannot_open():
+    """ Test that retries wait twice as long each time, up to the maximum, and start over once a stream opens """
+    class FlakyFeed(ChangeFeed):
+        def __init__(self, outcomes):
+            super().__init__(db=None, retry_delay=1, max_retry_delay=4)
+            self.outcomes = list(outcomes)
+
+        def watch(self):
+            if self.outcomes.pop(0) == 'fail':
+                raise ConnectionError('no replica set')
+            return FakeStream([], fail=True)
+
+    feed = FlakyFeed(['fail'] * 4 + ['open'] + ['fail'] * 2)  # the opened stream fails too
+    feed._stop = RecordedStop(7)
+    feed._run()
+    assert feed._stop.waits == [1, 2, 4, 4, 1, 2, 4]
+
+
+@pytest.mark.skipif(not os.getenv('REPLICA_SET_URI'), reason='needs a replica set in REPLICA_SET_URI')
+def test_change_feed_on_a_replica_set():
+    """ Test an insert into a real replica set reaching a subscriber """
+    from pymongo import MongoClient
+    client = MongoClient(os.environ['REPLICA_SET_URI'])
+    db = client.get_database('events_test')
+    feed = ChangeFeed(db, max_await_ms=100)
+    user_id = str(ObjectId())
+    subscription = feed.subscribe(user_id)
+    feed.start()
+    try:
+        time.sleep(0.5)  # let the stream open before writing
+        db.transactions.insert_one(transaction(user_id, 'Replica coffee'))
+        event = subscription.get(10)
+    finally:
+        feed.stop(5)
+        client.drop_database('events_test')
+        client.close()
+    assert event[0] == 'transaction' and event[1]['transaction']['item_name'] == 'Replica coffee'
@@ -0,0 +1,35 @@
+import io
+import json
+from datetime import datetime
+from exporter import export_row, csv_chunks, jsonl_chunks
+from importer import import_transactions
+from mongomock import MongoClient
+
+ROWS = [
+    {'_id': 1, 'item_name': 'Coffee', 'amount_cents': 250, 'category': 'Dining', 'date': datetime(2023, 1, 10)},
+    {'_id': 2, 'item_name': 'Refund', 'amount_cents': -5, 'category': 'Other', 'date': datetime(2023, 1, 11)},
+    {'_id': 3, 'item_name': 'Legacy', 'amount': 4.5, 'category': 'Dining', 'date': '2022-12-31'},
+]
+
+def test_export_row_formats_amount_and_date():
+    """ Test the exported columns for typed and legacy documents """
+    assert export_row(ROWS[0]) == {'item_name': 'Coffee', 'amount': '2.50', 'category': 'Dining', 'date': '2023-01-10'}
+    assert export_row(ROWS[1])['amount'] == '-0.05'
+    assert export_row(ROWS[2])['amount'] == '4.50'
+
+def test_csv_chunks_are_bounded():
+    """ Test that CSV output is yielded in chunks of rows """
+    chunks = list(csv_chunks(iter(ROWS), rows_per_chunk=2))
+    assert len(chunks) == 2
+    lines = ''.join(chunks).splitlines()
+    assert lines[0] == 'item_name,amount,category,date'
+    assert lines[1:] == ['Coffee,2.50,Dining,2023-01-10', 'Refund,-0.05,Other,2023-01-11', 'Legacy,4.50,Dining,2022-12-31']
+
+def test_jsonl_export_round_trips_through_import():
+    """ Test that an export can be imported again unchanged """
+    exported = ''.join(jsonl_chunks(iter(ROWS)))
+    assert json.loads(exported.splitlines()[0])['amount'] == '2.50'
+    transactions = MongoClient().db.transactions
+    result = import_transactions(transactions, io.StringIO(exported), 'jsonl', 'u1')
+    assert result.accepted == 3
+    assert sorted(doc['amount_cents'] for doc in transactions.find()) == [-5, 250, 450]
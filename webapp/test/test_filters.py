@@ -0,0 +1,43 @@
+import pytest
+from mongomock import MongoClient
+from datetime import datetime
+from filters import NO_FILTERS, Filters, apply_filters, filter_args, is_filtered, parse_filters
+from schema import transaction_fields
+from summary import period_match
+
+@pytest.fixture
+def transactions():
+    collection = MongoClient().db.transactions
+    rows = [('Iced Coffee', '4.50', 'Dining', '2024-01-10'), ('Coffee beans', '18', 'Groceries', '2024-02-01'),
+            ('Coffeemaker', '120', 'Home', '2024-02-15'), ('Rent', '900', 'Housing', '2024-02-01')]
+    collection.insert_many([dict(transaction_fields(*row), user_id='u1') for row in rows])
+    collection.insert_one(dict(transaction_fields('Coffee', '3', 'Dining', '2024-01-11'), user_id='u2'))
+    return collection
+
+def names(transactions, filters, start=None, end=None):
+    match = apply_filters(period_match('u1', start, end), filters)
+    return sorted(doc['item_name'] for doc in transactions.find(match))
+
+def test_parse_filters():
+    """ Test reading filters from query arguments """
+    assert parse_filters({}) == NO_FILTERS and not is_filtered(parse_filters({'q': ' ', 'category': ''}))
+    filters = parse_filters({'q': 'Iced  COFFEE!', 'category': ' Dining ', 'min': '1.5', 'max': '10'})
+    assert filters == Filters(('iced', 'coffee'), 'Dining', 150, 1000)
+    assert filter_args(filters) == {'q': 'iced coffee', 'category': 'Dining', 'min': '1.50', 'max': '10.00'}
+    for args in ({'min': 'abc'}, {'min': '10', 'max': '5'}):
+        with pytest.raises(ValueError):
+            parse_filters(args)
+
+def test_search_matches_word_prefixes(transactions):
+    """ Test that every search word must prefix a word of the item name, for one user only """
+    assert names(transactions, parse_filters({'q': 'coff'})) == ['Coffee beans', 'Coffeemaker', 'Iced Coffee']
+    assert names(transactions, parse_filters({'q': 'coffee be'})) == ['Coffee beans']
+    assert names(transactions, parse_filters({'q': 'offee'})) == []
+    assert names(transactions, parse_filters({'q': 'c.*'})) == names(transactions, parse_filters({'q': 'c'}))
+
+def test_filters_combine_with_period(transactions):
+    """ Test category, amount and date filters together """
+    assert names(transactions, parse_filters({'category': 'Dining'})) == ['Iced Coffee']
+    assert names(transactions, parse_filters({'min': '10', 'max': '200'})) == ['Coffee beans', 'Coffeemaker']
+    assert names(transactions, parse_filters({'q': 'coffee', 'max': '100'}),
+                 datetime(2024, 2, 1), datetime(2024, 3, 1)) == ['Coffee beans']
@@ -0,0 +1,59 @@
+import pytest
+import threading
+from flask import Flask
+from flask_bcrypt import Bcrypt
+from hashing import HasherBusy, PasswordHasher, hash_cost
+from metrics import RequestMetrics
+
+@pytest.fixture
+def bcrypt():
+    app = Flask(__name__)
+    app.config['BCRYPT_LOG_ROUNDS'] = 4
+    return Bcrypt(app)
+
+class BlockingBcrypt:
+    """ Stand-in whose hashes wait until released """
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def generate_password_hash(self, password, rounds=None):
+        self.started.set()
+        self.release.wait(5)
+        return f'$2b${rounds:02d}$hash'.encode()
+
+def test_hash_cost():
+    """ Test reading the work factor from a stored hash """
+    assert hash_cost('$2b$12$abcdefghijklmnopqrstuv') == 12
+    assert hash_cost(b'$2b$04$abcdefghijklmnopqrstuv') == 4
+    assert hash_cost('plain') is None
+
+def test_hash_check_and_rehash(bcrypt):
+    """ Test hashing on the pool and detecting hashes made at another cost """
+    metrics = RequestMetrics()
+    hasher = PasswordHasher(bcrypt, rounds=5, metrics=metrics)
+    hashed = hasher.hash('secret')
+    assert hash_cost(hashed) == 5 and not hasher.needs_rehash(hashed)
+    assert hasher.check(hashed, 'secret') and not hasher.check(hashed, 'wrong')
+    assert hasher.needs_rehash(bcrypt.generate_password_hash('secret').decode('utf-8'))
+    text = metrics.render()
+    assert 'budget_password_hash_seconds_count{operation="hash"} 1' in text
+    assert 'budget_password_hash_seconds_count{operation="check"} 2' in text
+    assert 'budget_password_hash_wait_seconds_count{operation="check"} 2' in text
+    hasher.shutdown()
+
+def test_full_pool_is_refused():
+    """ Test that jobs beyond the workers and queue are refused at once """
+    fake, metrics = BlockingBcrypt(), RequestMetrics()
+    hasher = PasswordHasher(fake, rounds=4, workers=1, max_pending=0, metrics=metrics)
+    results = []
+    worker = threading.Thread(target=lambda: results.append(hasher.hash('first')))
+    worker.start()
+    assert fake.started.wait(5)
+    with pytest.raises(HasherBusy):
+        hasher.hash('second')
+    fake.release.set()
+    worker.join(5)
+    assert results == ['$2b$04$hash'] and hasher.hash('third') == '$2b$04$hash'
+    assert 'budget_password_hash_rejected_total{operation="hash"} 1' in metrics.render()
+    hasher.shutdown()
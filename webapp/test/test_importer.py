@@ -0,0 +1,73 @@
+import io
+import pytest
+from mongomock import MongoClient
+from pymongo.errors import BulkWriteError
+from datetime import datetime
+from importer import detect_format, import_transactions
+
+@pytest.fixture
+def transactions():
+    return MongoClient().db.transactions
+
+def test_detect_format():
+    """ Test format detection from the file name """
+    assert detect_format('export.JSONL') == 'jsonl'
+    assert detect_format('bank.csv') == 'csv'
+    assert detect_format(None) == 'csv'
+
+def test_import_csv_in_batches(transactions):
+    """ Test that valid CSV rows are inserted in batches and invalid ones reported """
+    stream = io.StringIO(
+        'item_name,amount,category,date\n'
+        'Coffee,2.50,Dining,2023-01-10\n'
+        'Rent,1200,Utilities,2023-01-01\n'
+        ',5,Other,2023-01-02\n'
+        'Taxi,abc,Transport,2023-01-03\n'
+        'Lunch,12.30,Dining,2023-01-11\n'
+    )
+    batches = []
+    result = import_transactions(transactions, stream, 'csv', 'u1', batch_size=2, on_batch=batches.append)
+    assert (result.accepted, result.rejected) == (3, 2)
+    assert result.errors[0] == 'line 4: missing item_name'
+    assert [len(batch) for batch in batches] == [2, 1]
+    coffee = transactions.find_one({'item_name': 'Coffee'})
+    assert coffee['amount_cents'] == 250 and coffee['date'] == datetime(2023, 1, 10) and coffee['user_id'] == 'u1'
+
+def test_import_jsonl(transactions):
+    """ Test JSON Lines rows, blank lines and malformed lines """
+    stream = io.StringIO(
+        '{"item_name": "Coffee", "amount": 2.5, "category": "Dining", "date": "2023-01-10"}\n'
+        '\n'
+        'not json\n'
+        '{"item_name": "Gas", "amount": "40", "category": "Transport", "date": "2023-13-01"}\n'
+    )
+    result = import_transactions(transactions, stream, 'jsonl', 'u1')
+    assert (result.accepted, result.rejected) == (1, 2)
+    assert result.errors[0] == 'line 3: not a JSON object'
+    assert transactions.count_documents({}) == 1
+
+def test_zero_amount_is_not_missing(transactions):
+    """ Test that only absent or blank fields are reported missing """
+    stream = io.StringIO(
+        '{"item_name": "Refund", "amount": 0, "category": "Dining", "date": "2023-01-10"}\n'
+        '{"item_name": "Gas", "amount": " ", "category": "Transport", "date": "2023-01-11"}\n'
+    )
+    result = import_transactions(transactions, stream, 'jsonl', 'u1')
+    assert (result.accepted, result.rejected) == (1, 1)
+    assert result.errors == ['line 2: missing amount']
+    assert transactions.find_one({'item_name': 'Refund'})['amount_cents'] == 0
+
+def test_import_reports_oversized_amounts_and_failed_writes_by_line(transactions, monkeypatch):
+    """ Test that an out-of-range amount is an invalid row and a failed write names its source line """
+    stream = io.StringIO(
+        'item_name,amount,category,date\n'
+        'Coffee,2.50,Dining,2023-01-10\n'
+        'Yacht,1e20,Fun,2023-01-11\n'
+        'Lunch,12.30,Dining,2023-01-11\n'
+    )
+    def insert_many(docs, ordered=True):
+        raise BulkWriteError({'writeErrors': [{'index': 1, 'errmsg': 'duplicate'}]})
+    monkeypatch.setattr(transactions, 'insert_many', insert_many)
+    result = import_transactions(transactions, stream, 'csv', 'u1')
+    assert (result.accepted, result.rejected) == (1, 2)
+    assert result.errors == ["line 3: Amount out of range: '1e20'", "line 4: write failed for 'Lunch'"]
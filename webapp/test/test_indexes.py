@@ -0,0 +1,32 @@
+import pytest
+import mongomock
+from mongomock import MongoClient
+from indexes import INDEXES, ensure_indexes, find_collscans, check_query_plans
+from test.app import db as app_db
+
+def test_ensure_indexes_is_idempotent():
+    """ Test that every declared index exists after running ensure_indexes twice """
+    db = MongoClient().db
+    ensure_indexes(db)
+    ensure_indexes(db)
+    for collection, models in INDEXES.items():
+        existing = db[collection].index_information()
+        for model in models:
+            assert model.document['name'] in existing
+    assert db.spending_rollups.index_information()['user_granularity_bucket'].get('unique')
+    assert db.spending_daily.index_information()['user_day'].get('unique')
+
+def test_find_collscans_ignores_rejected_plans():
+    """ Test COLLSCAN detection in nested explain output """
+    indexed = {'queryPlanner': {'winningPlan': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN'}},
+                                'rejectedPlans': [{'stage': 'COLLSCAN'}]}}
+    scanned = {'stages': [{'$cursor': {'queryPlanner': {'winningPlan': {'stage': 'COLLSCAN'}}}}]}
+    assert not find_collscans(indexed)
+    assert find_collscans(scanned)
+
+def test_route_queries_use_indexes():
+    """ Test that no route query falls back to COLLSCAN (needs a real MongoDB) """
+    if isinstance(app_db, mongomock.Database):
+        pytest.skip('mongomock does not support explain')
+    ensure_indexes(app_db)
+    assert check_query_plans(app_db) == []
@@ -0,0 +1,94 @@
+import logging
+from types import SimpleNamespace
+from flask import Flask, Response, render_template_string
+from metrics import Histogram, RequestMetrics
+
+def command_event(name, command, duration_micros=2000):
+    return SimpleNamespace(command_name=name, command=command, duration_micros=duration_micros)
+
+def make_app(metrics):
+    app = Flask(__name__)
+    metrics.init_app(app)
+
+    @app.route('/summary')
+    def summary():
+        event = command_event('aggregate', {'aggregate': 'transactions', 'pipeline': [{'$match': {'user_id': 'u1'}}]})
+        metrics.started(event)
+        metrics.succeeded(event)
+        return render_template_string('{{ total }}', total=5)
+
+    @app.route('/stream')
+    def stream():
+        def rows():
+            event = command_event('find', {'find': 'transactions', 'filter': {}})
+            metrics.started(event)
+            metrics.succeeded(event)
+            yield 'row'
+        return Response(rows())
+    return app
+
+def test_histogram_buckets_are_cumulative():
+    """ Test that observations count towards every bucket at or above them """
+    histogram = Histogram((1, 5, 10))
+    for value in (0.5, 3, 7, 20):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 3]
+    assert histogram.count == 4 and histogram.sum == 30.5
+
+def test_request_trace_counts_commands_and_templates():
+    """ Test that a request's commands and template time land in its route's histograms """
+    metrics = RequestMetrics()
+    app = make_app(metrics)
+    assert app.test_client().get('/summary').get_data(as_text=True) == '5'
+    round_trips = metrics.histograms[('request_mongo_round_trips', 'summary')]
+    assert round_trips.count == 1 and round_trips.sum == 1
+    assert metrics.histograms[('request_mongo_seconds', 'summary')].sum == 0.002
+    assert metrics.histograms[('request_template_seconds', 'summary')].sum > 0
+    assert metrics.requests == {('summary', 'GET', '200'): 1}
+
+def test_streamed_response_is_recorded_after_the_body():
+    """ Test that queries run while streaming a response are attributed to it """
+    metrics = RequestMetrics()
+    response = make_app(metrics).test_client().get('/stream')
+    assert response.get_data(as_text=True) == 'row'
+    response.close()
+    assert metrics.histograms[('request_mongo_round_trips', 'stream')].sum == 1
+
+def test_commands_outside_requests_are_only_counted():
+    """ Test that commands without a request trace only increment the command counter """
+    metrics = RequestMetrics()
+    metrics.started(command_event('ping', {'ping': 1}))
+    assert metrics.commands == {'ping': 1}
+    assert metrics.histograms == {}
+
+def test_render_prometheus_text():
+    """ Test the exposition format of histograms and counters """
+    metrics = RequestMetrics()
+    make_app(metrics).test_client().get('/summary')
+    text = metrics.render()
+    assert '# TYPE budget_request_duration_seconds histogram' in text
+    assert 'budget_request_mongo_round_trips_bucket{route="summary",le="1"} 1' in text
+    assert 'budget_request_duration_seconds_count{route="summary"} 1' in text
+    assert 'budget_requests_total{route="summary",method="GET",status="200"} 1' in text
+    assert 'budget_mongo_commands_total{command="aggregate"} 1' in text
+
+def test_slow_requests_are_logged_with_pipeline(caplog):
+    """ Test that the slow log includes the aggregation pipeline """
+    metrics = RequestMetrics(slow_threshold=0)
+    app = make_app(metrics)
+    with caplog.at_level(logging.WARNING):
+        app.test_client().get('/summary')
+    assert 'Slow request GET /summary' in caplog.text
+    assert '"pipeline": [{"$match": {"user_id": "u1"}}]' in caplog.text
+
+def test_multiprocess_render_sums_every_worker(tmp_path, monkeypatch):
+    """ Test that each process's snapshot is added into the rendered totals """
+    workers = [RequestMetrics(multiprocess_dir=str(tmp_path)) for _ in range(2)]
+    for pid, metrics in enumerate(workers, start=100):
+        monkeypatch.setattr('metrics.os.getpid', lambda pid=pid: pid)
+        make_app(metrics).test_client().get('/summary')
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['100.json', '101.json']
+    text = workers[1].render()
+    assert 'budget_requests_total{route="summary",method="GET",status="200"} 2' in text
+    assert 'budget_request_mongo_round_trips_bucket{route="summary",le="1"} 2' in text
+    assert 'budget_mongo_commands_total{command="aggregate"} 2' in text
@@ -0,0 +1,32 @@
+import pytest
+from mongomock import MongoClient
+from datetime import datetime
+from migration import MIGRATION_ID, migrate_transactions
+
+@pytest.fixture
+def db():
+    return MongoClient().db
+
+def test_migrate_transactions_converts_legacy_documents(db):
+    """ Test that legacy documents get BSON dates, integer cents and search terms """
+    db.transactions.insert_many([
+        {'user_id': 'u1', 'item_name': 'Iced Coffee', 'amount': 4.5, 'date': '2023-01-10'},
+        {'user_id': 'u1', 'amount_cents': 999, 'date': datetime(2023, 1, 11)},
+        {'user_id': 'u1', 'amount': 8.99, 'date': datetime(2023, 1, 12)},
+        {'user_id': 'u1', 'amount': 1.0, 'date': 'not a date'},
+    ])
+    assert migrate_transactions(db.transactions, db.migrations, batch_size=1) == (3, 1)
+    docs = list(db.transactions.find({'date': {'$type': 'date'}}).sort('date', 1))
+    assert [doc['amount_cents'] for doc in docs] == [450, 999, 899]
+    assert [doc['search_terms'] for doc in docs] == [['iced', 'coffee'], [], []]
+    assert all('amount' not in doc for doc in docs)
+    assert db.migrations.find_one({'_id': MIGRATION_ID}) is None
+
+def test_migrate_transactions_resumes_from_checkpoint(db):
+    """ Test that a saved checkpoint skips the already converted range """
+    first = db.transactions.insert_one({'user_id': 'u1', 'amount': 1.0, 'date': '2023-01-10'}).inserted_id
+    db.transactions.insert_one({'user_id': 'u1', 'amount': 2.0, 'date': '2023-01-11'})
+    db.migrations.insert_one({'_id': MIGRATION_ID, 'last_id': first})
+    assert migrate_transactions(db.transactions, db.migrations) == (1, 0)
+    assert db.transactions.find_one({'_id': first})['amount'] == 1.0
+    assert migrate_transactions(db.transactions, db.migrations, restart=True) == (1, 0)
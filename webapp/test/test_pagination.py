@@ -0,0 +1,49 @@
+import pytest
+from mongomock import MongoClient
+from datetime import datetime, timedelta
+from pagination import encode_cursor, decode_cursor, seek_filter, fetch_page
+
+@pytest.fixture
+def transactions():
+    collection = MongoClient().db.transactions
+    start = datetime(2023, 1, 1)
+    # Two transactions per day so pages split ties on date by _id
+    collection.insert_many([
+        {'user_id': 'u1', 'item_name': f'item {i}', 'amount_cents': 100 + i, 'category': 'Other',
+         'date': start + timedelta(days=i // 2), 'note': 'not displayed'}
+        for i in range(7)
+    ])
+    return collection
+
+def test_cursor_round_trip():
+    """ Test encoding and decoding of date and legacy string boundaries """
+    doc = {'_id': '507f191e810c19729de860ea', 'date': datetime(2023, 1, 2)}
+    date, _id = decode_cursor(encode_cursor(doc))
+    assert date == datetime(2023, 1, 2) and str(_id) == doc['_id']
+    assert decode_cursor(encode_cursor({'_id': doc['_id'], 'date': '2023-01-02'}))[0] == '2023-01-02'
+    with pytest.raises(ValueError):
+        decode_cursor('garbage')
+
+def test_seek_filter_crosses_storage_formats():
+    """ Test that string dates sort below BSON dates when seeking """
+    older = seek_filter(datetime(2023, 1, 2), 'id', older=True)
+    assert {'date': {'$type': 'string'}} in older['$or']
+    newer = seek_filter('2023-01-02', 'id', older=False)
+    assert {'date': {'$type': 'date'}} in newer['$or']
+
+def test_fetch_page_walks_forward_and_back(transactions):
+    """ Test newest-first pages following next and previous cursors """
+    query = {'user_id': 'u1'}
+    first = fetch_page(transactions, query, 3)
+    assert [t['item_name'] for t in first.items] == ['item 6', 'item 5', 'item 4']
+    assert first.prev_cursor is None and 'note' not in first.items[0]
+
+    second = fetch_page(transactions, query, 3, after=first.next_cursor)
+    assert [t['item_name'] for t in second.items] == ['item 3', 'item 2', 'item 1']
+    last = fetch_page(transactions, query, 3, after=second.next_cursor)
+    assert [t['item_name'] for t in last.items] == ['item 0']
+    assert last.next_cursor is None
+
+    back = fetch_page(transactions, query, 3, before=last.prev_cursor)
+    assert back.items == second.items
+    assert fetch_page(transactions, query, 3, before=back.prev_cursor) == first
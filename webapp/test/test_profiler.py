@@ -0,0 +1,61 @@
+import pstats
+from flask import Flask, Response
+from profiler import RequestProfiler
+
+def make_app(profiler):
+    app = Flask(__name__)
+    profiler.init_app(app)
+
+    @app.route('/summary')
+    def summary():
+        return str(sum(range(1000)))
+
+    @app.route('/stream')
+    def stream():
+        return Response(str(n) for n in range(3))
+
+    @app.route('/other')
+    def other():
+        return 'other'
+    return app
+
+def profiles(directory):
+    return sorted(path.name for path in directory.iterdir()) if directory.exists() else []
+
+def test_sampled_request_dumps_pstats_file(tmp_path):
+    """ Test that a sampled request writes a loadable pstats file tagged with endpoint and user """
+    profiler = RequestProfiler(str(tmp_path), ['summary'], sample_rate=0.5, rng=lambda: 0.1, user_id=lambda: 'u1')
+    make_app(profiler).test_client().get('/summary')
+    [name] = profiles(tmp_path)
+    assert name.startswith('summary-u1-') and name.endswith('.prof')
+    assert pstats.Stats(str(tmp_path / name)).total_calls > 0
+
+def test_unsampled_and_other_endpoints_are_not_profiled(tmp_path):
+    """ Test the sample rate and the endpoint allow-list """
+    profiler = RequestProfiler(str(tmp_path), ['summary'], sample_rate=0.5, rng=lambda: 0.9)
+    client = make_app(profiler).test_client()
+    client.get('/summary')
+    profiler.rng = lambda: 0.0
+    client.get('/other')
+    assert profiles(tmp_path) == []
+
+def test_header_only_honoured_for_admins(tmp_path):
+    """ Test that X-Profile forces a profile for admins and is ignored otherwise """
+    admin = [False]
+    profiler = RequestProfiler(str(tmp_path), ['summary'], is_admin=lambda: admin[0])
+    client = make_app(profiler).test_client()
+    response = client.get('/summary', headers={'X-Profile': '1'})
+    assert 'X-Profile-File' not in response.headers and profiles(tmp_path) == []
+    admin[0] = True
+    response = client.get('/summary', headers={'X-Profile': '1'})
+    assert profiles(tmp_path) == [response.headers['X-Profile-File']]
+    assert response.headers['X-Profile-File'].startswith('summary-anonymous-')
+
+def test_streamed_response_is_profiled_until_closed(tmp_path):
+    """ Test that a streamed response is dumped after its body is produced """
+    profiler = RequestProfiler(str(tmp_path), ['stream'], sample_rate=1.0)
+    response = make_app(profiler).test_client().get('/stream')
+    assert response.get_data(as_text=True) == '012'
+    response.close()
+    assert len(profiles(tmp_path)) == 1
+    assert profiler.profiled == 1
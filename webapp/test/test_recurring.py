@@ -0,0 +1,93 @@
+import pytest
+import threading
+from mongomock import MongoClient
+from datetime import datetime
+from recurring import RecurringScheduler, SchedulerLease, add_months, due_occurrences, materialize_due, new_template
+
+@pytest.fixture
+def db():
+    return MongoClient().db
+
+def template(db, frequency, start, interval=1, end=None):
+    doc = new_template('u1', 'Rent', '900', 'Housing', start, frequency, interval, end)
+    doc['_id'] = db.recurring.insert_one(doc).inserted_id
+    return doc
+
+def test_new_template_validation():
+    """ Test that bad frequencies, intervals and dates are rejected """
+    for args in (('hourly', 1, None), ('daily', 0, None), ('monthly', 1, '2023-12-31')):
+        with pytest.raises(ValueError):
+            new_template('u1', 'Rent', '900', 'Housing', '2024-01-01', *args)
+    assert new_template('u1', 'Rent', '900.50', 'Housing', '2024-01-31', 'monthly')['amount_cents'] == 90050
+
+def test_monthly_occurrences_keep_the_anchor_day():
+    """ Test month-end clamping without drifting off the 31st """
+    assert add_months(datetime(2024, 1, 31), 1, 31) == datetime(2024, 2, 29)
+    rule = {'frequency': 'monthly', 'interval': 1, 'start': datetime(2024, 1, 31), 'next_due': datetime(2024, 1, 31)}
+    dates, next_due = due_occurrences(rule, datetime(2024, 4, 30))
+    assert dates == [datetime(2024, 1, 31), datetime(2024, 2, 29), datetime(2024, 3, 31), datetime(2024, 4, 30)]
+    assert next_due == datetime(2024, 5, 31)
+
+def test_due_occurrences_stop_at_end():
+    """ Test that a finished template has no next due date """
+    rule = {'frequency': 'weekly', 'interval': 2, 'start': datetime(2024, 1, 1), 'next_due': datetime(2024, 1, 1),
+            'end': datetime(2024, 1, 20)}
+    assert due_occurrences(rule, datetime(2024, 6, 1)) == ([datetime(2024, 1, 1), datetime(2024, 1, 15)], None)
+
+def test_materialize_catches_up_once(db):
+    """ Test catch-up after downtime, idempotent re-runs and the inserted callback """
+    template(db, 'monthly', '2024-01-15')
+    template(db, 'daily', '2024-03-01', interval=3)
+    reported = []
+    inserted = materialize_due(db.recurring, db.transactions, now=datetime(2024, 3, 10), batch_size=2,
+                               on_inserted=lambda user_id, docs: reported.extend(docs))
+    assert inserted == 2 + 4
+    assert db.transactions.count_documents({}) == 6 and len(reported) == 6
+    assert all('_id' in doc and doc['amount_cents'] == 90000 for doc in reported)
+
+    assert materialize_due(db.recurring, db.transactions, now=datetime(2024, 3, 10)) == 0
+    db.recurring.update_one({'frequency': 'monthly'}, {'$set': {'next_due': datetime(2024, 1, 15)}})
+    assert materialize_due(db.recurring, db.transactions, now=datetime(2024, 3, 10)) == 0
+    assert db.transactions.count_documents({}) == 6
+    assert db.recurring.find_one({'frequency': 'monthly'})['next_due'] == datetime(2024, 3, 15)
+
+def test_scheduler_runs_until_stopped():
+    """ Test that the scheduler thread runs its job and survives errors """
+    calls = []
+    ran_twice = threading.Event()
+    def job():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError('transient')
+        ran_twice.set()
+    scheduler = RecurringScheduler(job, interval=0.01)
+    scheduler.start()
+    assert ran_twice.wait(2)
+    scheduler.stop(timeout=2)
+    count = len(calls)
+    assert scheduler._thread is None and len(calls) == count
+
+def test_lease_is_held_by_one_process_until_it_expires_or_is_released(db):
+    """ Test that a second holder is refused until the lease expires or is released """
+    now = [1000.0]
+    first, second = (SchedulerLease(db.locks, ttl=60, clock=lambda: now[0]) for _ in range(2))
+    assert first.acquire() and not second.acquire()
+    now[0] += 30
+    assert first.acquire() and not second.acquire()  # renewed until 1090
+    now[0] += 61
+    assert second.acquire() and not first.acquire()
+    second.release()
+    assert first.acquire()
+
+def test_scheduler_only_runs_while_holding_the_lease(db):
+    """ Test that a scheduler whose lease is held elsewhere doesn't run, and runs once it is free """
+    ran = threading.Event()
+    other = SchedulerLease(db.locks, ttl=60)
+    assert other.acquire()
+    scheduler = RecurringScheduler(ran.set, interval=0.01, lease=SchedulerLease(db.locks, ttl=60))
+    scheduler.start()
+    assert not ran.wait(0.1)
+    other.release()
+    assert ran.wait(2)
+    scheduler.stop(timeout=2)
+    assert db.locks.count_documents({}) == 0
@@ -0,0 +1,64 @@
+import pytest
+from mongomock import MongoClient
+from datetime import datetime
+from rollups import bucket_keys, apply_change, apply_inserts, read_summary, rebuild_rollups
+
+@pytest.fixture
+def db():
+    return MongoClient().db
+
+def test_bucket_keys_match_mongo_week_numbering():
+    """ Days before the first Sunday of the year fall in week 0 like $week """
+    assert bucket_keys('2023-01-01')['week'] == {'year': 2023, 'week': 1}
+    assert bucket_keys(datetime(2022, 1, 1))['week'] == {'year': 2022, 'week': 0}
+    assert bucket_keys('2023-02-15')['month'] == {'year': 2023, 'month': 2}
+
+def test_apply_change_insert_edit_delete(db):
+    """ Test that rollups follow an insert, an edit and a delete """
+    coffee = {'amount': 4.5, 'date': '2023-01-10', 'category': 'Dining'}
+    apply_change(db.spending_rollups, 'u1', new=coffee)
+    apply_change(db.spending_rollups, 'u1', new={'amount': 10.0, 'date': '2023-02-01'})
+    summary = read_summary(db.spending_rollups, 'u1')
+    assert summary['yearly_spending'] == [{'_id': {'year': 2023}, 'total': 14.5}]
+    assert [row['_id'] for row in summary['monthly_spending']] == [{'year': 2023, 'month': 2}, {'year': 2023, 'month': 1}]
+
+    apply_change(db.spending_rollups, 'u1', old=coffee, new={'amount': 5.0, 'date': '2024-01-10'})
+    summary = read_summary(db.spending_rollups, 'u1')
+    assert summary['yearly_spending'] == [{'_id': {'year': 2024}, 'total': 5.0}, {'_id': {'year': 2023}, 'total': 10.0}]
+
+    apply_change(db.spending_rollups, 'u1', old={'amount': 5.0, 'date': '2024-01-10'})
+    summary = read_summary(db.spending_rollups, 'u1')
+    assert summary['yearly_spending'] == [{'_id': {'year': 2023}, 'total': 10.0}]
+    assert read_summary(db.spending_rollups, 'u2')['weekly_spending'] == []
+
+def test_rebuild_matches_incremental(db):
+    """ Test that a rebuild from raw transactions gives the same totals as incremental updates """
+    rows = [
+        {'user_id': 'u1', 'amount': 200.0, 'date': '2023-01-01'},
+        {'user_id': 'u1', 'amount': 150.0, 'date': datetime(2023, 1, 7)},
+        {'user_id': 'u2', 'amount': 300.0, 'date': '2023-02-01'},
+    ]
+    db.transactions.insert_many([dict(row) for row in rows])
+    for row in rows:
+        apply_change(db.incremental, row['user_id'], new=row)
+
+    assert rebuild_rollups(db.transactions, db.spending_rollups) == 6
+    for user_id in ('u1', 'u2'):
+        assert read_summary(db.spending_rollups, user_id) == read_summary(db.incremental, user_id)
+
+    db.transactions.delete_many({'user_id': 'u2'})
+    rebuild_rollups(db.transactions, db.spending_rollups, user_id='u2')
+    assert read_summary(db.spending_rollups, 'u2')['yearly_spending'] == []
+    assert read_summary(db.spending_rollups, 'u1')['yearly_spending'] == [{'_id': {'year': 2023}, 'total': 350.0}]
+
+def test_apply_inserts_matches_single_changes(db):
+    """ Test that a batch insert updates rollups like one change per transaction """
+    rows = [
+        {'amount_cents': 250, 'date': '2023-01-10'},
+        {'amount_cents': 1000, 'date': '2023-01-11'},
+        {'amount_cents': 99, 'date': '2024-06-01'},
+    ]
+    apply_inserts(db.spending_rollups, 'u1', rows)
+    for row in rows:
+        apply_change(db.incremental, 'u1', new=row)
+    assert read_summary(db.spending_rollups, 'u1') == read_summary(db.incremental, 'u1')
@@ -0,0 +1,45 @@
+import pytest
+from datetime import datetime
+from schema import to_cents, amount_cents, search_terms, transaction_fields, date_range, to_view
+
+def test_to_cents_rounds_half_up_without_float_drift():
+    """ Test conversion of form strings and legacy floats to integer cents """
+    assert to_cents('2.50') == 250
+    assert to_cents(0.1 + 0.2) == 30
+    assert to_cents('19.995') == 2000
+    with pytest.raises(ValueError):
+        to_cents('abc')
+
+def test_to_cents_rejects_amounts_beyond_64_bit_cents():
+    """ Test that amounts BSON can't store as an int64 are invalid values """
+    assert to_cents('92233720368547758.07') == 2 ** 63 - 1
+    for value in ('1e20', '-1e20', 'Infinity', 'NaN'):
+        with pytest.raises(ValueError):
+            to_cents(value)
+
+def test_amount_cents_reads_both_formats():
+    """ Test reading the amount of typed and legacy documents """
+    assert amount_cents({'amount_cents': 450}) == 450
+    assert amount_cents({'amount': 4.5}) == 450
+
+def test_transaction_fields_are_typed():
+    """ Test the fields written by the add and edit routes """
+    fields = transaction_fields('Coffee', '2.50', 'Dining', '2023-01-10')
+    assert fields == {'item_name': 'Coffee', 'search_terms': ['coffee'], 'amount_cents': 250, 'category': 'Dining', 'date': datetime(2023, 1, 10)}
+
+def test_search_terms_are_distinct_lowercase_words():
+    """ Test the words stored for item name search """
+    assert search_terms("Joe's Coffee & coffee-beans") == ['joe', 's', 'coffee', 'beans']
+    assert search_terms(None) == []
+
+def test_date_range_matches_dates_and_strings():
+    """ Test that the range filter has one branch per storage format """
+    branches = date_range(datetime(2023, 1, 1), datetime(2023, 2, 1))['$or']
+    assert branches[0]['date'] == {'$gte': datetime(2023, 1, 1), '$lt': datetime(2023, 2, 1)}
+    assert branches[1]['date'] == {'$gte': '2023-01-01', '$lt': '2023-02-01'}
+
+def test_to_view_formats_for_templates():
+    """ Test the template view of typed and legacy documents """
+    assert to_view({'amount_cents': 250, 'date': datetime(2023, 1, 10)}) == {'amount_cents': 250, 'amount': 2.5, 'date': '2023-01-10'}
+    assert to_view({'amount': 4.5, 'date': '2023-01-10'}) == {'amount': 4.5, 'date': '2023-01-10'}
+    assert to_view(None) is None
@@ -0,0 +1,142 @@
+import json
+from datetime import datetime
+from types import SimpleNamespace
+import mongomock
+import pytest
+from bson import ObjectId
+from bench.storage_bench import ENGINES, main
+from schema import transaction_fields
+from storage import MongoRepository, SqliteRepository
+
+# Every test below runs against each engine: the conformance suite
+
+@pytest.fixture(params=ENGINES)
+def repository(request):
+    repository = MongoRepository(mongomock.MongoClient().db) if request.param == 'mongo' else SqliteRepository()
+    yield repository
+    repository.close()
+
+def add(repository, user_id, item_name, amount, category, date):
+    return repository.add_transactions([dict(transaction_fields(item_name, amount, category, date), user_id=user_id)])[0]
+
+def test_users_are_found_by_name_and_id(repository):
+    """ Test adding a user and looking them up """
+    user_id = repository.add_user('alice', 'hash-1')
+    user = repository.find_user('alice')
+    assert str(user['_id']) == user_id and user['password'] == 'hash-1'
+    assert repository.get_user(user_id)['username'] == 'alice'
+    assert repository.find_user('bob') is None
+    assert repository.get_user(str(ObjectId())) is None
+
+def test_set_password_only_replaces_the_expected_hash(repository):
+    """ Test the compare-and-set used when a login rehashes a password """
+    user_id = repository.add_user('alice', 'hash-1')
+    assert not repository.set_password(user_id, 'hash-2', expected='stale')
+    assert repository.set_password(user_id, 'hash-2', expected='hash-1')
+    assert repository.set_password(user_id, 'hash-3')
+    assert repository.find_user('alice')['password'] == 'hash-3'
+
+def test_transaction_round_trip(repository):
+    """ Test that a stored transaction comes back in the typed format """
+    doc = add(repository, 'u1', 'Coffee', '3.50', 'Food', '2024-03-04')
+    assert repository.get_transaction('u1', doc['_id']) == {
+        '_id': doc['_id'], 'user_id': 'u1', 'item_name': 'Coffee', 'category': 'Food',
+        'amount_cents': 350, 'date': datetime(2024, 3, 4)}
+    assert repository.get_transaction('u1', str(doc['_id']))['item_name'] == 'Coffee'
+    assert repository.get_transaction('u2', doc['_id']) is None
+
+def test_update_returns_the_previous_version(repository):
+    """ Test editing a transaction and scoping edits to its owner """
+    doc = add(repository, 'u1', 'Coffee', '3.50', 'Food', '2024-03-04')
+    assert repository.update_transaction('u2', doc['_id'], {'category': 'Other'}) is None
+    old = repository.update_transaction('u1', doc['_id'], transaction_fields('Tea', '2', 'Drinks', '2024-03-05'))
+    assert (old['item_name'], old['amount_cents']) == ('Coffee', 350)
+    new = repository.get_transaction('u1', doc['_id'])
+    assert (new['item_name'], new['category'], new['amount_cents'], new['date']) == ('Tea', 'Drinks', 200, datetime(2024, 3, 5))
+
+def test_delete_returns_the_deleted_transaction(repository):
+    """ Test deleting a transaction once, by its owner only """
+    doc = add(repository, 'u1', 'Coffee', '3.50', 'Food', '2024-03-04')
+    assert repository.delete_transaction('u2', doc['_id']) is None
+    assert repository.delete_transaction('u1', doc['_id'])['item_name'] == 'Coffee'
+    assert repository.delete_transaction('u1', doc['_id']) is None
+    assert repository.get_transaction('u1', doc['_id']) is None
+
+def test_batch_update_writes_only_the_owners_merged_fields(repository):
+    """ Test a batch edit: the merge sees the owner's documents and its result is written """
+    mine = add(repository, 'u1', 'Coffee', '3.50', 'Food', '2024-03-04')
+    theirs = add(repository, 'u2', 'Tea', '2', 'Drinks', '2024-03-04')
+    seen = []
+    def merge(existing):
+        seen.extend(existing)
+        return {_id: transaction_fields('Latte', '4', 'Food', '2024-03-06') for _id in existing}
+    changes = repository.update_transactions('u1', [mine['_id'], theirs['_id']], merge)
+    assert seen == [mine['_id']]
+    assert [(old['amount_cents'], new['amount_cents']) for old, new in changes] == [(350, 400)]
+    assert repository.get_transaction('u1', mine['_id'])['item_name'] == 'Latte'
+    assert repository.get_transaction('u2', theirs['_id'])['item_name'] == 'Tea'
+
+def test_batch_update_writes_nothing_when_the_merge_fails(repository):
+    """ Test that a failed merge leaves every document as it was, and editable again """
+    doc = add(repository, 'u1', 'Coffee', '3.50', 'Food', '2024-03-04')
+    def merge(existing):
+        raise ValueError('bad amount')
+    with pytest.raises(ValueError):
+        repository.update_transactions('u1', [doc['_id']], merge)
+    assert repository.get_transaction('u1', doc['_id'])['amount_cents'] == 350
+    assert repository.update_transaction('u1', doc['_id'], {'category': 'Other'}) is not None
+
+def test_batch_delete_returns_the_deleted_transactions(repository):
+    """ Test deleting several transactions at once, by their owner only """
+    first = add(repository, 'u1', 'Coffee', '3.50', 'Food', '2024-03-04')
+    second = add(repository, 'u1', 'Tea', '2', 'Drinks', '2024-03-05')
+    theirs = add(repository, 'u2', 'Cake', '4', 'Food', '2024-03-05')
+    deleted = repository.delete_transactions('u1', [first['_id'], second['_id'], theirs['_id']])
+    assert sorted(t['item_name'] for t in deleted) == ['Coffee', 'Tea']
+    assert repository.delete_transactions('u1', [first['_id']]) == []
+    assert repository.get_transaction('u2', theirs['_id']) is not None
+
+class CountingCollection:
+    """Wraps a collection and counts the calls made on it."""
+
+    def __init__(self, collection):
+        self.collection, self.calls = collection, []
+
+    def __getattr__(self, name):
+        self.calls.append(name)
+        return getattr(self.collection, name)
+
+def test_mongo_batches_take_the_same_round_trips_for_any_size():
+    """ Test that batch edits and deletes don't make one call per id """
+    db = mongomock.MongoClient().db
+    transactions = CountingCollection(db.transactions)
+    repository = MongoRepository(SimpleNamespace(users=db.users, transactions=transactions))
+    ids = [add(repository, 'u1', f'Item {n}', '1', 'Food', '2024-03-04')['_id'] for n in range(50)]
+    transactions.calls.clear()
+    repository.update_transactions('u1', ids, lambda existing: {_id: {'category': 'Other'} for _id in existing})
+    assert transactions.calls == ['update_many', 'find', 'bulk_write']
+    transactions.calls.clear()
+    assert len(repository.delete_transactions('u1', ids)) == 50
+    assert transactions.calls == ['update_many', 'find', 'delete_many']
+
+def test_mongo_skips_documents_claimed_by_another_batch():
+    """ Test that a claimed document is left to the batch writing it, until the claim expires """
+    db = mongomock.MongoClient().db
+    repository = MongoRepository(db)
+    doc = add(repository, 'u1', 'Coffee', '3.50', 'Food', '2024-03-04')
+    db.transactions.update_one({'_id': doc['_id']}, {'$set': {'claim': {'token': ObjectId(), 'at': datetime.now()}}})
+    assert repository.delete_transactions('u1', [doc['_id']]) == []
+    assert repository.delete_transaction('u1', doc['_id']) is None
+    assert repository.update_transaction('u1', doc['_id'], {'category': 'Other'}) is None
+    db.transactions.update_one({'_id': doc['_id']}, {'$set': {'claim.at': datetime(2024, 1, 1)}})
+    assert [t['_id'] for t in repository.delete_transactions('u1', [doc['_id']])] == [doc['_id']]
+
+def test_storage_bench_runs_every_engine(tmp_path):
+    """ Test a small in-memory run of the storage benchmark """
+    output = tmp_path / 'report.json'
+    main(['--in-memory', '--users', '2', '--transactions', '50', '--repeat', '2', '--output', str(output)])
+    report = json.loads(output.read_text())
+    assert set(report['engines']) == set(ENGINES)
+    for timings in report['engines'].values():
+        assert timings['get_transaction']['calls'] == 4
+        assert all(timing['median_ms'] >= 0 for timing in timings.values())
@@ -0,0 +1,61 @@
+import pytest
+from mongomock import MongoClient
+from datetime import datetime
+from summary import period_bounds, period_match, range_bounds, shift_years, build_pipeline, summarize
+
+@pytest.fixture
+def transactions():
+    collection = MongoClient().db.transactions
+    collection.insert_many([
+        {'user_id': 'u1', 'item_name': 'Rent', 'amount': 300.0, 'category': 'Utilities', 'date': '2023-02-01'},
+        {'user_id': 'u1', 'item_name': 'Coffee', 'amount': 4.5, 'category': 'Dining', 'date': '2023-02-10'},
+        {'user_id': 'u1', 'item_name': 'Dinner', 'amount': 40.0, 'category': 'Dining', 'date': '2023-03-01'},
+        {'user_id': 'u2', 'item_name': 'Taxi', 'amount': 20.0, 'category': 'Transport', 'date': '2023-02-05'},
+    ])
+    return collection
+
+def test_period_bounds():
+    """ Test whole-year and single-month periods, including December """
+    assert period_bounds(2023) == (datetime(2023, 1, 1), datetime(2024, 1, 1))
+    assert period_bounds(2023, 12) == (datetime(2023, 12, 1), datetime(2024, 1, 1))
+
+def test_range_bounds_custom_and_named():
+    """ Test inclusive custom ranges and the named presets """
+    today = datetime(2024, 5, 15, 13, 30)
+    assert range_bounds({'start': '2024-01-10', 'end': '2024-01-12'}, today) == \
+        (datetime(2024, 1, 10), datetime(2024, 1, 13), '2024-01-10 to 2024-01-12')
+    assert range_bounds({'range': 'last-30-days'}, today)[:2] == (datetime(2024, 4, 16), datetime(2024, 5, 16))
+    assert range_bounds({'range': 'quarter'}, today)[:2] == (datetime(2024, 4, 1), datetime(2024, 7, 1))
+    assert range_bounds({'range': 'quarter', 'year': '2023', 'quarter': '4'}, today)[:2] == (datetime(2023, 10, 1), datetime(2024, 1, 1))
+    assert range_bounds({'year': '2024'}, today) is None
+
+def test_range_bounds_rejects_bad_input():
+    """ Test reversed, malformed and unknown ranges """
+    today = datetime(2024, 5, 15)
+    for args in ({'start': '2024-02-01', 'end': '2024-01-01'}, {'start': '2024-02-30', 'end': '2024-03-01'},
+                 {'start': '2024-01-01'}, {'range': 'fortnight'}, {'range': 'quarter', 'quarter': '5'}):
+        with pytest.raises(ValueError):
+            range_bounds(args, today)
+
+def test_shift_years_handles_leap_day():
+    """ Test that Feb 29 maps to Feb 28 in a non-leap year """
+    assert shift_years(datetime(2024, 2, 29), -1) == datetime(2023, 2, 28)
+    assert shift_years(datetime(2024, 3, 1), -1) == datetime(2023, 3, 1)
+
+def test_build_pipeline_is_single_facet_stage():
+    """ Test that every requested view shares one $match and one $facet """
+    pipeline = build_pipeline({'user_id': 'u1'}, ('weekly', 'monthly', 'yearly', 'categories'))
+    assert [list(stage) for stage in pipeline] == [['$match'], ['$facet']]
+    assert set(pipeline[1]['$facet']) == {'weekly', 'monthly', 'yearly', 'categories'}
+
+def test_summarize_period_categories(transactions):
+    """ Test the category totals of a period """
+    start, end = period_bounds(2023, 2)
+    result = summarize(transactions, period_match('u1', start, end), facets=('categories',))
+    assert result['categories'] == [{'_id': 'Utilities', 'total': 300.0, 'count': 1}, {'_id': 'Dining', 'total': 4.5, 'count': 1}]
+
+def test_summarize_empty_period(transactions):
+    """ Test a period without transactions """
+    start, end = period_bounds(2020)
+    result = summarize(transactions, period_match('u1', start, end), facets=('categories',))
+    assert result == {'categories': []}
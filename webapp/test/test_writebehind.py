@@ -0,0 +1,85 @@
+import pytest
+import threading
+import time
+from writebehind import WriteBehindQueue
+
+class Recorder:
+    """ Write function that keeps every batch it was given """
+    def __init__(self, delay=0, fail=False):
+        self.batches = []
+        self.delay = delay
+        self.fail = fail
+
+    def __call__(self, docs):
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError('write failed')
+        self.batches.append([doc['n'] for doc in docs])
+
+def docs(user_id, *numbers):
+    return [{'user_id': user_id, 'n': n} for n in numbers]
+
+def test_batches_flush_on_size_and_delay():
+    """ Test that a full batch is written at once and a partial one after the delay """
+    write = Recorder()
+    queue = WriteBehindQueue(write, max_batch=3, max_delay=60)
+    queue.submit(docs('u1', 1, 2) + docs('u2', 3), wait=True, timeout=5)
+    ticket = queue.submit(docs('u1', 4, 5, 6, 7), wait=False)
+    for _ in range(500):
+        if len(write.batches) == 2:
+            break
+        time.sleep(0.01)
+    assert write.batches == [[1, 2, 3], [4, 5, 6]] and not ticket.done()
+    queue.close(timeout=5)
+    assert write.batches[-1] == [7] and ticket.done()
+
+    write = Recorder()
+    queue = WriteBehindQueue(write, max_batch=100, max_delay=0.01)
+    queue.submit(docs('u1', 1), wait=False).result(timeout=5)
+    assert write.batches == [[1]]
+    queue.close(timeout=5)
+
+def test_sync_gives_read_your_writes():
+    """ Test that sync writes a user's queued documents immediately """
+    write = Recorder()
+    queue = WriteBehindQueue(write, max_batch=100, max_delay=60)
+    submitted = docs('u1', 1, 2)
+    queue.submit(submitted, wait=False)
+    assert [doc['n'] for doc in queue.pending('u1')] == [1, 2] and all('_id' in doc for doc in submitted)
+    assert queue.sync('u1', timeout=5)
+    assert write.batches == [[1, 2]] and queue.pending('u1') == []
+    assert queue.sync('u2', timeout=0)
+    queue.close(timeout=5)
+
+def test_close_writes_what_is_left():
+    """ Test a clean flush on shutdown """
+    write = Recorder()
+    queue = WriteBehindQueue(write, max_batch=100, max_delay=60)
+    queue.submit(docs('u1', 1), wait=False)
+    queue.submit(docs('u2', 2), wait=False)
+    queue.close(timeout=5)
+    assert write.batches == [[1, 2]]
+    with pytest.raises(RuntimeError):
+        queue.submit(docs('u1', 3))
+
+def test_acknowledged_writes_report_errors():
+    """ Test that a failed batch reaches waiting submitters and clears the pending documents """
+    queue = WriteBehindQueue(Recorder(fail=True), max_batch=10, max_delay=0.01)
+    with pytest.raises(RuntimeError, match='write failed'):
+        queue.submit(docs('u1', 1), timeout=5)
+    assert queue.pending('u1') == []
+    queue.close(timeout=5)
+
+def test_concurrent_submitters_share_batches():
+    """ Test that acknowledged submits from many threads are coalesced into few inserts """
+    write = Recorder(delay=0.02)
+    queue = WriteBehindQueue(write, max_batch=50, max_delay=0.01)
+    threads = [threading.Thread(target=queue.submit, args=(docs(f'u{n % 3}', n),), kwargs={'timeout': 10})
+               for n in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert sorted(n for batch in write.batches for n in batch) == list(range(40))
+    assert len(write.batches) < 40
+    queue.close(timeout=5)
@@ -0,0 +1,152 @@
+"""Write-behind batching of transaction inserts.
+
+With ``WRITE_BEHIND`` on, the add-transaction routes hand new documents to a
+``WriteBehindQueue`` instead of inserting them one by one. A background
+thread collects them and writes each batch with a single ``insert_many``
+once ``max_batch`` documents are waiting or the oldest has waited
+``max_delay`` seconds, so a burst of adds costs one round trip per batch.
+
+``submit`` either waits until its documents are written (``ack``: errors
+reach the caller and concurrent requests share a round trip) or returns at
+once (``async``: fire-and-forget, a failed batch is only logged).
+Documents get their ``_id`` on submit and are listed by ``pending`` until
+written; ``sync`` writes a user's queued documents immediately and waits
+for them, which the app calls before serving that user's reads so they
+always see their own writes. That only holds within one process, which is
+why the app runs ``async`` with a single worker only. ``close`` writes
+whatever is left on shutdown.
+Submitters block while ``max_pending`` documents are already queued.
+"""
+import logging
+import threading
+import time
+from bson.objectid import ObjectId
+
+logger = logging.getLogger(__name__)
+
+
+class Ticket:
+    """Completion of one submit: ``result()`` waits for the write and re-raises its error."""
+
+    def __init__(self, count):
+        self._done = threading.Event()
+        self._remaining = count
+        self.error = None
+
+    def finish(self, count, error=None):
+        """Mark ``count`` documents written (called with the queue's lock held)."""
+        self.error = self.error or error
+        self._remaining -= count
+        if self._remaining <= 0:
+            self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError('Queued transactions were not written in time')
+        if self.error is not None:
+            raise self.error
+
+
+class WriteBehindQueue:
+    def __init__(self, write, max_batch=100, max_delay=0.05, max_pending=10000):
+        """``write(docs)`` inserts one batch (any users mixed) and updates what derives from it."""
+        self.write = write
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self._cond = threading.Condition()
+        self._buffer = []  # (doc, ticket) waiting for the flusher
+        self._oldest = None  # when the first buffered document arrived
+        self._pending = {}  # user_id -> {_id: document} submitted and not yet written
+        self._urgent = set()  # users whose documents should be written now
+        self._closed = False
+        self._thread = None
+
+    def submit(self, docs, wait=True, timeout=None):
+        """Queue documents (each with a ``user_id``); returns their ticket."""
+        ticket = Ticket(len(docs))
+        if not docs:
+            ticket.finish(0)
+            return ticket
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('The write queue is closed')
+            while len(self._buffer) >= self.max_pending:
+                self._cond.wait()
+            self._start()
+            if not self._buffer:
+                self._oldest = time.monotonic()
+            for doc in docs:
+                doc.setdefault('_id', ObjectId())
+                self._buffer.append((doc, ticket))
+                self._pending.setdefault(doc['user_id'], {})[doc['_id']] = doc
+            self._cond.notify_all()
+        if wait:
+            ticket.result(timeout)
+        return ticket
+
+    def pending(self, user_id):
+        """The user's documents that are queued or being written."""
+        with self._cond:
+            return list(self._pending.get(user_id, {}).values())
+
+    def sync(self, user_id, timeout=None):
+        """Write the user's queued documents now and wait until they are; returns False on timeout."""
+        with self._cond:
+            if user_id not in self._pending:
+                return True
+            self._urgent.add(user_id)
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: user_id not in self._pending, timeout)
+
+    def close(self, timeout=None):
+        """Write everything still queued and stop the flusher."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='write-behind', daemon=True)
+            self._thread.start()
+
+    def _due(self):
+        return (self._closed or self._urgent or len(self._buffer) >= self.max_batch
+                or time.monotonic() - self._oldest >= self.max_delay)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._buffer or not self._due():
+                    if not self._buffer and self._closed:
+                        return
+                    waited = time.monotonic() - self._oldest if self._buffer else None
+                    self._cond.wait(None if waited is None else self.max_delay - waited)
+                batch = self._buffer[:self.max_batch]
+                del self._buffer[:self.max_batch]
+                self._oldest = time.monotonic() if self._buffer else None
+                self._cond.notify_all()  # room for blocked submitters
+            error = None
+            try:
+                self.write([doc for doc, _ in batch])
+            except Exception as exc:
+                logger.exception('Writing %d queued transactions failed', len(batch))
+                error = exc
+            with self._cond:
+                written = {}
+                for doc, ticket in batch:
+                    docs = self._pending.get(doc['user_id'], {})
+                    docs.pop(doc['_id'], None)
+                    if not docs:
+                        self._pending.pop(doc['user_id'], None)
+                        self._urgent.discard(doc['user_id'])
+                    written[ticket] = written.get(ticket, 0) + 1
+                for ticket, count in written.items():
+                    ticket.finish(count, error)
+                self._cond.notify_all()